@@ -0,0 +1,845 @@
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+# Load the reference implementation under a unique name so it does not clash
+# with the canonical solutions of other scenarios in the same test session.
+_spec = importlib.util.spec_from_file_location(
+    "api_key_manager_canonical",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "canonical_solution.py"))
+canonical = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = canonical
+_spec.loader.exec_module(canonical)
+
+
+class TestHashedAPIKeyManager(unittest.TestCase):
+    """Test suite for the hashed-at-rest key store."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.manager = canonical.HashedAPIKeyManager()
+
+    def test_raw_key_not_stored(self):
+        """Test that the raw key never appears in the store."""
+        key = self.manager.generate_key({'user_id': 'user1'})
+
+        self.assertTrue(self.manager.validate_key(key))
+        for index, (digest, key_id, _) in self.manager.keys.items():
+            self.assertNotIn(key.encode(), (index, digest))
+            self.assertNotEqual(key_id, key)
+
+    def test_display_ids(self):
+        """Test that listings return prefix plus short key ID."""
+        key = self.manager.generate_key({'user_id': 'user2'})
+        key_id = key[:3 + canonical.HashedAPIKeyManager.KEY_ID_LENGTH]
+
+        self.assertEqual(self.manager.get_all_keys(), [key_id])
+        self.assertEqual(self.manager.list_user_keys('user2'), [key_id])
+        self.assertEqual(self.manager.list_user_keys('user3'), [])
+
+    def test_metadata_and_revoke(self):
+        """Test metadata lookup and revocation through the digest."""
+        key = self.manager.generate_key({'user_id': 'user4', 'count': 1})
+
+        self.assertEqual(self.manager.get_metadata(key), {'user_id': 'user4', 'count': 1})
+        self.assertIsNone(self.manager.get_metadata(key[:-1] + 'x'))
+        self.assertTrue(self.manager.revoke_key(key))
+        self.assertFalse(self.manager.revoke_key(key))
+        self.assertFalse(self.manager.validate_key(key))
+
+    def test_secret_determines_digest(self):
+        """Test that managers with different secrets do not share digests."""
+        other = canonical.HashedAPIKeyManager(secret=b'other secret')
+        self.assertNotEqual(self.manager._digest('sk_abc'), other._digest('sk_abc'))
+
+
+class TestBulkOperations(unittest.TestCase):
+    """Test suite for bulk key generation and revocation."""
+
+    def test_generate_keys(self):
+        """Test bulk-generated keys are unique, well formed and share metadata."""
+        for manager in (canonical.APIKeyManager(), canonical.HashedAPIKeyManager()):
+            keys = manager.generate_keys(50, {'user_id': 'bulk'})
+
+            self.assertEqual(len(set(keys)), 50)
+            self.assertTrue(all(len(key) == 35 and key.startswith('sk_') for key in keys))
+            self.assertTrue(all(manager.validate_key(key) for key in keys))
+            self.assertIs(manager._get(manager._ref(keys[0])), manager._get(manager._ref(keys[-1])))
+            self.assertEqual(manager.get_metadata(keys[0]), {'user_id': 'bulk'})
+
+    def test_shared_metadata_is_isolated(self):
+        """Test that the shared metadata is read back as a private dict."""
+        manager = canonical.APIKeyManager()
+        metadata = {'user_id': 'bulk'}
+        first, second = manager.generate_keys(2, metadata)
+        metadata['user_id'] = 'changed'
+
+        retrieved = manager.get_metadata(first)
+        self.assertIs(type(retrieved), dict)
+        retrieved['user_id'] = 'other'
+        self.assertEqual(manager.get_metadata(first)['user_id'], 'bulk')
+        self.assertEqual(manager.get_metadata(second)['user_id'], 'bulk')
+
+    def test_shared_nested_metadata_is_isolated(self):
+        """Test that nested values of a batch cannot be changed through one key."""
+        for manager in (canonical.APIKeyManager(), canonical.HashedAPIKeyManager()):
+            first, second = manager.generate_keys(2, {'user_id': 'bulk', 'permissions': ['read']})
+
+            manager.get_metadata(first)['permissions'].append('admin')
+            page, _ = manager.page_keys(with_metadata=True)
+            page[0][1]['permissions'].append('admin')
+            self.assertEqual(manager.get_metadata(first)['permissions'], ['read'])
+            self.assertEqual(manager.get_metadata(second)['permissions'], ['read'])
+
+    def test_revoke_keys(self):
+        """Test revoking an iterable of keys, including unknown ones."""
+        for manager in (canonical.APIKeyManager(), canonical.HashedAPIKeyManager()):
+            keys = manager.generate_keys(5, {'user_id': 'u1'})
+
+            self.assertEqual(manager.revoke_keys(keys[:3] + ['sk_unknown']), 3)
+            self.assertEqual(len(manager.get_all_keys()), 2)
+
+    def test_revoke_user(self):
+        """Test revoking all keys of one user leaves other users intact."""
+        for manager in (canonical.APIKeyManager(), canonical.HashedAPIKeyManager()):
+            manager.generate_keys(3, {'user_id': 'u1'})
+            manager.generate_key({'user_id': 'u1'})
+            kept = manager.generate_key({'user_id': 'u2'})
+
+            self.assertEqual(manager.revoke_user('u1'), 4)
+            self.assertEqual(manager.list_user_keys('u1'), [])
+            self.assertTrue(manager.validate_key(kept))
+            self.assertEqual(manager.revoke_user('u1'), 0)
+
+    def test_revoke_user_counts_live_keys(self):
+        """Test that expired keys awaiting the reaper are removed but not counted."""
+        clock = FakeClock()
+        for manager in (canonical.APIKeyManager(clock=clock),
+                        canonical.HashedAPIKeyManager(clock=clock)):
+            manager.generate_keys(2, {'user_id': 'u1'}, ttl=10)
+            manager.generate_key({'user_id': 'u1'})
+            clock.now += 20
+
+            self.assertEqual(manager.revoke_user('u1'), 1)
+            self.assertEqual(manager.get_all_keys(), [])
+            self.assertEqual(len(manager.keys), 0)
+
+
+class FakeClock:
+    """Manually advanced time source."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestValidationCache(unittest.TestCase):
+    """Test suite for the validation front cache."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.clock = FakeClock()
+        self.cache = canonical.ValidationCache(ttl=10, max_negative=3, clock=self.clock)
+
+    def test_positive_hits_and_ttl(self):
+        """Test that valid keys are served from cache until their TTL expires."""
+        for manager in (canonical.APIKeyManager(cache=self.cache),
+                        canonical.HashedAPIKeyManager(cache=self.cache)):
+            self.cache.clear()
+            key = manager.generate_key({'user_id': 'u1'})
+            manager.validate_key(key)
+            self.assertTrue(manager.validate_key(key))
+            self.assertEqual(len(self.cache.positive), 1)
+
+            self.clock.now += 11
+            self.assertEqual(self.cache.lookup(next(iter(self.cache.positive))), None)
+
+    def test_spray_rejected_from_negative_cache(self):
+        """Test that repeated invalid keys skip the backing store."""
+        manager = canonical.APIKeyManager(cache=self.cache)
+        manager.keys = LookupCountingDict()
+        for _ in range(5):
+            self.assertFalse(manager.validate_key('sk_sprayed'))
+
+        self.assertEqual(manager.keys.lookups, 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats['negative_hits'], 4)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 0.8)
+
+    def test_negative_cache_bounded(self):
+        """Test that negative entries are evicted in LRU order."""
+        manager = canonical.APIKeyManager(cache=self.cache)
+        for i in range(10):
+            manager.validate_key(f'sk_bad{i}')
+
+        self.assertEqual(list(self.cache.negative), ['sk_bad7', 'sk_bad8', 'sk_bad9'])
+
+    def test_revocation_invalidates_immediately(self):
+        """Test that revoked keys are rejected even while cached."""
+        for manager in (canonical.APIKeyManager(cache=self.cache),
+                        canonical.HashedAPIKeyManager(cache=self.cache)):
+            key = manager.generate_key({'user_id': 'u1'})
+            other = manager.generate_key({'user_id': 'u2'})
+            self.assertTrue(manager.validate_key(key))
+            self.assertTrue(manager.validate_key(other))
+
+            manager.revoke_key(key)
+            manager.revoke_user('u2')
+            self.assertFalse(manager.validate_key(key))
+            self.assertFalse(manager.validate_key(other))
+
+
+class TestMmapKeyStore(unittest.TestCase):
+    """Test suite for the persistent, memory-mapped key store."""
+
+    def setUp(self):
+        """Set up a temporary store directory."""
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def open_manager(self, **kwargs):
+        """Open a manager over the store directory."""
+        store = canonical.MmapKeyStore(self.path, **kwargs)
+        self.addCleanup(store.close)
+        return canonical.APIKeyManager(store=store), store
+
+    def test_keys_survive_restart(self):
+        """Test that generated and revoked keys persist across reopen."""
+        manager, store = self.open_manager()
+        kept = manager.generate_key({'user_id': 'u1', 'permissions': ['read']})
+        revoked = manager.generate_key({'user_id': 'u1'})
+        manager.revoke_key(revoked)
+        store.close()
+
+        manager, _ = self.open_manager()
+        self.assertTrue(manager.validate_key(kept))
+        self.assertFalse(manager.validate_key(revoked))
+        self.assertEqual(manager.get_metadata(kept), {'user_id': 'u1', 'permissions': ['read']})
+        self.assertEqual(manager.list_user_keys('u1'), [kept])
+
+    def test_expiry_survives_restart_and_compaction(self):
+        """Test that TTL and rotated keys stay expired after reopening."""
+        clock = FakeClock()
+        store = canonical.MmapKeyStore(self.path)
+        manager = canonical.APIKeyManager(store=store, clock=clock)
+        forever = manager.generate_key({'user_id': 'u1'})
+        short = manager.generate_key({'user_id': 'u1'}, ttl=10)
+        old = manager.generate_key({'user_id': 'u1', 'permissions': ['read']})
+        new = manager.rotate_key(old, grace_period=5)
+        self.assertEqual(manager.get_metadata(old)['permissions'], ['read'])
+        store.compact()
+        store.close()
+
+        clock.now = 20
+        manager, store = self.open_manager()
+        manager.clock = clock
+        for key, valid in ((forever, True), (short, False), (old, False), (new, True)):
+            self.assertEqual(manager.validate_key(key), valid)
+        self.assertEqual(sorted(manager.list_user_keys('u1')), sorted([forever, new]))
+        self.assertEqual(manager.reap_expired(), 2)
+        self.assertEqual(len(store), 2)
+
+    def test_validate_does_not_decode_metadata(self):
+        """Test that validation after reopen only touches the mapped table."""
+        manager, store = self.open_manager()
+        key = manager.generate_key({'user_id': 'u1'})
+        store.close()
+
+        manager, store = self.open_manager()
+        store._read_record = None  # any metadata read would now fail
+        self.assertTrue(manager.validate_key(key))
+        self.assertFalse(manager.validate_key('sk_missing'))
+
+    def test_table_grows(self):
+        """Test that the table resizes as keys are added."""
+        manager, store = self.open_manager(initial_capacity=16)
+        keys = manager.generate_keys(200, {'user_id': 'bulk'})
+
+        self.assertGreater(store._capacity, 16)
+        self.assertEqual(len(store), 200)
+        self.assertTrue(all(manager.validate_key(key) for key in keys))
+
+    def test_compaction(self):
+        """Test that compaction drops dead records and keeps live keys."""
+        manager, store = self.open_manager()
+        keys = manager.generate_keys(100, {'user_id': 'bulk'})
+        manager.revoke_keys(keys[:90])
+        size_before = os.path.getsize(store.log_path)
+
+        store.compact()
+        self.assertLess(os.path.getsize(store.log_path), size_before)
+        self.assertEqual(sorted(manager.get_all_keys()), sorted(keys[90:]))
+        store.close()
+
+        manager, _ = self.open_manager()
+        self.assertTrue(all(manager.validate_key(key) for key in keys[90:]))
+        self.assertFalse(manager.validate_key(keys[0]))
+
+    def test_recovers_from_stale_table_and_torn_log(self):
+        """Test rebuilding the table from the log after a crash."""
+        manager, store = self.open_manager()
+        key = manager.generate_key({'user_id': 'u1'})
+        store.close()
+        with open(store.log_path, 'ab') as log:
+            log.write(b'G\x05')  # torn record header
+        os.remove(store.table_path)
+
+        manager, store = self.open_manager()
+        self.assertTrue(manager.validate_key(key))
+        self.assertEqual(os.path.getsize(store.log_path), store._log_size)
+
+
+class TestCompactMetadata(unittest.TestCase):
+    """Test suite for interned metadata storage."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.store = canonical.CompactKeyStore()
+        self.manager = canonical.APIKeyManager(store=self.store)
+
+    def test_round_trip(self):
+        """Test that metadata reads back unchanged and isolated."""
+        metadata = {
+            'user_id': 'user16',
+            'permissions': ['read', 'write'],
+            'scopes': ('a', 'b'),
+            'tags': {'environment': 'production', 'teams': ['x']},
+            'rate_limit': 1000,
+        }
+        key = self.manager.generate_key(metadata)
+
+        retrieved = self.manager.get_metadata(key)
+        self.assertEqual(retrieved, metadata)
+        retrieved['permissions'].append('delete')
+        self.assertEqual(self.manager.get_metadata(key)['permissions'], ['read', 'write'])
+        self.assertEqual(self.manager.get_metadata(self.manager.generate_key({})), {})
+
+    def test_schema_and_permissions_shared(self):
+        """Test that identical schemas and permission lists are interned."""
+        first = self.manager.generate_key({'user_id': 'u1', 'permissions': ['read']})
+        second = self.manager.generate_key({'user_id': 'u2', 'permissions': ['read']})
+
+        a, b = self.store.records[first], self.store.records[second]
+        self.assertIs(a.schema, b.schema)
+        self.assertIs(a.values[1], b.values[1])
+        self.assertEqual(a.get('user_id'), 'u1')
+        self.assertIsNone(a.get('missing'))
+
+    def test_equal_values_of_different_types_not_shared(self):
+        """Test that 1, 1.0 and True in sequences keep their own types."""
+        values = [[True, False], [1, 0], [1.0, 0.0], (True,), (1.0,), (1,),
+                  [[True], [1]], [[1], [True]], [(1.0, True)], [(1, 1)]]
+        keys = [self.manager.generate_key({'p': value}) for value in values]
+
+        for key, value in zip(keys, values):
+            stored = self.manager.get_metadata(key)['p']
+            self.assertEqual(repr(stored), repr(value))
+
+    def test_bulk_batch_shares_record(self):
+        """Test that a bulk batch is packed once."""
+        keys = self.manager.generate_keys(10, {'user_id': 'bulk', 'permissions': ['read']})
+
+        self.assertIs(self.store.records[keys[0]], self.store.records[keys[-1]])
+        self.assertEqual(self.manager.list_user_keys('bulk'), keys)
+        self.assertEqual(self.manager.revoke_user('bulk'), 10)
+
+
+class TestKeyExpiry(unittest.TestCase):
+    """Test suite for key TTLs, rotation and reaping."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.clock = FakeClock()
+        self.managers = (canonical.APIKeyManager(clock=self.clock),
+                         canonical.HashedAPIKeyManager(clock=self.clock))
+
+    def test_expired_keys_invalid_before_reaping(self):
+        """Test that expiry is enforced without waiting for the reaper."""
+        for manager in self.managers:
+            key = manager.generate_key({'user_id': 'u1'}, ttl=10)
+            forever = manager.generate_key({'user_id': 'u1'})
+            self.assertTrue(manager.validate_key(key))
+
+            self.clock.now += 10
+            self.assertFalse(manager.validate_key(key))
+            self.assertIsNone(manager.get_metadata(key))
+            self.assertEqual(len(manager.list_user_keys('u1')), 1)
+            self.assertEqual(len(manager.get_all_keys()), 1)
+            self.assertTrue(manager.validate_key(forever))
+            self.assertEqual(len(manager.keys), 2)
+
+    def test_expiry_overrides_cached_result(self):
+        """Test that a cached positive result does not outlive the key."""
+        manager = canonical.APIKeyManager(cache=canonical.ValidationCache(ttl=100),
+                                          clock=self.clock)
+        key = manager.generate_key({'user_id': 'u1'}, ttl=5)
+        self.assertTrue(manager.validate_key(key))
+
+        self.clock.now += 5
+        self.assertFalse(manager.validate_key(key))
+
+    def test_reap_in_bounded_batches(self):
+        """Test that reaping removes at most one batch per call."""
+        for manager in self.managers:
+            manager.generate_keys(25, {'user_id': 'bulk'}, ttl=1)
+            revoked = manager.generate_key({'user_id': 'bulk'}, ttl=0.5)
+            manager.revoke_key(revoked)
+            self.clock.now += 2
+
+            self.assertEqual(manager.reap_expired(max_batch=10), 9)
+            self.assertEqual(manager.reap_expired(max_batch=10), 10)
+            self.assertEqual(manager.reap_expired(max_batch=10), 6)
+            self.assertEqual(manager.reap_expired(max_batch=10), 0)
+            self.assertEqual(len(manager.keys), 0)
+            self.assertEqual(manager.expiry, {})
+
+    def test_rotate_key(self):
+        """Test that rotation overlaps old and new keys for the grace period."""
+        for manager in self.managers:
+            old = manager.generate_key({'user_id': 'u1', 'permissions': ['read']})
+            new = manager.rotate_key(old, grace_period=30)
+
+            self.assertNotEqual(old, new)
+            self.assertEqual(manager.get_metadata(new), {'user_id': 'u1', 'permissions': ['read']})
+            self.assertTrue(manager.validate_key(old))
+            self.clock.now += 30
+            self.assertFalse(manager.validate_key(old))
+            self.assertTrue(manager.validate_key(new))
+            self.assertIsNone(manager.rotate_key(old))
+
+    def test_background_reaper(self):
+        """Test that the reaper thread removes expired keys."""
+        manager = canonical.ConcurrentAPIKeyManager()
+        manager.generate_keys(50, {'user_id': 'bulk'}, ttl=0)
+        manager.start_reaper(interval=0.01, batch_size=8)
+        try:
+            deadline = time.time() + 5
+            while manager.keys and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            manager.stop_reaper()
+        self.assertEqual(len(manager.keys), 0)
+
+
+class TestConcurrentAPIKeyManager(unittest.TestCase):
+    """Test suite for the thread-safe manager and async facade."""
+
+    READERS = 64
+
+    def test_reaper_alongside_writers(self):
+        """Test that the background reaper and writer threads do not interfere."""
+        manager = canonical.ConcurrentAPIKeyManager()
+        errors, kept = [], []
+
+        def writer(n):
+            try:
+                for i in range(300):
+                    manager.generate_keys(3, {'user_id': 'short'}, ttl=0)
+                    key = manager.generate_key({'user_id': f'w{n}'})
+                    if i % 2:
+                        manager.revoke_key(key)
+                    else:
+                        kept.append(key)
+                    manager.revoke_user('nobody')
+            except Exception as exc:  # surfaced in the main thread
+                errors.append(repr(exc))
+
+        manager.start_reaper(interval=0.001, batch_size=4)
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            deadline = time.time() + 5
+            while len(manager.keys) > len(kept) and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            manager.stop_reaper()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(manager.keys), sorted(kept))
+        self.assertTrue(all(manager.validate_key(key) for key in kept))
+
+    def test_stress_readers_with_writer(self):
+        """Test 64 reader threads against a writer generating and revoking keys."""
+        manager = canonical.ConcurrentAPIKeyManager(cache=canonical.ValidationCache())
+        stable = manager.generate_keys(100, {'user_id': 'stable'})
+        stop = threading.Event()
+        errors = []
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    for key in stable[:10]:
+                        if not manager.validate_key(key):
+                            errors.append(f'stable key rejected: {key}')
+                    manager.get_metadata(stable[0])
+                    if len(manager.list_user_keys('stable')) != 100:
+                        errors.append('stable listing changed')
+                    manager.get_all_keys()
+                    time.sleep(0)  # let the writer in, as request I/O would
+            except Exception as exc:  # surfaced in the main thread
+                errors.append(repr(exc))
+
+        threads = [threading.Thread(target=reader) for _ in range(self.READERS)]
+        for thread in threads:
+            thread.start()
+        try:
+            churned = []
+            for i in range(300):
+                churned.append(manager.generate_key({'user_id': f'churn{i % 7}'}))
+                if i % 3 == 0:
+                    manager.revoke_key(churned.pop(0))
+                if i % 50 == 0:
+                    manager.revoke_user('churn1')
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        for key in churned:
+            manager.revoke_key(key)
+            self.assertFalse(manager.validate_key(key))
+
+    def test_snapshot_refreshed_after_write(self):
+        """Test that listings reflect every completed write."""
+        manager = canonical.ConcurrentAPIKeyManager()
+        key = manager.generate_key({'user_id': 'u1'})
+        self.assertEqual(manager.list_user_keys('u1'), [key])
+
+        manager.revoke_key(key)
+        self.assertEqual(manager.list_user_keys('u1'), [])
+
+    def test_revoke_keys_is_one_write(self):
+        """Test that a batch revocation bumps the snapshot version once."""
+        manager = canonical.ConcurrentAPIKeyManager()
+        keys = manager.generate_keys(10, {'user_id': 'u1'})
+        version = manager._version
+
+        self.assertEqual(manager.revoke_keys(keys), 10)
+        self.assertEqual(manager._version, version + 1)
+        self.assertEqual(manager.list_user_keys('u1'), [])
+
+    def test_async_facade(self):
+        """Test the async facade end to end."""
+        async def scenario():
+            manager = canonical.AsyncAPIKeyManager()
+            key = await manager.generate_key({'user_id': 'u1'})
+            keys = await manager.generate_keys(3, {'user_id': 'u1'})
+            self.assertTrue(await manager.validate_key(key))
+            self.assertEqual(await manager.get_metadata(key), {'user_id': 'u1'})
+            self.assertEqual(len(await manager.list_user_keys('u1')), 4)
+            self.assertEqual(await manager.revoke_keys(keys), 3)
+            self.assertTrue(await manager.revoke_key(key))
+            self.assertEqual(await manager.get_all_keys(), [])
+
+        asyncio.run(scenario())
+
+    def test_readers_and_writer_on_mmap_store(self):
+        """Test a shared MmapKeyStore under reader threads and a resizing writer."""
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        store = canonical.MmapKeyStore(path, initial_capacity=8)
+        self.addCleanup(store.close)
+        manager = canonical.ConcurrentAPIKeyManager(store=store)
+        stable = manager.generate_keys(20, {'user_id': 'stable'})
+        stop = threading.Event()
+        errors = []
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    for key in stable:
+                        if manager.get_metadata(key) != {'user_id': 'stable'}:
+                            errors.append(f'stable key lost: {key}')
+                        time.sleep(0)  # let the writer in, as request I/O would
+            except Exception as exc:  # surfaced in the main thread
+                errors.append(repr(exc))
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        try:
+            kept = [manager.generate_key({'user_id': 'w'}) for _ in range(500)]
+            manager.revoke_keys(kept[::2])
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(store), 20 + 250)
+        self.assertTrue(all(manager.validate_key(key) for key in kept[1::2]))
+
+    def test_async_store_reads_leave_the_loop(self):
+        """Test that point reads against a KeyStore run in the executor."""
+        threads = []
+
+        class RecordingStore(canonical.LocalKeyStore):
+            def __contains__(self, key):
+                threads.append(threading.current_thread())
+                return super().__contains__(key)
+
+            def __getitem__(self, key):
+                threads.append(threading.current_thread())
+                return super().__getitem__(key)
+
+        async def scenario():
+            inner = canonical.ConcurrentAPIKeyManager(store=RecordingStore(latency=0.001))
+            manager = canonical.AsyncAPIKeyManager(inner)
+            key = await manager.generate_key({'user_id': 'u1'})
+            threads.clear()
+            self.assertTrue(await manager.validate_key(key))
+            self.assertEqual(await manager.get_metadata(key), {'user_id': 'u1'})
+
+        asyncio.run(scenario())
+        self.assertTrue(threads)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class TestShardedKeyStore(unittest.TestCase):
+    """Test suite for consistent-hash sharding over local backends."""
+
+    def make_store(self, nodes=4, replication=1, latency=0.0):
+        """Build a sharded store over local backends."""
+        backends = {f'node{i}': canonical.LocalKeyStore(latency) for i in range(nodes)}
+        store = canonical.ShardedKeyStore(backends, replication=replication)
+        self.addCleanup(store.close)
+        return store
+
+    def test_manager_over_shards(self):
+        """Test the manager API on top of a sharded store."""
+        store = self.make_store()
+        manager = canonical.APIKeyManager(store=store)
+        keys = manager.generate_keys(200, {'user_id': 'bulk'})
+        own = manager.generate_key({'user_id': 'u1'})
+
+        self.assertTrue(all(manager.validate_key(key) for key in keys))
+        self.assertEqual(manager.list_user_keys('u1'), [own])
+        self.assertEqual(len(store), 201)
+        self.assertTrue(all(len(backend) > 0 for backend in store.backends.values()))
+        self.assertEqual(manager.revoke_user('bulk'), 200)
+        self.assertEqual(manager.get_all_keys(), [own])
+
+    def test_replication(self):
+        """Test that each key lives on `replication` distinct backends."""
+        store = self.make_store(replication=2)
+        manager = canonical.APIKeyManager(store=store)
+        key = manager.generate_key({'user_id': 'u1'})
+
+        holders = [name for name, backend in store.backends.items() if key in backend.data]
+        self.assertEqual(len(holders), 2)
+        store.backends[holders[0]].data.clear()  # lose the primary copy
+        self.assertEqual(manager.get_metadata(key), {'user_id': 'u1'})
+        self.assertEqual(manager.list_user_keys('u1'), [key])
+
+    def test_rebalance_on_membership_change(self):
+        """Test that adding and removing backends moves only affected keys."""
+        store = self.make_store(nodes=3)
+        manager = canonical.APIKeyManager(store=store)
+        keys = manager.generate_keys(300, {'user_id': 'bulk'})
+
+        moved = store.add_backend('node3', canonical.LocalKeyStore())
+        self.assertGreater(moved, 0)
+        self.assertLess(moved, 300)
+        self.assertEqual(len(store.backends['node3']), moved)
+        self.assertEqual(sum(len(b) for b in store.backends.values()), 300)
+
+        store.remove_backend('node0')
+        self.assertEqual(sum(len(b) for b in store.backends.values()), 300)
+        self.assertTrue(all(manager.validate_key(key) for key in keys))
+
+    def test_rejects_unusable_configuration(self):
+        """Test that a store that would write nowhere cannot be built."""
+        with self.assertRaises(ValueError):
+            canonical.ShardedKeyStore({})
+        with self.assertRaises(ValueError):
+            canonical.ShardedKeyStore({'node0': canonical.LocalKeyStore()}, replication=0)
+
+    def test_add_backend_during_fan_out(self):
+        """Test that growing the pool does not break concurrent queries."""
+        store = self.make_store(nodes=2, latency=0.001)
+        errors = []
+        stop = threading.Event()
+
+        def query():
+            while not stop.is_set():
+                try:
+                    store.keys_for_user('u1')
+                except RuntimeError as error:
+                    errors.append(error)
+
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(2, 8):
+            store.add_backend(f'node{i}', canonical.LocalKeyStore())
+            time.sleep(0.005)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_fan_out_runs_in_parallel(self):
+        """Test that per-user queries hit all shards concurrently."""
+        store = self.make_store(nodes=8, latency=0.05)
+        start = time.perf_counter()
+        store.keys_for_user('u1')
+        self.assertLess(time.perf_counter() - start, 0.05 * 8 / 2)
+
+
+class TestPagination(unittest.TestCase):
+    """Test suite for cursor pagination and streaming enumeration."""
+
+    def test_pages_cover_all_keys(self):
+        """Test that paging returns every key exactly once, in order."""
+        for manager in (canonical.APIKeyManager(), canonical.HashedAPIKeyManager()):
+            manager.generate_keys(25, {'user_id': 'bulk'})
+            pages, cursor = [], None
+            while True:
+                page, cursor = manager.page_keys(cursor, limit=10)
+                pages.append(page)
+                if cursor is None:
+                    break
+
+            self.assertEqual([len(page) for page in pages], [10, 10, 5])
+            self.assertEqual(sum(pages, []), manager.get_all_keys())
+
+    def test_cursor_stable_under_concurrent_changes(self):
+        """Test that inserts and revokes between pages neither repeat nor skip keys."""
+        manager = canonical.APIKeyManager()
+        keys = manager.generate_keys(30, {'user_id': 'bulk'})
+        first, cursor = manager.page_keys(limit=10)
+
+        manager.revoke_keys(keys[:5] + keys[12:14])
+        added = manager.generate_keys(3, {'user_id': 'late'})
+        rest = []
+        while cursor is not None:
+            page, cursor = manager.page_keys(cursor, limit=10)
+            rest.extend(page)
+
+        self.assertEqual(first, keys[:10])
+        self.assertEqual(rest, keys[10:12] + keys[14:] + added)
+
+    def test_order_index_compacts(self):
+        """Test that revoked keys are dropped from the order index."""
+        manager = canonical.APIKeyManager()
+        keys = manager.generate_keys(3000, {'user_id': 'bulk'})
+        manager.page_keys(limit=1)
+        manager.revoke_keys(keys[:2000])
+
+        self.assertLess(len(manager._order[0]), 3000)
+        self.assertEqual(sum(manager.iter_keys(chunk_size=500), []), keys[2000:])
+
+    def test_iter_keys_filters(self):
+        """Test chunked iteration with user filter, metadata and expiry."""
+        clock = FakeClock()
+        manager = canonical.APIKeyManager(clock=clock)
+        mine = manager.generate_keys(5, {'user_id': 'u1'})
+        manager.generate_keys(5, {'user_id': 'u2'})
+        manager.generate_key({'user_id': 'u1'}, ttl=1)
+        clock.now += 1
+
+        chunks = list(manager.iter_keys(chunk_size=2, user_id='u1', with_metadata=True))
+        self.assertTrue(all(len(chunk) <= 2 for chunk in chunks))
+        self.assertEqual([key for chunk in chunks for key, _ in chunk], mine)
+        self.assertEqual(chunks[0][0][1], {'user_id': 'u1'})
+
+    def test_export_keys(self):
+        """Test streaming an export as JSON lines."""
+        manager = canonical.APIKeyManager(store=canonical.CompactKeyStore())
+        keys = manager.generate_keys(7, {'user_id': 'bulk', 'permissions': ['read']})
+        out = io.StringIO()
+
+        self.assertEqual(manager.export_keys(out, chunk_size=3), 7)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['key'] for row in rows], keys)
+        self.assertEqual(rows[0]['metadata'], {'user_id': 'bulk', 'permissions': ['read']})
+
+    def test_order_index_released_after_enumeration(self):
+        """Test that a finished enumeration drops the order index and its cursors."""
+        manager = canonical.APIKeyManager()
+        keys = manager.generate_keys(25, {'user_id': 'bulk'})
+        first, stale = manager.page_keys(limit=10)
+        self.assertEqual(sum(manager.iter_keys(chunk_size=10), []), keys)
+
+        self.assertIsNone(manager._order)
+        with self.assertRaises(ValueError):
+            manager.page_keys(stale, limit=10)
+        self.assertEqual(manager.page_keys(limit=10)[0], first)
+
+    def open_mmap_manager(self):
+        """Open a manager over a temporary MmapKeyStore."""
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        store = canonical.MmapKeyStore(path)
+        self.addCleanup(store.close)
+        return canonical.APIKeyManager(store=store), store
+
+    def test_mmap_store_pages_through_log(self):
+        """Test paging an MmapKeyStore across expiry changes and a compaction."""
+        manager, store = self.open_mmap_manager()
+        keys = manager.generate_keys(30, {'user_id': 'bulk'})
+        first, cursor = manager.page_keys(limit=10)
+
+        store.set_expiry(keys[20], 1e12)
+        manager.revoke_keys(keys[:5] + keys[12:14])
+        store.compact()
+        added = manager.generate_keys(3, {'user_id': 'late'})
+        rest = []
+        while cursor is not None:
+            page, cursor = manager.page_keys(cursor, limit=10)
+            rest.extend(page)
+
+        self.assertEqual(first, keys[:10])
+        self.assertEqual(rest, keys[10:12] + keys[14:] + added)
+        self.assertIsNone(manager._order)
+
+    def test_mmap_export_memory_is_flat(self):
+        """Test that exporting from an MmapKeyStore holds one chunk at a time."""
+        class Discard:
+            def writelines(self, lines):
+                for _ in lines:
+                    pass
+
+        peaks = []
+        for n in (1000, 4000):
+            manager, _ = self.open_mmap_manager()
+            manager.generate_keys(n, {'user_id': 'bulk', 'permissions': ['read']})
+            tracemalloc.start()
+            try:
+                self.assertEqual(manager.export_keys(Discard(), chunk_size=100), n)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            self.assertIsNone(manager._order)
+
+        self.assertLess(peaks[1], peaks[0] * 1.5)
+
+
+class LookupCountingDict(dict):
+    """Dict that counts membership tests, standing in for a remote store."""
+
+    lookups = 0
+
+    def __contains__(self, key):
+        self.lookups += 1
+        return super().__contains__(key)
+
+
+if __name__ == '__main__':
+    unittest.main()
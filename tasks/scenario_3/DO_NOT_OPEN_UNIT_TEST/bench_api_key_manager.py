@@ -0,0 +1,300 @@
+"""
+Benchmark suite for the API key manager reference implementation.
+
+Usage:
+    python bench_api_key_manager.py [--backends dict,hashed,...] [--sizes 1000000,10000000]
+                                    [--fanouts 1,100] [--lookups N] [--no-memory]
+                                    [--profile cprofile|pyinstrument] [--json PATH]
+
+For every backend and store size it measures:
+  - generate_key / generate_keys throughput (plus the raw entropy cost)
+  - validate_key latency for hits and misses (mean, p50, p99)
+  - list_user_keys latency for users owning `fanout` keys each
+  - Python heap retained per key once the store is built, and the peak
+    while building it
+
+After the table, two comparisons are printed for every size where the
+backends involved were run: the validation latency added by hashing keys
+(hashed minus dict, hit and miss), and bytes per key for the dict versus
+the compact metadata layout.
+
+The default sizes match the store sizes we plan for and take a long
+time; pass e.g. --sizes 10000,100000 for a quick run.
+
+Results are printed as a table and, with --json, written as flat records
+({backend, size, benchmark, ...metrics}) so runs against different
+backends can be compared directly.
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import platform
+import pstats
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List
+
+from canonical_solution import (
+    APIKeyManager, CompactKeyStore, ConcurrentAPIKeyManager, HashedAPIKeyManager,
+    LocalKeyStore, MmapKeyStore, ShardedKeyStore,
+)
+
+PERMISSION_SETS = (['read'], ['read', 'write'], ['read', 'write', 'delete'])
+
+BACKENDS: Dict[str, Callable[[str], APIKeyManager]] = {
+    'dict': lambda path: APIKeyManager(),
+    'compact': lambda path: APIKeyManager(store=CompactKeyStore()),
+    'hashed': lambda path: HashedAPIKeyManager(),
+    'concurrent': lambda path: ConcurrentAPIKeyManager(),
+    'mmap': lambda path: APIKeyManager(store=MmapKeyStore(path)),
+    'sharded': lambda path: APIKeyManager(store=ShardedKeyStore(
+        {f'node{i}': LocalKeyStore() for i in range(4)})),
+}
+
+
+def metadata_for(i: int, fanout: int) -> Dict[str, Any]:
+    """Build realistic metadata for the i-th key; each user owns `fanout` keys."""
+    user_id = f"user{i // fanout}"
+    return {
+        'user_id': user_id,
+        'email': f"{user_id}@example.com",
+        'permissions': list(PERMISSION_SETS[i % len(PERMISSION_SETS)]),
+        'rate_limit': 1000,
+    }
+
+
+def percentiles(samples: List[int]) -> Dict[str, float]:
+    """Summarize nanosecond samples as microsecond mean/p50/p99."""
+    samples = sorted(samples)
+    return {
+        'mean_us': sum(samples) / len(samples) / 1000,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000,
+    }
+
+
+def time_calls(func: Callable[[Any], Any], args: List[Any]) -> Dict[str, float]:
+    """Time one call per argument and summarize the latencies."""
+    clock = time.perf_counter_ns
+    samples = []
+    for arg in args:
+        start = clock()
+        func(arg)
+        samples.append(clock() - start)
+    return percentiles(samples)
+
+
+@contextlib.contextmanager
+def profiled(kind: str, label: str) -> Iterator[None]:
+    """Profile the enclosed block with cProfile or pyinstrument, if requested."""
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(12)
+            print(f"--- cProfile: {label} ---\n{out.getvalue()}", file=sys.stderr)
+    elif kind == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise SystemExit("pyinstrument is not installed (pip install pyinstrument)")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            print(f"--- pyinstrument: {label} ---", file=sys.stderr)
+            print(profiler.output_text(unicode=True), file=sys.stderr)
+    else:
+        yield
+
+
+def bench_entropy(count: int) -> Dict[str, Any]:
+    """Compare per-key entropy reads with one batched read."""
+    start = time.perf_counter()
+    for _ in range(count):
+        secrets.token_hex(16)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    secrets.token_bytes(16 * count).hex()
+    batched = time.perf_counter() - start
+    return {'backend': '-', 'size': count, 'benchmark': 'entropy',
+            'per_key_ops': count / single, 'batched_ops': count / batched}
+
+
+def bench_backend(name: str, size: int, fanouts: List[int], lookups: int,
+                  memory: bool, profile: str) -> List[Dict[str, Any]]:
+    """Run every benchmark for one backend and store size."""
+    results = []
+    base = {'backend': name, 'size': size}
+    cleanups: List[Callable[[], None]] = []
+
+    def fresh() -> APIKeyManager:
+        path = tempfile.mkdtemp(prefix='bench-keys-')
+        cleanups.append(lambda: shutil.rmtree(path, ignore_errors=True))
+        manager = BACKENDS[name](path)
+        cleanups.append(lambda: close(manager))
+        return manager
+
+    try:
+        # Throughput: one key at a time, then in bulk
+        manager = fresh()
+        rows = [metadata_for(i, fanouts[0]) for i in range(size)]
+        with profiled(profile, f"{name} generate_key x{size}"):
+            start = time.perf_counter()
+            keys = [manager.generate_key(row) for row in rows]
+            elapsed = time.perf_counter() - start
+        results.append({**base, 'benchmark': 'generate_key', 'ops_per_sec': size / elapsed})
+
+        bulk = fresh()
+        start = time.perf_counter()
+        bulk.generate_keys(size, rows[0])
+        elapsed = time.perf_counter() - start
+        results.append({**base, 'benchmark': 'generate_keys', 'ops_per_sec': size / elapsed})
+
+        # Validation latency for hits and misses
+        hits = [secrets.choice(keys) for _ in range(lookups)]
+        misses = [f"sk_{secrets.token_hex(16)}" for _ in range(lookups)]
+        with profiled(profile, f"{name} validate_key x{2 * lookups}"):
+            results.append({**base, 'benchmark': 'validate_hit',
+                            **time_calls(manager.validate_key, hits)})
+            results.append({**base, 'benchmark': 'validate_miss',
+                            **time_calls(manager.validate_key, misses)})
+
+        # Per-user listing at each fan-out
+        for fanout in fanouts:
+            if fanout != fanouts[0]:
+                manager = fresh()
+                for i in range(size):
+                    manager.generate_key(metadata_for(i, fanout))
+            users = [f"user{secrets.randbelow(max(1, size // fanout))}" for _ in range(20)]
+            with profiled(profile, f"{name} list_user_keys fanout={fanout}"):
+                results.append({**base, 'benchmark': 'list_user_keys', 'fanout': fanout,
+                                **time_calls(manager.list_user_keys, users)})
+
+        # Python heap held by the built store, and the peak while building it
+        if memory:
+            del manager, bulk, keys
+            tracemalloc.start()
+            traced = fresh()
+            for i in range(size):
+                traced.generate_key(metadata_for(i, fanouts[0]))
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append({**base, 'benchmark': 'memory', 'bytes_per_key': retained / size,
+                            'peak_mib_per_million': peak / 2 ** 20 * 1_000_000 / size})
+    finally:
+        for cleanup in reversed(cleanups):
+            cleanup()
+    return results
+
+
+def close(manager: APIKeyManager) -> None:
+    """Release any resources held by a manager's store."""
+    store_close = getattr(manager.keys, 'close', None)
+    if store_close is not None:
+        store_close()
+
+
+def compare(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Derive the hashed-vs-dict latency and dict-vs-compact memory comparisons."""
+    by_key = {(row['backend'], row['size'], row['benchmark']): row for row in results}
+    comparisons = []
+    for size in sorted({row['size'] for row in results if row['backend'] != '-'}):
+        plain_hit = by_key.get(('dict', size, 'validate_hit'))
+        hashed_hit = by_key.get(('hashed', size, 'validate_hit'))
+        if plain_hit is not None and hashed_hit is not None:
+            plain_miss = by_key[('dict', size, 'validate_miss')]
+            hashed_miss = by_key[('hashed', size, 'validate_miss')]
+            comparisons.append({
+                'backend': 'hashed', 'size': size, 'benchmark': 'vs_dict_validate',
+                'hit_added_us': hashed_hit['mean_us'] - plain_hit['mean_us'],
+                'miss_added_us': hashed_miss['mean_us'] - plain_miss['mean_us'],
+            })
+        plain_memory = by_key.get(('dict', size, 'memory'))
+        compact_memory = by_key.get(('compact', size, 'memory'))
+        if plain_memory is not None and compact_memory is not None:
+            comparisons.append({
+                'backend': 'compact', 'size': size, 'benchmark': 'vs_dict_memory',
+                'dict_bytes_per_key': plain_memory['bytes_per_key'],
+                'compact_bytes_per_key': compact_memory['bytes_per_key'],
+                'saved_pct': 100 * (1 - compact_memory['bytes_per_key']
+                                    / plain_memory['bytes_per_key']),
+            })
+    return comparisons
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    """Print results one line per record."""
+    for row in results:
+        label = f"{row['backend']:>10} {row['size']:>9} {row['benchmark']:<15}"
+        metrics = ", ".join(f"{key}={value:,}" if isinstance(value, int) else f"{key}={value:,.2f}"
+                            for key, value in row.items()
+                            if key not in ('backend', 'size', 'benchmark'))
+        print(f"{label} {metrics}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backends', default='dict,compact,hashed',
+                        help=f"comma-separated subset of {','.join(BACKENDS)}")
+    parser.add_argument('--sizes', default='1000000,10000000',
+                        help='comma-separated store sizes')
+    parser.add_argument('--fanouts', default='1,100',
+                        help='comma-separated keys per user for list_user_keys')
+    parser.add_argument('--lookups', type=int, default=20_000,
+                        help='validate_key calls per hit/miss measurement')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the peak memory measurement')
+    parser.add_argument('--profile', choices=('cprofile', 'pyinstrument'),
+                        help='profile the generate, validate and list phases')
+    parser.add_argument('--json', help='write results to this file as JSON')
+    args = parser.parse_args()
+
+    backends = args.backends.split(',')
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+    fanouts = [int(fanout) for fanout in args.fanouts.split(',')]
+
+    results = [bench_entropy(max(sizes))]
+    for size in sizes:
+        for name in backends:
+            results.extend(bench_backend(name, size, fanouts, args.lookups,
+                                         args.memory, args.profile))
+    print_table(results)
+    comparisons = compare(results)
+    if comparisons:
+        print()
+        print_table(comparisons)
+    results.extend(comparisons)
+
+    if args.json:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'args': vars(args),
+            },
+            'results': results,
+        }
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
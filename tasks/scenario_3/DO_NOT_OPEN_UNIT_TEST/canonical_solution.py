@@ -1,41 +1,1276 @@
+import asyncio
+import bisect
+import copy
+import functools
+import hashlib
+import heapq
+import hmac
+import json
+import mmap
+import os
 import secrets
-from typing import Dict, Any, List, Optional
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Executor, ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Callable, Dict, Any, Hashable, IO, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+
+class ValidationCache:
+    """
+    Front cache for key validation results.
+
+    Valid keys are cached with a TTL. Rejected keys go into a bounded LRU so
+    repeated sprays of random keys are answered without touching the backing
+    store. An LRU is used rather than a Bloom filter because entries must be
+    removable: a false "known invalid" answer would reject a real key.
+
+    The cache may be shared by reader threads; its counters are approximate
+    under contention.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 100_000,
+                 negative_ttl: float = 60.0, max_negative: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the validation cache.
+
+        Args:
+            ttl: Seconds a positive (valid) entry stays cached
+            max_entries: Maximum number of positive entries
+            negative_ttl: Seconds a negative (invalid) entry stays cached
+            max_negative: Maximum number of negative entries
+            clock: Time source, in seconds
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.max_negative = max_negative
+        self.clock = clock
+        self.positive: OrderedDict = OrderedDict()
+        self.negative: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        # Bumped by every invalidation so late results can be discarded
+        self.generation = 0
+
+    def lookup(self, key: Hashable) -> Optional[bool]:
+        """
+        Look up a cached validation result.
+
+        Args:
+            key: Cache key for the API key
+
+        Returns:
+            True or False if a fresh entry exists, None on a cache miss
+        """
+        for entries, result in ((self.positive, True), (self.negative, False)):
+            expires_at = entries.get(key)
+            if expires_at is None:
+                continue
+            if expires_at <= self.clock():
+                entries.pop(key, None)
+                break
+            try:
+                entries.move_to_end(key)
+            except KeyError:  # invalidated by another thread
+                pass
+            if result:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    def record(self, key: Hashable, valid: bool, generation: Optional[int] = None) -> None:
+        """
+        Cache the result of a backing-store lookup.
+
+        Args:
+            key: Cache key for the API key
+            valid: Whether the backing store knew the key
+            generation: Value of `generation` read before the store lookup;
+                        the result is dropped if an invalidation happened since
+        """
+        if generation is not None and generation != self.generation:
+            return
+        if valid:
+            entries, ttl, limit = self.positive, self.ttl, self.max_entries
+            self.negative.pop(key, None)
+        else:
+            entries, ttl, limit = self.negative, self.negative_ttl, self.max_negative
+            self.positive.pop(key, None)
+        entries[key] = self.clock() + ttl
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            try:
+                entries.popitem(last=False)
+            except KeyError:  # emptied by another thread
+                break
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Drop any cached result for a key (on revocation or creation).
+
+        Args:
+            key: Cache key for the API key
+        """
+        self.generation += 1
+        self.positive.pop(key, None)
+        self.negative.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop all cached entries."""
+        self.positive.clear()
+        self.negative.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with hits, negative_hits (sprayed keys rejected without
+            a store lookup), misses and the overall hit_rate
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+class KeyStore(MutableMapping):
+    """
+    Base class for pluggable APIKeyManager storage.
+
+    A store maps API key strings to metadata mappings. Subclasses implement
+    the MutableMapping methods and may override keys_for_user with something
+    cheaper than a full scan. A plain dict is used when no store is given.
+    """
+
+    def keys_for_user(self, user_id: str) -> List[str]:
+        """
+        List the keys whose metadata has a matching 'user_id'.
+
+        Args:
+            user_id: The user ID to search for
+
+        Returns:
+            List of API key strings
+        """
+        return [api_key for api_key, metadata in self.items()
+                if metadata.get('user_id') == user_id]
+
+    def set_expiry(self, key: str, expires_at: float) -> None:
+        """
+        Record when a stored key expires.
+
+        Persistent stores must keep this so expiring and rotated keys do not
+        come back after a restart; in-memory stores can ignore it, since the
+        manager tracks expiry itself.
+
+        Args:
+            key: A stored API key
+            expires_at: Expiry time, on the manager's clock
+        """
+
+    def expiries(self) -> Iterator[Tuple[str, float]]:
+        """Yield (key, expires_at) for every stored key that expires."""
+        return iter(())
+
+    def scan(self, cursor: Optional[str] = None,
+             limit: int = 1000) -> Optional[Tuple[List[Tuple[str, Dict[str, Any]]], Optional[str]]]:
+        """
+        Page through stored keys in a stable order, if the store has one.
+
+        Stores that can resume an enumeration from their own layout override
+        this, and the manager pages through them without an index of its own.
+
+        Args:
+            cursor: Cursor from the previous page, or None to start
+            limit: Maximum number of stored keys to read
+
+        Returns:
+            ([(key, metadata)], next cursor or None at the end), or None if
+            the store has no resumable order
+        """
+        return None
+
+
+class MmapKeyStore(KeyStore):
+    """
+    Persistent key store backed by an append-only event log.
+
+    Every generate/revoke is appended to ``keys.log``. Lookups go through an
+    open-addressing hash table in ``keys.idx`` that is memory-mapped, so a
+    freshly started process can validate keys without reading the log, and
+    metadata is only decoded when a value is requested. Keys must be strings
+    and metadata must be JSON-serializable.
+
+    The table header records how much of the log it covers; on open, any
+    log tail written after that point is replayed, and a missing or stale
+    table is rebuilt from the log.
+
+    Generate records carry increasing sequence numbers and stay in that
+    order through compaction, so scan() pages through the log itself.
+    Setting an expiry appends a small record and updates the key's table
+    slot in place, which leaves the key's position unchanged; slots hold
+    the time, so expiries() can list them without reading the log.
+
+    Reads seek the shared log handle and writes may remap the table, so
+    every operation holds an internal lock; the store can be shared between
+    threads, but lookups from different threads do not run in parallel.
+    """
+
+    LOG_MAGIC = b'AKL2'
+    TABLE_MAGIC = b'AKX3'
+    LOG_HEADER = struct.Struct('<4s8s')          # magic, generation
+    RECORD_HEADER = struct.Struct('<cHIQ')       # op, key length, body length, sequence
+    EXPIRES = struct.Struct('<d')                # body of OP_EXPIRY records
+    TABLE_HEADER = struct.Struct('<4s8sQQQQQQ')  # magic, log generation, capacity, count,
+                                                 # used slots, log size, dead bytes, next sequence
+    SLOT = struct.Struct('<16sQQd')              # fingerprint, record offset, record length,
+                                                 # expires_at (NEVER if it does not expire)
+    OP_GENERATE = b'G'
+    OP_EXPIRY = b'E'
+    OP_REVOKE = b'R'
+    EMPTY = 0
+    TOMBSTONE = 2 ** 64 - 1
+    NEVER = float('inf')
+    MAX_LOAD = 0.7
+    COMPACT_MIN_BYTES = 1 << 20
+
+    def __init__(self, path: str, initial_capacity: int = 1024,
+                 compact_ratio: float = 0.5, sync: bool = False):
+        """
+        Open (or create) a key store in a directory.
+
+        Args:
+            path: Directory holding the log and table files
+            initial_capacity: Slot count for a new table (rounded to a power of two)
+            compact_ratio: Compact once this fraction of the log is dead records
+            sync: fsync the log after every write
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.sync = sync
+        self.log_path = os.path.join(path, 'keys.log')
+        self.table_path = os.path.join(path, 'keys.idx')
+        self._table: Optional[mmap.mmap] = None
+        self._lock = threading.RLock()
+        self._open_log()
+        self._open_table(initial_capacity)
+
+    # File management
+
+    def _open_log(self) -> None:
+        """Open the event log, creating it with a fresh generation if needed."""
+        if not os.path.exists(self.log_path):
+            with open(self.log_path, 'wb') as log:
+                log.write(self.LOG_HEADER.pack(self.LOG_MAGIC, secrets.token_bytes(8)))
+        self._log = open(self.log_path, 'r+b')
+        magic, self._generation = self.LOG_HEADER.unpack(self._log.read(self.LOG_HEADER.size))
+        if magic != self.LOG_MAGIC:
+            raise ValueError(f"{self.log_path} is not an API key log")
+        self._log_end = os.fstat(self._log.fileno()).st_size
+
+    def _open_table(self, initial_capacity: int) -> None:
+        """Map the hash table, rebuilding or catching it up from the log."""
+        header = None
+        if os.path.exists(self.table_path):
+            with open(self.table_path, 'rb') as table:
+                header = table.read(self.TABLE_HEADER.size)
+
+        if header is not None and len(header) == self.TABLE_HEADER.size:
+            magic, generation, capacity, _, _, log_size, _, _ = self.TABLE_HEADER.unpack(header)
+            if (magic == self.TABLE_MAGIC and generation == self._generation
+                    and log_size <= self._log_end):
+                self._map_table()
+                self._replay(self._log_size)
+                return
+
+        self._reset_table(initial_capacity)
+        self._next_seq = 0
+        self._replay(self.LOG_HEADER.size)
+
+    def _map_table(self) -> None:
+        """Memory-map the table file and load its header."""
+        with open(self.table_path, 'r+b') as table:
+            self._table = mmap.mmap(table.fileno(), 0)
+        (_, _, self._capacity, self._count, self._used,
+         self._log_size, self._dead, self._next_seq) = self.TABLE_HEADER.unpack_from(self._table, 0)
+
+    def _reset_table(self, capacity: int) -> None:
+        """Replace the table file with an empty one of at least `capacity` slots."""
+        next_seq = getattr(self, '_next_seq', 0)
+        if self._table is not None:
+            self._table.close()
+        capacity = 1 << max(4, (capacity - 1).bit_length())
+        tmp_path = self.table_path + '.tmp'
+        with open(tmp_path, 'wb') as table:
+            table.write(self.TABLE_HEADER.pack(self.TABLE_MAGIC, self._generation, capacity,
+                                               0, 0, self.LOG_HEADER.size, 0, next_seq))
+            table.truncate(self.TABLE_HEADER.size + capacity * self.SLOT.size)
+        os.replace(tmp_path, self.table_path)
+        self._map_table()
+
+    def _write_header(self) -> None:
+        """Persist the in-memory table counters to the mapped header."""
+        self.TABLE_HEADER.pack_into(self._table, 0, self.TABLE_MAGIC, self._generation,
+                                    self._capacity, self._count, self._used,
+                                    self._log_size, self._dead, self._next_seq)
+
+    def _replay(self, offset: int) -> None:
+        """Apply log records from `offset` to the end of the log to the table."""
+        self._log.seek(offset)
+        while offset < self._log_end:
+            header = self._log.read(self.RECORD_HEADER.size)
+            if len(header) < self.RECORD_HEADER.size:
+                break
+            op, key_length, body_length, seq = self.RECORD_HEADER.unpack(header)
+            length = self.RECORD_HEADER.size + key_length + body_length
+            body = self._log.read(key_length + body_length)
+            if len(body) < key_length + body_length:
+                break
+            key = body[:key_length].decode()
+            if op == self.OP_GENERATE:
+                self._table_put(key, offset, length)
+                self._next_seq = max(self._next_seq, seq + 1)
+            elif op == self.OP_EXPIRY:
+                self._table_expire(key, self.EXPIRES.unpack_from(body, key_length)[0], length)
+            else:
+                self._table_remove(key, length)
+            offset += length
+        # Drop a torn record left by a crash mid-append
+        if offset < self._log_end:
+            self._log.truncate(offset)
+            self._log_end = offset
+        self._log_size = offset
+        self._write_header()
+
+    # Hash table
+
+    @staticmethod
+    def _fingerprint(key: str) -> bytes:
+        """Return the 16-byte table fingerprint of a key."""
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+    def _probe(self, fingerprint: bytes) -> Tuple[int, bool]:
+        """
+        Find the slot for a fingerprint by linear probing.
+
+        Returns:
+            (slot index, found); when not found, the index is where to insert
+        """
+        mask = self._capacity - 1
+        index = int.from_bytes(fingerprint[:8], 'little') & mask
+        free = -1
+        while True:
+            slot_fp, offset, _, _ = self.SLOT.unpack_from(
+                self._table, self.TABLE_HEADER.size + index * self.SLOT.size)
+            if offset == self.EMPTY:
+                return (index if free < 0 else free), False
+            if offset == self.TOMBSTONE:
+                if free < 0:
+                    free = index
+            elif slot_fp == fingerprint:
+                return index, True
+            index = (index + 1) & mask
+
+    def _slot(self, index: int) -> Tuple[bytes, int, int, float]:
+        """Read a slot as (fingerprint, record offset, record length, expires_at)."""
+        return self.SLOT.unpack_from(self._table, self.TABLE_HEADER.size + index * self.SLOT.size)
+
+    def _set_slot(self, index: int, fingerprint: bytes, offset: int, length: int,
+                  expires_at: float = NEVER) -> None:
+        """Write a slot."""
+        self.SLOT.pack_into(self._table, self.TABLE_HEADER.size + index * self.SLOT.size,
+                            fingerprint, offset, length, expires_at)
+
+    def _live_slots(self) -> Iterator[Tuple[bytes, int, int, float]]:
+        """Yield every live slot."""
+        for index in range(self._capacity):
+            slot = self._slot(index)
+            if slot[1] != self.EMPTY and slot[1] != self.TOMBSTONE:
+                yield slot
+
+    def _expiry_length(self, key: str) -> int:
+        """Size of the expiry record for a key."""
+        return self.RECORD_HEADER.size + len(key.encode()) + self.EXPIRES.size
+
+    def _superseded(self, key: str, slot: Tuple[bytes, int, int, float]) -> int:
+        """Log bytes that die with a key's current slot: its record and expiry record."""
+        dead = slot[2]
+        if slot[3] != self.NEVER:
+            dead += self._expiry_length(key)
+        return dead
+
+    def _table_put(self, key: str, offset: int, length: int) -> None:
+        """Point the table entry for `key` at a generate record."""
+        if self._used + 1 > self._capacity * self.MAX_LOAD:
+            self._resize(max(self._capacity, int((self._count + 1) / self.MAX_LOAD) * 2))
+        fingerprint = self._fingerprint(key)
+        index, found = self._probe(fingerprint)
+        if found:
+            self._dead += self._superseded(key, self._slot(index))
+        else:
+            self._count += 1
+            if self._slot(index)[1] == self.EMPTY:
+                self._used += 1
+        self._set_slot(index, fingerprint, offset, length)
+
+    def _table_expire(self, key: str, expires_at: float, record_length: int) -> bool:
+        """Set the expiry time in a key's slot; `record_length` is the expiry record size."""
+        index, found = self._probe(self._fingerprint(key))
+        if not found:
+            self._dead += record_length
+            return False
+        fingerprint, offset, length, previous = self._slot(index)
+        if previous != self.NEVER:
+            self._dead += record_length
+        self._set_slot(index, fingerprint, offset, length, expires_at)
+        return True
+
+    def _table_remove(self, key: str, record_length: int) -> bool:
+        """Tombstone the table entry for `key`; `record_length` is the revoke record size."""
+        index, found = self._probe(self._fingerprint(key))
+        if not found:
+            self._dead += record_length
+            return False
+        self._dead += self._superseded(key, self._slot(index)) + record_length
+        self._count -= 1
+        self._set_slot(index, b'\0' * 16, self.TOMBSTONE, 0)
+        return True
+
+    def _resize(self, capacity: int) -> None:
+        """Rebuild the table with a new capacity, dropping tombstones."""
+        live = list(self._live_slots())
+        count, log_size, dead = self._count, self._log_size, self._dead
+        self._reset_table(capacity)
+        for fingerprint, offset, length, expires_at in live:
+            index, _ = self._probe(fingerprint)
+            self._set_slot(index, fingerprint, offset, length, expires_at)
+        self._count, self._used, self._log_size, self._dead = count, count, log_size, dead
+        self._write_header()
+
+    # Log
+
+    def _append(self, op: bytes, key: str, body: bytes = b'', seq: int = 0) -> Tuple[int, int]:
+        """Append a record to the log and return (offset, length)."""
+        encoded = key.encode()
+        record = self.RECORD_HEADER.pack(op, len(encoded), len(body), seq) + encoded + body
+        offset = self._log_end
+        self._log.seek(offset)
+        self._log.write(record)
+        self._log.flush()
+        if self.sync:
+            os.fsync(self._log.fileno())
+        self._log_end += len(record)
+        return offset, len(record)
+
+    def _read_record(self, offset: int, length: int) -> Tuple[str, bytes]:
+        """Read a generate record as (key, encoded metadata)."""
+        self._log.seek(offset)
+        data = self._log.read(length)
+        key_length = self.RECORD_HEADER.unpack_from(data)[1]
+        start = self.RECORD_HEADER.size
+        return data[start:start + key_length].decode(), data[start + key_length:]
+
+    def _after_write(self) -> None:
+        """Record the covered log size and compact if enough of the log is dead."""
+        self._log_size = self._log_end
+        self._write_header()
+        if (self._log_size > self.COMPACT_MIN_BYTES
+                and self._dead > self._log_size * self.compact_ratio):
+            self._compact()
+
+    def compact(self) -> None:
+        """Rewrite the log with only live records, in order, and rebuild the table."""
+        with self._lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Compact with the lock held."""
+        generation = secrets.token_bytes(8)
+        tmp_path = self.log_path + '.tmp'
+        entries = []
+        with open(tmp_path, 'wb') as out:
+            out.write(self.LOG_HEADER.pack(self.LOG_MAGIC, generation))
+            position = self.LOG_HEADER.size
+            # Keep log order, which is scan() order
+            for fingerprint, offset, length, expires_at in sorted(self._live_slots(),
+                                                                   key=lambda slot: slot[1]):
+                self._log.seek(offset)
+                record = self._log.read(length)
+                out.write(record)
+                entries.append((fingerprint, position, length, expires_at))
+                position += length
+                if expires_at != self.NEVER:
+                    key_length = self.RECORD_HEADER.unpack_from(record)[1]
+                    key = record[self.RECORD_HEADER.size:self.RECORD_HEADER.size + key_length]
+                    out.write(self.RECORD_HEADER.pack(self.OP_EXPIRY, key_length,
+                                                      self.EXPIRES.size, 0)
+                              + key + self.EXPIRES.pack(expires_at))
+                    position += self.RECORD_HEADER.size + key_length + self.EXPIRES.size
+            out.flush()
+            os.fsync(out.fileno())
+
+        # A crash between these steps leaves a generation mismatch, which
+        # makes the next open rebuild the table from the new log.
+        self._log.close()
+        os.replace(tmp_path, self.log_path)
+        self._open_log()
+        count = len(entries)
+        self._reset_table(int(count / self.MAX_LOAD) + 1)
+        for fingerprint, offset, length, expires_at in entries:
+            index, _ = self._probe(fingerprint)
+            self._set_slot(index, fingerprint, offset, length, expires_at)
+        self._count, self._used, self._log_size, self._dead = count, count, position, 0
+        self._write_header()
+
+    def flush(self) -> None:
+        """Flush the log and the mapped table to disk."""
+        with self._lock:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._table.flush()
+
+    def close(self) -> None:
+        """Flush and close the store files."""
+        with self._lock:
+            if self._table is None:
+                return
+            self.flush()
+            self._table.close()
+            self._table = None
+            self._log.close()
+
+    def __enter__(self) -> 'MmapKeyStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # Mapping interface
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        with self._lock:
+            return self._probe(self._fingerprint(key))[1]
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        if not isinstance(key, str):
+            raise KeyError(key)
+        with self._lock:
+            index, found = self._probe(self._fingerprint(key))
+            if not found:
+                raise KeyError(key)
+            _, offset, length, _ = self._slot(index)
+            stored_key, metadata = self._read_record(offset, length)
+        if stored_key != key:
+            raise KeyError(key)
+        return json.loads(metadata)
+
+    def __setitem__(self, key: str, metadata: Mapping[str, Any]) -> None:
+        encoded = json.dumps(dict(metadata)).encode()
+        with self._lock:
+            offset, length = self._append(self.OP_GENERATE, key, encoded, self._next_seq)
+            self._next_seq += 1
+            self._table_put(key, offset, length)
+            self._after_write()
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            _, length = self._append(self.OP_REVOKE, key)
+            self._table_remove(key, length)
+            self._after_write()
+
+    def __iter__(self) -> Iterator[str]:
+        # Read every key up front: a later write may compact the log
+        with self._lock:
+            keys = [self._read_record(offset, length)[0]
+                    for _, offset, length, _ in list(self._live_slots())]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def set_expiry(self, key: str, expires_at: float) -> None:
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            _, length = self._append(self.OP_EXPIRY, key, self.EXPIRES.pack(expires_at))
+            self._table_expire(key, expires_at, length)
+            self._after_write()
+
+    def expiries(self) -> Iterator[Tuple[str, float]]:
+        with self._lock:
+            expiring = [(self._read_record(offset, length)[0], expires_at)
+                        for _, offset, length, expires_at in list(self._live_slots())
+                        if expires_at != self.NEVER]
+        return iter(expiring)
+
+    def scan(self, cursor: Optional[str] = None,
+             limit: int = 1000) -> Optional[Tuple[List[Tuple[str, Dict[str, Any]]], Optional[str]]]:
+        """
+        Page through live keys in the order they were stored, reading the log.
+
+        The cursor holds the log generation, an offset and the last sequence
+        number passed. After a compaction the offset is stale, and the new
+        log is searched for that sequence number once.
+        """
+        with self._lock:
+            if cursor is None:
+                offset, after = self.LOG_HEADER.size, -1
+            else:
+                generation, offset, after = cursor.split(':')
+                offset, after = int(offset), int(after)
+                if bytes.fromhex(generation) != self._generation:
+                    offset = self._find_seq(after)
+            page: List[Tuple[str, Dict[str, Any]]] = []
+            while offset < self._log_size and len(page) < limit:
+                self._log.seek(offset)
+                op, key_length, body_length, seq = self.RECORD_HEADER.unpack(
+                    self._log.read(self.RECORD_HEADER.size))
+                length = self.RECORD_HEADER.size + key_length + body_length
+                if op == self.OP_GENERATE and seq > after:
+                    after = seq
+                    key = self._log.read(key_length).decode()
+                    index, found = self._probe(self._fingerprint(key))
+                    # Only a key's current record is live
+                    if found and self._slot(index)[1] == offset:
+                        page.append((key, json.loads(self._log.read(body_length))))
+                offset += length
+            if offset >= self._log_size:
+                return page, None
+            return page, f"{self._generation.hex()}:{offset}:{after}"
+
+    def _find_seq(self, after: int) -> int:
+        """Offset of the first generate record with a sequence number above `after`."""
+        offset = self.LOG_HEADER.size
+        while offset < self._log_size:
+            self._log.seek(offset)
+            op, key_length, body_length, seq = self.RECORD_HEADER.unpack(
+                self._log.read(self.RECORD_HEADER.size))
+            if op == self.OP_GENERATE and seq > after:
+                break
+            offset += self.RECORD_HEADER.size + key_length + body_length
+        return offset
+
+
+class _FrozenList(tuple):
+    """Marker for a list stored as an interned tuple."""
+
+    __slots__ = ()
+
+
+class CompactMetadata:
+    """Per-key metadata record: a shared field schema plus a tuple of values."""
+
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema: Dict[str, int], values: Tuple[Any, ...]):
+        self.schema = schema
+        self.values = values
+
+    def get(self, field: str, default: Any = None) -> Any:
+        """Read one field without rebuilding the metadata dict."""
+        position = self.schema.get(field)
+        return default if position is None else self.values[position]
+
+
+class MetadataInterner:
+    """
+    Packs metadata dicts into CompactMetadata records.
+
+    Field-name schemas and list/tuple values (e.g. permission lists) are
+    interned, so keys with the same shape and permissions share them; these
+    are kept for the lifetime of the interner. String values go through
+    sys.intern, which releases them once no key references them.
+    """
+
+    def __init__(self):
+        """Initialize empty intern tables."""
+        self.schemas: Dict[Tuple[str, ...], Dict[str, int]] = {}
+        self.sequences: Dict[Tuple[type, tuple], tuple] = {}
+
+    def pack(self, metadata: Mapping[str, Any]) -> CompactMetadata:
+        """
+        Convert a metadata mapping into a compact record.
+
+        Args:
+            metadata: Metadata mapping to pack
+
+        Returns:
+            CompactMetadata sharing interned schema and sequences
+        """
+        fields = tuple(metadata)
+        schema = self.schemas.get(fields)
+        if schema is None:
+            schema = self.schemas[fields] = {field: i for i, field in enumerate(fields)}
+        return CompactMetadata(schema, tuple(self._freeze(value) for value in metadata.values()))
+
+    def _freeze(self, value: Any) -> Any:
+        """Convert a metadata value into its shared, immutable form."""
+        if isinstance(value, Mapping):
+            return self.pack(value)
+        if isinstance(value, (list, tuple)):
+            frozen = (_FrozenList if isinstance(value, list) else tuple)(
+                self._freeze(item) for item in value)
+            try:
+                return self.sequences.setdefault(self._intern_key(frozen), frozen)
+            except TypeError:
+                return frozen
+        if type(value) is str:
+            return sys.intern(value)
+        return value
+
+    @classmethod
+    def _intern_key(cls, value: Any) -> Tuple[type, Any]:
+        """
+        Lookup key for the sequence table.
+
+        Types are part of the key at every level: 1, 1.0 and True compare
+        (and hash) equal, so (1,) and (True,) must not share an entry.
+        """
+        if isinstance(value, tuple):
+            return type(value), tuple(cls._intern_key(item) for item in value)
+        return type(value), value
+
+    @classmethod
+    def unpack(cls, record: CompactMetadata) -> Dict[str, Any]:
+        """
+        Rebuild a fresh metadata dict from a compact record.
+
+        Args:
+            record: Record produced by pack()
+
+        Returns:
+            Metadata dictionary with lists restored
+        """
+        return {field: cls._thaw(value) for field, value in zip(record.schema, record.values)}
+
+    @classmethod
+    def _thaw(cls, value: Any) -> Any:
+        """Convert a stored value back into its original form."""
+        if isinstance(value, CompactMetadata):
+            return cls.unpack(value)
+        if isinstance(value, _FrozenList):
+            return [cls._thaw(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(cls._thaw(item) for item in value)
+        return value
+
+
+class CompactKeyStore(KeyStore):
+    """
+    In-memory key store that keeps metadata as interned CompactMetadata.
+
+    Reads return a freshly built dict, so callers cannot mutate stored state.
+    """
+
+    def __init__(self):
+        """Initialize an empty compact store."""
+        self.records: Dict[str, CompactMetadata] = {}
+        self.interner = MetadataInterner()
+        self._last_shared: Optional[Tuple[Mapping[str, Any], CompactMetadata]] = None
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.records
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        return MetadataInterner.unpack(self.records[key])
+
+    def __setitem__(self, key: str, metadata: Mapping[str, Any]) -> None:
+        # Bulk generation passes one read-only mapping for a whole batch;
+        # pack it once and share the record.
+        if self._last_shared is not None and self._last_shared[0] is metadata:
+            record = self._last_shared[1]
+        else:
+            record = self.interner.pack(metadata)
+            if isinstance(metadata, MappingProxyType):
+                self._last_shared = (metadata, record)
+        self.records[key] = record
+
+    def __delitem__(self, key: str) -> None:
+        del self.records[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def keys_for_user(self, user_id: str) -> List[str]:
+        # Read the field from each record without rebuilding dicts
+        return [api_key for api_key, record in list(self.records.items())
+                if record.get('user_id') == user_id]
+
+
+class LocalKeyStore(KeyStore):
+    """
+    In-process stand-in for a remote shard.
+
+    Wraps a dict and can add a fixed delay to every call, which makes
+    fan-out and rebalancing behaviour testable without a network.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Initialize an empty local store.
+
+        Args:
+            latency: Seconds to sleep per call, simulating a round trip
+        """
+        self.data: Dict[str, Mapping[str, Any]] = {}
+        self.latency = latency
+        self.calls = 0
+
+    def _round_trip(self) -> None:
+        """Account for (and optionally simulate) one request to the shard."""
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def __contains__(self, key: object) -> bool:
+        self._round_trip()
+        return key in self.data
+
+    def __getitem__(self, key: str) -> Mapping[str, Any]:
+        self._round_trip()
+        return self.data[key]
+
+    def __setitem__(self, key: str, metadata: Mapping[str, Any]) -> None:
+        self._round_trip()
+        self.data[key] = metadata
+
+    def __delitem__(self, key: str) -> None:
+        self._round_trip()
+        del self.data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        self._round_trip()
+        return iter(list(self.data))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def keys_for_user(self, user_id: str) -> List[str]:
+        self._round_trip()
+        return [api_key for api_key, metadata in list(self.data.items())
+                if metadata.get('user_id') == user_id]
+
+
+class ConsistentHashRing:
+    """Consistent-hash ring with virtual nodes."""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        """
+        Initialize the ring.
+
+        Args:
+            nodes: Initial node names
+            vnodes: Virtual nodes per node; more gives a more even spread
+        """
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(token: str) -> int:
+        """Map a token to a position on the ring."""
+        return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big')
+
+    def add_node(self, node: str) -> None:
+        """Place a node's virtual nodes on the ring."""
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = self._hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: str) -> None:
+        """Take a node's virtual nodes off the ring."""
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def nodes_for(self, token: str, count: int = 1) -> List[str]:
+        """
+        Find the nodes responsible for a token.
+
+        Args:
+            token: Routing token
+            count: Number of distinct nodes wanted (replication factor)
+
+        Returns:
+            Up to `count` distinct node names, primary first
+        """
+        count = min(count, len(self.nodes))
+        found: List[str] = []
+        index = bisect.bisect(self._points, self._hash(token))
+        for step in range(len(self._points)):
+            owner = self._owners[(index + step) % len(self._points)]
+            if owner not in found:
+                found.append(owner)
+                if len(found) == count:
+                    break
+        return found
+
+
+class ShardedKeyStore(KeyStore):
+    """
+    Key store spread over several backend stores.
+
+    Each key is routed by consistent hashing of its random part to a
+    primary backend and `replication - 1` replicas. Per-user queries fan out
+    to all backends in parallel.
+    """
+
+    def __init__(self, backends: Mapping[str, KeyStore], replication: int = 1,
+                 prefix: str = "sk_", vnodes: int = 64):
+        """
+        Initialize the sharded store.
+
+        Args:
+            backends: Backend stores by node name
+            replication: Number of backends holding each key
+            prefix: Key prefix stripped before hashing
+            vnodes: Virtual nodes per backend on the hash ring
+
+        Raises:
+            ValueError: If there are no backends or replication is below 1
+        """
+        if not backends:
+            raise ValueError("ShardedKeyStore needs at least one backend")
+        if replication < 1:
+            raise ValueError(f"replication must be at least 1, got {replication}")
+        self.backends: Dict[str, KeyStore] = dict(backends)
+        self.replication = replication
+        self.prefix = prefix
+        self.ring = ConsistentHashRing(self.backends, vnodes)
+        # Guards swapping the pool, so no fan-out submits to a closed one
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ThreadPoolExecutor:
+        """Create a fan-out pool with one worker per backend."""
+        return ThreadPoolExecutor(max_workers=max(1, len(self.backends)),
+                                  thread_name_prefix='key-shard')
+
+    def _owners(self, key: str) -> List[str]:
+        """Return the backend names owning a key, primary first."""
+        token = key[len(self.prefix):] if key.startswith(self.prefix) else key
+        return self.ring.nodes_for(token, self.replication)
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return any(key in self.backends[name] for name in self._owners(key))
+
+    def __getitem__(self, key: str) -> Mapping[str, Any]:
+        # Read from the primary, falling back to replicas
+        for name in self._owners(key):
+            try:
+                return self.backends[name][key]
+            except KeyError:
+                continue
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, metadata: Mapping[str, Any]) -> None:
+        for name in self._owners(key):
+            self.backends[name][key] = metadata
+
+    def __delitem__(self, key: str) -> None:
+        removed = False
+        for name in self._owners(key):
+            backend = self.backends[name]
+            if key in backend:
+                del backend[key]
+                removed = True
+        if not removed:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        # Replicas hold copies; count each key only on its primary
+        for name, backend in list(self.backends.items()):
+            for key in backend:
+                if self._owners(key)[0] == name:
+                    yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def set_expiry(self, key: str, expires_at: float) -> None:
+        for name in self._owners(key):
+            backend = self.backends[name]
+            if key in backend:
+                backend.set_expiry(key, expires_at)
+
+    def expiries(self) -> Iterator[Tuple[str, float]]:
+        for name, backend in list(self.backends.items()):
+            for key, expires_at in backend.expiries():
+                if self._owners(key)[0] == name:
+                    yield key, expires_at
+
+    def _fan_out(self, method: str, *args) -> List[Any]:
+        """Call a method on every backend in parallel and collect the results."""
+        with self._executor_lock:
+            futures = [self._executor.submit(getattr(backend, method), *args)
+                       for backend in list(self.backends.values())]
+        return [future.result() for future in futures]
+
+    def keys_for_user(self, user_id: str) -> List[str]:
+        seen = set()
+        user_keys = []
+        for shard_keys in self._fan_out('keys_for_user', user_id):
+            for api_key in shard_keys:
+                if api_key not in seen:
+                    seen.add(api_key)
+                    user_keys.append(api_key)
+        return user_keys
+
+    def add_backend(self, name: str, backend: KeyStore) -> int:
+        """
+        Add a backend and move the keys it now owns onto it.
+
+        Returns:
+            Number of key copies moved
+        """
+        self.backends[name] = backend
+        self.ring.add_node(name)
+        # Swap in a larger pool; tasks already queued on the old one still
+        # run, since shutdown(wait=False) only refuses new submissions.
+        with self._executor_lock:
+            old, self._executor = self._executor, self._new_executor()
+        old.shutdown(wait=False)
+        return self.rebalance()
+
+    def remove_backend(self, name: str) -> int:
+        """
+        Remove a backend, re-homing its keys on the remaining backends.
+
+        Returns:
+            Number of key copies moved
+        """
+        self.ring.remove_node(name)
+        backend = self.backends.pop(name)
+        moved = 0
+        for key in list(backend):
+            metadata = backend[key]
+            for owner in self._owners(key):
+                if key not in self.backends[owner]:
+                    self.backends[owner][key] = metadata
+                    moved += 1
+        return moved + self.rebalance()
+
+    def rebalance(self) -> int:
+        """
+        Make every key live on exactly its current owners.
+
+        Returns:
+            Number of key copies moved
+        """
+        moved = 0
+        for name, backend in list(self.backends.items()):
+            for key in list(backend):
+                owners = self._owners(key)
+                if name in owners and all(key in self.backends[o] for o in owners):
+                    continue
+                metadata = backend[key]
+                for owner in owners:
+                    if key not in self.backends[owner]:
+                        self.backends[owner][key] = metadata
+                        moved += 1
+                if name not in owners:
+                    del backend[key]
+        return moved
+
+    def close(self) -> None:
+        """Shut down the fan-out thread pool."""
+        with self._executor_lock:
+            executor = self._executor
+        executor.shutdown(wait=True)
+
+
+def _private_copy(metadata: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Deep-copy stored metadata for a caller.
+
+    Stored metadata may be a read-only mapping shared by a bulk batch, whose
+    nested values (e.g. permission lists) every key in the batch references.
+    """
+    return copy.deepcopy(dict(metadata))
 
 
 class APIKeyManager:
     """Manages API key generation and validation."""
 
-    def __init__(self, prefix: str = "sk_"):
+    KEY_BYTES = 16
+
+    def __init__(self, prefix: str = "sk_", cache: Optional[ValidationCache] = None,
+                 store: Optional[MutableMapping] = None,
+                 clock: Callable[[], float] = time.time):
         """
         Initialize the API key manager.
 
         Args:
             prefix: Prefix for generated keys (default: "sk_")
+            cache: Optional front cache for validate_key results
+            store: Optional KeyStore used instead of an in-memory dict
+                   (e.g. MmapKeyStore for persistence, ShardedKeyStore)
+            clock: Time source for key expiry, in seconds
         """
         self.prefix = prefix
-        self.keys: Dict[str, Dict[str, Any]] = {}
+        self.keys: MutableMapping[str, Mapping[str, Any]] = store if store is not None else {}
+        self.cache = cache
+        self.clock = clock
+        # Expiry times: ref -> expires_at, plus a min-heap of (expires_at, ref)
+        # that may hold stale entries for revoked keys. A KeyStore also
+        # persists them, and they are reloaded from it here.
+        self.expiry: Dict[Hashable, float] = {}
+        if isinstance(self.keys, KeyStore):
+            self.expiry.update(self.keys.expiries())
+        self._expiry_heap: List[Tuple[float, Hashable]] = [
+            (expires_at, ref) for ref, expires_at in self.expiry.items()]
+        heapq.heapify(self._expiry_heap)
+        # Enumeration order for pagination over stores without scan(),
+        # built on first use and released when an enumeration reaches the
+        # end: refs in insertion order plus their sequence numbers. Revoked
+        # refs are skipped lazily and dropped once they make up half the
+        # index. Cursors carry the epoch, bumped on each release.
+        self._order: Optional[Tuple[List[Hashable], array]] = None
+        self._order_dead = 0
+        self._order_epoch = 0
+        self._next_seq = 0
+
+    # Storage hooks; subclasses that store keys differently override these.
+
+    def _ref(self, api_key: str) -> Hashable:
+        """Return the identifier used for a key in the store, cache and expiry index."""
+        return api_key
+
+    def _has(self, ref: Hashable) -> bool:
+        """Check whether the store holds a key."""
+        return ref in self.keys
+
+    def _get(self, ref: Hashable) -> Optional[Mapping[str, Any]]:
+        """Return the stored metadata for a key, or None."""
+        return self.keys.get(ref)
+
+    def _delete(self, ref: Hashable) -> bool:
+        """Remove a key from the store; return whether it was present."""
+        if ref in self.keys:
+            del self.keys[ref]
+            return True
+        return False
+
+    def _entries(self) -> List[Tuple[Hashable, str, Mapping[str, Any]]]:
+        """Snapshot the store as (ref, listed key, metadata) triples."""
+        # list() over a dict view runs without releasing the GIL, so the
+        # background reaper cannot change the dict mid-iteration.
+        return [(api_key, api_key, metadata) for api_key, metadata in list(self.keys.items())]
+
+    def _refs(self) -> List[Hashable]:
+        """Snapshot the refs of every stored key."""
+        return list(self.keys)
+
+    def _listing(self, ref: Hashable) -> Optional[Tuple[str, Mapping[str, Any]]]:
+        """Return (listed key, metadata) for a stored key, or None if it is gone."""
+        metadata = self._get(ref)
+        return (ref, metadata) if metadata is not None else None
+
+    def _user_entries(self, user_id: str) -> List[Tuple[Hashable, str]]:
+        """Return (ref, listed key) pairs for a user's keys."""
+        if isinstance(self.keys, KeyStore):
+            return [(api_key, api_key) for api_key in self.keys.keys_for_user(user_id)]
+        return [(ref, api_key) for ref, api_key, metadata in self._entries()
+                if metadata.get('user_id') == user_id]
+
+    def _store_key(self, random_part: str, metadata: Mapping[str, Any]) -> str:
+        """Store a key built from `random_part` and return the full key."""
+        # Combine prefix with random part
+        api_key = f"{self.prefix}{random_part}"
+
+        # Store key with metadata
+        self.keys[api_key] = metadata
+        if self.cache is not None:
+            self.cache.invalidate(api_key)
+        self._track(api_key)
+
+        return api_key
+
+    # Key lifecycle
 
-    def generate_key(self, metadata: Dict[str, Any]) -> str:
+    def generate_key(self, metadata: Dict[str, Any], ttl: Optional[float] = None) -> str:
         """
         Generate a new API key with associated metadata.
 
         Args:
             metadata: Dictionary containing user information
                      (e.g., {'user_id': '123', 'email': 'user@example.com', 'permissions': ['read', 'write']})
+            ttl: Optional lifetime in seconds; the key never expires if omitted
 
         Returns:
             The generated API key string
         """
         # Generate cryptographically secure random hex string
-        random_part = secrets.token_hex(16)  # 16 bytes = 32 hex characters
+        random_part = secrets.token_hex(self.KEY_BYTES)  # 16 bytes = 32 hex characters
 
-        # Combine prefix with random part
-        api_key = f"{self.prefix}{random_part}"
+        api_key = self._store_key(random_part, metadata.copy())
+        if ttl is not None:
+            self._set_expiry(self._ref(api_key), self.clock() + ttl)
+        return api_key
 
-        # Store key with metadata
-        self.keys[api_key] = metadata.copy()
+    def generate_keys(self, n: int, metadata: Dict[str, Any],
+                      ttl: Optional[float] = None) -> List[str]:
+        """
+        Generate `n` API keys that share the same metadata.
 
-        return api_key
+        Entropy for the whole batch is pulled in one read and sliced, and
+        every key references a single read-only copy of the metadata;
+        readers get deep copies, so nested values stay shared safely.
+
+        Args:
+            n: Number of keys to generate
+            metadata: Dictionary containing user information
+            ttl: Optional lifetime in seconds for every key in the batch
+
+        Returns:
+            List of the generated API key strings
+        """
+        width = self.KEY_BYTES * 2
+        entropy = secrets.token_bytes(self.KEY_BYTES * n).hex()
+        shared = MappingProxyType(metadata.copy())
+        api_keys = [self._store_key(entropy[i:i + width], shared)
+                    for i in range(0, len(entropy), width)]
+        if ttl is not None:
+            expires_at = self.clock() + ttl
+            for api_key in api_keys:
+                self._set_expiry(self._ref(api_key), expires_at)
+        return api_keys
 
     def validate_key(self, api_key: str) -> bool:
         """
@@ -45,9 +1280,20 @@ class APIKeyManager:
             api_key: The API key string to validate
 
         Returns:
-            True if key is valid (exists), False otherwise
+            True if key is valid (exists and has not expired), False otherwise
         """
-        return api_key in self.keys
+        ref = self._ref(api_key)
+        if self.expiry and self._expired(ref):
+            return False
+        if self.cache is None:
+            return self._has(ref)
+
+        valid = self.cache.lookup(ref)
+        if valid is None:
+            generation = self.cache.generation
+            valid = self._has(ref)
+            self.cache.record(ref, valid, generation)
+        return valid
 
     def get_metadata(self, api_key: str) -> Optional[Dict[str, Any]]:
         """
@@ -57,9 +1303,13 @@ class APIKeyManager:
             api_key: The API key string
 
         Returns:
-            Dictionary of metadata if key exists, None otherwise
+            Deep copy of the metadata if key exists, None otherwise
         """
-        return self.keys.get(api_key)
+        ref = self._ref(api_key)
+        if self.expiry and self._expired(ref):
+            return None
+        metadata = self._get(ref)
+        return _private_copy(metadata) if metadata is not None else None
 
     def revoke_key(self, api_key: str) -> bool:
         """
@@ -71,10 +1321,70 @@ class APIKeyManager:
         Returns:
             True if key was revoked, False if key didn't exist
         """
-        if api_key in self.keys:
-            del self.keys[api_key]
-            return True
-        return False
+        return self._forget(self._ref(api_key))
+
+    def revoke_keys(self, api_keys: Iterable[str]) -> int:
+        """
+        Revoke several API keys in one pass.
+
+        Args:
+            api_keys: API key strings to revoke
+
+        Returns:
+            Number of keys that were revoked
+        """
+        # Call _forget directly: revoke_key is locked per call in subclasses
+        revoked = 0
+        for api_key in api_keys:
+            if self._forget(self._ref(api_key)):
+                revoked += 1
+        return revoked
+
+    def revoke_user(self, user_id: str) -> int:
+        """
+        Revoke every API key belonging to a user.
+
+        Args:
+            user_id: The user ID whose keys should be revoked
+
+        Returns:
+            Number of live keys that were revoked; expired keys the reaper
+            has not removed yet are deleted too but not counted
+        """
+        revoked = 0
+        for ref, _ in self._user_entries(user_id):
+            live = not (self.expiry and self._expired(ref))
+            if self._forget(ref) and live:
+                revoked += 1
+        return revoked
+
+    def rotate_key(self, api_key: str, grace_period: float = 3600.0,
+                   ttl: Optional[float] = None) -> Optional[str]:
+        """
+        Issue a replacement key and retire the old one after a grace period.
+
+        Both keys validate during the overlap, so clients can switch over
+        without downtime.
+
+        Args:
+            api_key: The API key string to rotate
+            grace_period: Seconds the old key stays valid
+            ttl: Optional lifetime in seconds for the replacement key
+
+        Returns:
+            The replacement key, or None if the old key is not valid
+        """
+        metadata = self.get_metadata(api_key)
+        if metadata is None:
+            return None
+
+        new_key = self.generate_key(dict(metadata), ttl)
+        ref = self._ref(api_key)
+        deadline = self.clock() + grace_period
+        current = self.expiry.get(ref)
+        if current is None or deadline < current:
+            self._set_expiry(ref, deadline)
+        return new_key
 
     def list_user_keys(self, user_id: str) -> List[str]:
         """
@@ -87,8 +1397,8 @@ class APIKeyManager:
             List of API key strings belonging to this user
         """
         user_keys = []
-        for api_key, metadata in self.keys.items():
-            if metadata.get('user_id') == user_id:
+        for ref, api_key in self._user_entries(user_id):
+            if not (self.expiry and self._expired(ref)):
                 user_keys.append(api_key)
         return user_keys
 
@@ -99,4 +1409,488 @@ class APIKeyManager:
         Returns:
             List of all API key strings
         """
-        return list(self.keys.keys())
+        if not self.expiry:
+            return [api_key for _, api_key, _ in self._entries()]
+        return [api_key for ref, api_key, _ in self._entries() if not self._expired(ref)]
+
+    def _forget(self, ref: Hashable) -> bool:
+        """Remove a key from the store and every side index."""
+        removed = self._delete(ref)
+        self.expiry.pop(ref, None)
+        # Invalidate after deleting so a concurrent lookup cannot re-cache it
+        if self.cache is not None:
+            self.cache.invalidate(ref)
+        if removed and self._order is not None:
+            self._order_dead += 1
+            if self._order_dead > max(1024, len(self._order[0]) // 2):
+                self._compact_order()
+        return removed
+
+    # Pagination
+
+    def _track(self, ref: Hashable) -> None:
+        """Append a newly stored key to the enumeration order."""
+        if self._order is not None:
+            refs, seqs = self._order
+            refs.append(ref)
+            seqs.append(self._next_seq)
+            self._next_seq += 1
+
+    def _ensure_order(self) -> Tuple[List[Hashable], array]:
+        """Return the enumeration order, building it from the store if needed."""
+        if self._order is None:
+            refs = self._refs()
+            self._next_seq = len(refs)
+            self._order = (refs, array('Q', range(len(refs))))
+        return self._order
+
+    def _compact_order(self) -> None:
+        """Drop revoked refs from the enumeration order, keeping their sequence numbers."""
+        refs, seqs = self._order
+        live = [i for i, ref in enumerate(refs) if self._has(ref)]
+        # Swap in one assignment so readers see either the old or new index
+        self._order = ([refs[i] for i in live], array('Q', (seqs[i] for i in live)))
+        self._order_dead = 0
+
+    def page_keys(self, cursor: Optional[str] = None, limit: int = 1000,
+                  user_id: Optional[str] = None,
+                  with_metadata: bool = False) -> Tuple[List[Any], Optional[str]]:
+        """
+        Return one page of keys in a stable order.
+
+        Keys are ordered by when this manager first saw them. Paging with the
+        returned cursor never repeats a key or skips a key that existed for
+        the whole enumeration, even if keys are generated or revoked between
+        calls; keys generated meanwhile appear on later pages.
+
+        Stores with a scan() (MmapKeyStore) are paged through directly.
+        Otherwise the manager keeps an index of the order until an
+        enumeration reaches the end; cursors issued before that are then
+        rejected, so enumerations running side by side may need a restart.
+
+        Args:
+            cursor: Cursor from the previous page, or None to start
+            limit: Maximum number of keys on the page
+            user_id: Only include keys belonging to this user
+            with_metadata: Return (key, metadata) pairs instead of keys
+
+        Returns:
+            (page, next cursor); the cursor is None once the end is reached
+
+        Raises:
+            ValueError: If the cursor was issued before the order index was released
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        if isinstance(self.keys, KeyStore):
+            scanned = self.keys.scan(cursor, limit)
+            if scanned is not None:
+                return self._page_scan(scanned, limit, user_id, with_metadata)
+        if cursor is None:
+            after = None
+        else:
+            epoch, _, seq = cursor.partition(':')
+            if int(epoch) != self._order_epoch:
+                raise ValueError("cursor has expired; restart the enumeration")
+            after = int(seq)
+        refs, seqs = self._ensure_order()
+        # Refs are appended before their sequence numbers, so seqs bounds both
+        end = len(seqs)
+        index = 0 if after is None else bisect.bisect_right(seqs, after, 0, end)
+        page: List[Any] = []
+        while index < end and len(page) < limit:
+            ref = refs[index]
+            index += 1
+            entry = self._listing(ref)
+            if entry is None or (self.expiry and self._expired(ref)):
+                continue
+            api_key, metadata = entry
+            if user_id is not None and metadata.get('user_id') != user_id:
+                continue
+            page.append((api_key, _private_copy(metadata)) if with_metadata else api_key)
+        if index < len(seqs):
+            return page, f"{self._order_epoch}:{seqs[index - 1]}"
+        self._release_order()
+        return page, None
+
+    def _page_scan(self, scanned: Tuple[List[Tuple[str, Dict[str, Any]]], Optional[str]],
+                   limit: int, user_id: Optional[str],
+                   with_metadata: bool) -> Tuple[List[Any], Optional[str]]:
+        """Build a page from store scan() results, scanning on until it is full."""
+        page: List[Any] = []
+        while True:
+            entries, cursor = scanned
+            for api_key, metadata in entries:
+                if self.expiry and self._expired(api_key):
+                    continue
+                if user_id is not None and metadata.get('user_id') != user_id:
+                    continue
+                page.append((api_key, metadata) if with_metadata else api_key)
+            if cursor is None or len(page) >= limit:
+                return page, cursor
+            scanned = self.keys.scan(cursor, limit - len(page))
+
+    def _release_order(self) -> None:
+        """Drop the enumeration order once an enumeration has finished."""
+        self._order = None
+        self._order_dead = 0
+        self._order_epoch += 1
+
+    def iter_keys(self, chunk_size: int = 1000, user_id: Optional[str] = None,
+                  with_metadata: bool = False) -> Iterator[List[Any]]:
+        """
+        Stream all keys in chunks without building the full list.
+
+        Args:
+            chunk_size: Maximum number of keys per chunk
+            user_id: Only include keys belonging to this user
+            with_metadata: Yield (key, metadata) pairs instead of keys
+
+        Yields:
+            Lists of at most `chunk_size` keys
+        """
+        cursor = None
+        while True:
+            page, cursor = self.page_keys(cursor, chunk_size, user_id, with_metadata)
+            if page:
+                yield page
+            if cursor is None:
+                return
+
+    def export_keys(self, out: IO[str], chunk_size: int = 1000) -> int:
+        """
+        Write every key and its metadata to a text file as JSON lines.
+
+        Memory use stays flat: only one chunk is held at a time.
+
+        Args:
+            out: Writable text file
+            chunk_size: Keys fetched per chunk
+
+        Returns:
+            Number of keys written
+        """
+        written = 0
+        for chunk in self.iter_keys(chunk_size, with_metadata=True):
+            out.writelines(json.dumps({'key': api_key, 'metadata': metadata}) + '\n'
+                           for api_key, metadata in chunk)
+            written += len(chunk)
+        return written
+
+    # Expiry
+
+    def _expired(self, ref: Hashable) -> bool:
+        """Check whether a key is past its expiry time."""
+        expires_at = self.expiry.get(ref)
+        return expires_at is not None and expires_at <= self.clock()
+
+    def _set_expiry(self, ref: Hashable, expires_at: float) -> None:
+        """Schedule a key to expire."""
+        if isinstance(self.keys, KeyStore):
+            self.keys.set_expiry(ref, expires_at)
+        self.expiry[ref] = expires_at
+        heapq.heappush(self._expiry_heap, (expires_at, ref))
+        # Drop stale entries once they dominate the heap
+        if len(self._expiry_heap) > 2 * len(self.expiry) + 1024:
+            self._expiry_heap = [(at, ref) for ref, at in self.expiry.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def reap_expired(self, max_batch: int = 1000) -> int:
+        """
+        Remove expired keys, examining at most `max_batch` heap entries.
+
+        Expired keys are already rejected by validate_key; reaping only frees
+        their storage, in bounded batches so no single call stalls. This
+        manager is not thread-safe, so call it from the thread that writes;
+        ConcurrentAPIKeyManager can run it on a background thread.
+
+        Args:
+            max_batch: Maximum number of heap entries to process
+
+        Returns:
+            Number of keys removed
+        """
+        now = self.clock()
+        heap = self._expiry_heap
+        reaped = 0
+        for _ in range(max_batch):
+            if not heap or heap[0][0] > now:
+                break
+            expires_at, ref = heapq.heappop(heap)
+            # Skip entries for keys that were revoked or re-scheduled
+            if self.expiry.get(ref) == expires_at:
+                self._forget(ref)
+                reaped += 1
+        return reaped
+
+
+class HashedAPIKeyManager(APIKeyManager):
+    """
+    API key manager that never keeps raw keys in memory.
+
+    Keys are stored under a keyed BLAKE2b digest, so a heap dump only
+    exposes digests. The prefix plus a short key ID is kept for display;
+    listing methods return these display IDs instead of raw keys. The
+    digest table is an in-memory dict: this manager takes no KeyStore, so
+    it cannot be combined with the persistent or sharded backends.
+    """
+
+    DIGEST_SIZE = 32
+    INDEX_SIZE = 16
+    KEY_ID_LENGTH = 8
+
+    def __init__(self, prefix: str = "sk_", secret: Optional[bytes] = None,
+                 cache: Optional[ValidationCache] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize the hashed API key manager.
+
+        Args:
+            prefix: Prefix for generated keys (default: "sk_")
+            secret: Key for the BLAKE2b digest (random per instance if omitted)
+            cache: Optional front cache for validate_key results, keyed by digest
+            clock: Time source for key expiry, in seconds
+        """
+        super().__init__(prefix, cache, clock=clock)
+        self.secret = secret if secret is not None else secrets.token_bytes(32)
+        # Index (leading digest bytes) -> (full digest, display ID, metadata)
+        self.keys: Dict[bytes, Tuple[bytes, str, Mapping[str, Any]]] = {}
+        # Keyed hasher template; copying it skips re-absorbing the key block
+        self._hasher = hashlib.blake2b(key=self.secret, digest_size=self.DIGEST_SIZE)
+
+    def _digest(self, api_key: str) -> bytes:
+        """Compute the keyed digest of an API key."""
+        hasher = self._hasher.copy()
+        hasher.update(api_key.encode())
+        return hasher.digest()
+
+    def _find(self, digest: bytes) -> Optional[Tuple[bytes, str, Mapping[str, Any]]]:
+        """
+        Return the stored record for a key digest, or None if not found.
+
+        One dict lookup on the leading digest bytes, then a constant-time
+        comparison of the full digest.
+        """
+        record = self.keys.get(digest[:self.INDEX_SIZE])
+        if record is not None and hmac.compare_digest(record[0], digest):
+            return record
+        return None
+
+    def _ref(self, api_key: str) -> bytes:
+        """Keys are referenced by their digest everywhere."""
+        return self._digest(api_key)
+
+    def _has(self, ref: bytes) -> bool:
+        return self._find(ref) is not None
+
+    def _get(self, ref: bytes) -> Optional[Mapping[str, Any]]:
+        record = self._find(ref)
+        return record[2] if record is not None else None
+
+    def _delete(self, ref: bytes) -> bool:
+        if self._find(ref) is None:
+            return False
+        del self.keys[ref[:self.INDEX_SIZE]]
+        return True
+
+    def _entries(self) -> List[Tuple[bytes, str, Mapping[str, Any]]]:
+        """Snapshot the store as (digest, display ID, metadata) triples."""
+        return list(self.keys.values())
+
+    def _refs(self) -> List[bytes]:
+        return [digest for digest, _, _ in list(self.keys.values())]
+
+    def _listing(self, ref: bytes) -> Optional[Tuple[str, Mapping[str, Any]]]:
+        record = self._find(ref)
+        return (record[1], record[2]) if record is not None else None
+
+    def _store_key(self, random_part: str, metadata: Mapping[str, Any]) -> str:
+        """Store only the digest of the key built from `random_part`."""
+        api_key = f"{self.prefix}{random_part}"
+
+        digest = self._digest(api_key)
+        key_id = f"{self.prefix}{random_part[:self.KEY_ID_LENGTH]}"
+        self.keys[digest[:self.INDEX_SIZE]] = (digest, key_id, metadata)
+        if self.cache is not None:
+            self.cache.invalidate(digest)
+        self._track(digest)
+
+        return api_key
+
+
+class ConcurrentAPIKeyManager(APIKeyManager):
+    """
+    APIKeyManager safe to share between threads.
+
+    Writers (generation, revocation, rotation, reaping) are serialized by a
+    lock. Readers never take it: point lookups are single dict operations,
+    and listings iterate an immutable snapshot that is rebuilt at most once
+    per write, read-copy-update style. Any KeyStore can back it: the stores
+    in this module are safe to read while another thread writes
+    (MmapKeyStore serializes access with its own lock).
+    """
+
+    def __init__(self, prefix: str = "sk_", cache: Optional[ValidationCache] = None,
+                 store: Optional[MutableMapping] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize the concurrent API key manager.
+
+        Args:
+            prefix: Prefix for generated keys (default: "sk_")
+            cache: Optional front cache for validate_key results
+            store: Optional KeyStore used instead of an in-memory dict
+            clock: Time source for key expiry, in seconds
+        """
+        super().__init__(prefix, cache, store, clock)
+        self._write_lock = threading.RLock()
+        self._version = 0
+        self._snapshot: Tuple[int, List[Tuple[Hashable, str, Mapping[str, Any]]]] = (-1, [])
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_stop = threading.Event()
+
+    def _write(self, method: Callable, *args) -> Any:
+        """Run a base-class write method under the writer lock."""
+        with self._write_lock:
+            try:
+                return method(self, *args)
+            finally:
+                self._version += 1
+
+    def _entries(self) -> List[Tuple[Hashable, str, Mapping[str, Any]]]:
+        """Return the snapshot for the current version, rebuilding it if stale."""
+        version, entries = self._snapshot
+        if version != self._version:
+            # Tag with the version read before copying; a write that lands
+            # during the copy leaves the snapshot stale for the next reader.
+            version = self._version
+            entries = super()._entries()
+            self._snapshot = (version, entries)
+        return entries
+
+    def _ensure_order(self) -> Tuple[List[Hashable], array]:
+        order = self._order
+        if order is not None:
+            return order
+        # Build under the writer lock so no concurrent insert is missed
+        with self._write_lock:
+            return super()._ensure_order()
+
+    def generate_key(self, metadata: Dict[str, Any], ttl: Optional[float] = None) -> str:
+        return self._write(APIKeyManager.generate_key, metadata, ttl)
+
+    def generate_keys(self, n: int, metadata: Dict[str, Any],
+                      ttl: Optional[float] = None) -> List[str]:
+        return self._write(APIKeyManager.generate_keys, n, metadata, ttl)
+
+    def revoke_key(self, api_key: str) -> bool:
+        return self._write(APIKeyManager.revoke_key, api_key)
+
+    def revoke_keys(self, api_keys: Iterable[str]) -> int:
+        return self._write(APIKeyManager.revoke_keys, api_keys)
+
+    def revoke_user(self, user_id: str) -> int:
+        return self._write(APIKeyManager.revoke_user, user_id)
+
+    def rotate_key(self, api_key: str, grace_period: float = 3600.0,
+                   ttl: Optional[float] = None) -> Optional[str]:
+        return self._write(APIKeyManager.rotate_key, api_key, grace_period, ttl)
+
+    def reap_expired(self, max_batch: int = 1000) -> int:
+        return self._write(APIKeyManager.reap_expired, max_batch)
+
+    def start_reaper(self, interval: float = 1.0, batch_size: int = 1000) -> None:
+        """
+        Start a daemon thread that reaps expired keys.
+
+        Each batch holds the writer lock, so reaping never overlaps a
+        generation or revocation.
+
+        Args:
+            interval: Seconds between reaping rounds
+            batch_size: Heap entries processed per batch
+        """
+        if self._reaper is not None:
+            return
+
+        def run():
+            while not self._reaper_stop.wait(interval):
+                while self.reap_expired(batch_size) and not self._reaper_stop.is_set():
+                    time.sleep(0)  # yield between batches
+
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=run, name='api-key-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self) -> None:
+        """Stop the background reaper thread, if running."""
+        if self._reaper is None:
+            return
+        self._reaper_stop.set()
+        self._reaper.join()
+        self._reaper = None
+
+
+class AsyncAPIKeyManager:
+    """
+    asyncio facade over a ConcurrentAPIKeyManager.
+
+    Point reads against the default dict store are answered inline since
+    they never block; with a KeyStore (file or network I/O) they run in the
+    executor like writes and full listings, so they cannot stall the loop.
+    """
+
+    def __init__(self, manager: Optional[ConcurrentAPIKeyManager] = None,
+                 executor: Optional[Executor] = None):
+        """
+        Initialize the async facade.
+
+        Args:
+            manager: Manager to wrap (a new ConcurrentAPIKeyManager if omitted)
+            executor: Executor for blocking work (the loop default if omitted)
+        """
+        self.manager = manager if manager is not None else ConcurrentAPIKeyManager()
+        self.executor = executor
+
+    async def _offload(self, method: Callable, *args) -> Any:
+        """Run a manager method in the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args))
+
+    async def _read(self, method: Callable, *args) -> Any:
+        """Run a point read inline, or in the executor if it may do store I/O."""
+        if isinstance(self.manager.keys, KeyStore):
+            return await self._offload(method, *args)
+        return method(*args)
+
+    async def validate_key(self, api_key: str) -> bool:
+        return await self._read(self.manager.validate_key, api_key)
+
+    async def get_metadata(self, api_key: str) -> Optional[Dict[str, Any]]:
+        return await self._read(self.manager.get_metadata, api_key)
+
+    async def generate_key(self, metadata: Dict[str, Any], ttl: Optional[float] = None) -> str:
+        return await self._offload(self.manager.generate_key, metadata, ttl)
+
+    async def generate_keys(self, n: int, metadata: Dict[str, Any],
+                            ttl: Optional[float] = None) -> List[str]:
+        return await self._offload(self.manager.generate_keys, n, metadata, ttl)
+
+    async def revoke_key(self, api_key: str) -> bool:
+        return await self._offload(self.manager.revoke_key, api_key)
+
+    async def revoke_keys(self, api_keys: Iterable[str]) -> int:
+        return await self._offload(self.manager.revoke_keys, list(api_keys))
+
+    async def revoke_user(self, user_id: str) -> int:
+        return await self._offload(self.manager.revoke_user, user_id)
+
+    async def rotate_key(self, api_key: str, grace_period: float = 3600.0,
+                         ttl: Optional[float] = None) -> Optional[str]:
+        return await self._offload(self.manager.rotate_key, api_key, grace_period, ttl)
+
+    async def list_user_keys(self, user_id: str) -> List[str]:
+        return await self._offload(self.manager.list_user_keys, user_id)
+
+    async def get_all_keys(self) -> List[str]:
+        return await self._offload(self.manager.get_all_keys)
@@ -0,0 +1,206 @@
+"""
+Benchmark suite for the login authenticator reference implementation.
+
+Usage:
+    python bench_login_authenticator.py [--backends memory,sqlite] [--users N]
+                                        [--logins N] [--concurrency 1,4,16]
+                                        [--mix VALID,INVALID,UNKNOWN] [--cost N]
+                                        [--phases] [--json PATH]
+
+For every backend it loads `users` accounts, then measures:
+  - login throughput and latency (mean, p50, p99, p99.9) at each
+    concurrency level, for a weighted mix of correct passwords, wrong
+    passwords and unknown usernames
+  - lookup throughput for user_exists / get_failed_attempts
+  - session token validation throughput, for comparison with login
+
+With --phases the LoginMetrics breakdown (normalize / lookup / verify /
+update) for each concurrency level is printed as well.
+
+The default --cost is deliberately low so storage overhead stays visible
+next to key derivation; pass the policy cost (14) for end-to-end numbers.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from canonical_solution import (
+    KDFPool, LatencyHistogram, LoginAuthenticator, LoginMetrics, MemoryUserStore,
+    PasswordHasher, SQLiteUserStore, UserStore,
+)
+
+PASSWORD = "correct-horse"
+
+BACKENDS: Dict[str, Callable[[str], UserStore]] = {
+    'memory': lambda path: MemoryUserStore(),
+    'sqlite': lambda path: SQLiteUserStore(os.path.join(path, 'users.db')),
+}
+
+
+def load_users(auth: LoginAuthenticator, count: int) -> List[str]:
+    """Insert `count` users sharing one precomputed hash."""
+    password_hash = auth.hasher.hash(PASSWORD)
+    usernames = [f"user{i}" for i in range(count)]
+    for username in usernames:
+        auth.users.add(username, {'password_hash': password_hash, 'failed_attempts': 0})
+    return usernames
+
+
+def make_workload(usernames: List[str], count: int,
+                  mix: Tuple[float, float, float]) -> List[Tuple[str, str]]:
+    """Build (username, password) attempts: valid, wrong-password and unknown-user."""
+    rng = random.Random(42)
+    attempts = []
+    for i, kind in enumerate(rng.choices(('valid', 'invalid', 'unknown'), weights=mix, k=count)):
+        if kind == 'unknown':
+            attempts.append((f"ghost{i}", PASSWORD))
+        else:
+            attempts.append((rng.choice(usernames),
+                             PASSWORD if kind == 'valid' else "wrong-password"))
+    return attempts
+
+
+def run_threads(threads: int, work: Callable[[int], None],
+                total: int) -> Tuple[float, LatencyHistogram]:
+    """Split `total` calls of `work` over `threads` threads.
+
+    Returns:
+        (calls/sec, histogram of per-call latency)
+    """
+    per_thread = total // threads
+    histograms = [LatencyHistogram() for _ in range(threads)]
+
+    def worker(slot: int) -> None:
+        clock = time.perf_counter_ns
+        histogram = histograms[slot]
+        for i in range(slot * per_thread, (slot + 1) * per_thread):
+            start = clock()
+            work(i)
+            histogram.record(clock() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start
+
+    merged = histograms[0]
+    for histogram in histograms[1:]:
+        merged.merge(histogram)
+    return per_thread * threads / elapsed, merged
+
+
+def bench_backend(name: str, users: int, logins: int, concurrency: List[int],
+                  mix: Tuple[float, float, float], cost: int,
+                  phases: bool) -> List[Dict[str, Any]]:
+    """Run every benchmark for one backend."""
+    path = tempfile.mkdtemp(prefix='bench-users-')
+    store = BACKENDS[name](path)
+    pool = KDFPool(max_workers=max(concurrency), max_queue=max(concurrency))
+    metrics = LoginMetrics()
+    results = []
+    try:
+        auth = LoginAuthenticator(hasher=PasswordHasher(cost=cost), pool=pool,
+                                  store=store, metrics=metrics)
+        usernames = load_users(auth, users)
+        attempts = make_workload(usernames, logins, mix)
+
+        def login(i: int) -> None:
+            auth.login(*attempts[i])
+
+        def lookup(i: int) -> None:
+            username = usernames[i % users]
+            auth.user_exists(username)
+            auth.get_failed_attempts(username)
+
+        for level in concurrency:
+            metrics.reset()
+            ops, latency = run_threads(level, login, logins)
+            results.append({'backend': name, 'benchmark': 'login', 'concurrency': level,
+                            'ops_per_sec': ops, **latency.summary()})
+            if phases:
+                results[-1]['phases'] = metrics.snapshot()['phases']
+
+        ops, latency = run_threads(1, lookup, logins * 10)
+        results.append({'backend': name, 'benchmark': 'lookup', 'concurrency': 1,
+                        'ops_per_sec': ops, **latency.summary()})
+
+        token = auth.login_session(usernames[0], PASSWORD)
+        ops, latency = run_threads(1, lambda i: auth.validate_session(token), logins * 10)
+        results.append({'backend': name, 'benchmark': 'session', 'concurrency': 1,
+                        'ops_per_sec': ops, **latency.summary()})
+    finally:
+        pool.shutdown()
+        close = getattr(store, 'close', None)
+        if close is not None:
+            close()
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    """Print results one line per record, plus any phase breakdown."""
+    for row in results:
+        print(f"{row['backend']:>8} {row['benchmark']:<8} c={row['concurrency']:<3} "
+              f"ops_per_sec={row['ops_per_sec']:>12,.1f}  p50={row['p50_us']:,.1f}us "
+              f"p99={row['p99_us']:,.1f}us p99.9={row['p999_us']:,.1f}us")
+        for phase, summary in row.get('phases', {}).items():
+            print(f"{'':>22}{phase:<18} mean={summary['mean_us']:,.1f}us "
+                  f"p99={summary['p99_us']:,.1f}us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backends', default='memory,sqlite',
+                        help=f"comma-separated subset of {','.join(BACKENDS)}")
+    parser.add_argument('--users', type=int, default=10_000, help='accounts to load')
+    parser.add_argument('--logins', type=int, default=2_000,
+                        help='login attempts per concurrency level')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--mix', default='0.6,0.3,0.1',
+                        help='weights of valid, wrong-password and unknown-user attempts')
+    parser.add_argument('--cost', type=int, default=8, help='scrypt cost (log2 N)')
+    parser.add_argument('--phases', action='store_true',
+                        help='report per-phase login latency from LoginMetrics')
+    parser.add_argument('--json', help='write results to this file as JSON')
+    args = parser.parse_args()
+
+    backends = args.backends.split(',')
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    concurrency = [int(level) for level in args.concurrency.split(',')]
+    mix = tuple(float(weight) for weight in args.mix.split(','))
+    if len(mix) != 3:
+        parser.error("--mix needs three weights")
+
+    results = []
+    for name in backends:
+        results.extend(bench_backend(name, args.users, args.logins, concurrency, mix,
+                                     args.cost, args.phases))
+    print_table(results)
+
+    if args.json:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'args': vars(args),
+            },
+            'results': results,
+        }
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
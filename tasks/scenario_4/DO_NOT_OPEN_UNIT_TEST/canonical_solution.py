@@ -1,12 +1,1325 @@
-from typing import Dict
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import itertools
+import json
+import math
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Any, Callable, Deque, Dict, Generator, Iterable, Iterator, List, Mapping, Optional, Set,
+    Tuple,
+)
+
+# A key derivation requested by a login or registration flow: (function, args)
+_KDFStep = Tuple[Callable, Tuple[Any, ...]]
+
+
+class AuthenticatorBusy(RuntimeError):
+    """Raised when the password hashing queue is full."""
+
+
+class PasswordHasher:
+    """
+    Derives salted password hashes with scrypt or PBKDF2-SHA256.
+
+    Hashes are stored as self-describing strings,
+    ``$<algorithm>$<cost>$<salt>$<hash>`` with base64 salt and hash, so
+    existing hashes keep verifying after the policy changes and can be
+    upgraded later.
+    """
+
+    DEFAULT_COST = {'scrypt': 14, 'pbkdf2_sha256': 600_000}
+    # Accepted parameters for hashes made elsewhere (see check)
+    COST_RANGE = {'scrypt': (10, 17), 'pbkdf2_sha256': (1_000, 2_400_000)}
+    SALT_SIZE_RANGE = (8, 64)
+    DIGEST_SIZE_RANGE = (16, 64)
+
+    def __init__(self, algorithm: str = 'scrypt', cost: Optional[int] = None,
+                 salt_size: int = 16, dklen: int = 32):
+        """
+        Initialize the hasher with the current hashing policy.
+
+        Args:
+            algorithm: 'scrypt' or 'pbkdf2_sha256'
+            cost: Work factor; log2(N) for scrypt, iterations for PBKDF2
+                  (defaults to DEFAULT_COST for the algorithm)
+            salt_size: Random salt length in bytes
+            dklen: Derived key length in bytes
+        """
+        if algorithm not in self.DEFAULT_COST:
+            raise ValueError(f"unsupported algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.cost = cost if cost is not None else self.DEFAULT_COST[algorithm]
+        self.salt_size = salt_size
+        self.dklen = dklen
+
+    @staticmethod
+    def derive(password: str, salt: bytes, algorithm: str, cost: int, dklen: int) -> bytes:
+        """
+        Run the key-derivation function.
+
+        Args:
+            password: Plaintext password
+            salt: Per-user random salt
+            algorithm: 'scrypt' or 'pbkdf2_sha256'
+            cost: Work factor for the algorithm
+            dklen: Derived key length in bytes
+
+        Returns:
+            Derived key bytes
+        """
+        if algorithm == 'scrypt':
+            n, r = 2 ** cost, 8
+            return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=1,
+                                  maxmem=256 * r * n, dklen=dklen)
+        if algorithm == 'pbkdf2_sha256':
+            return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, cost, dklen)
+        raise ValueError(f"unsupported algorithm: {algorithm}")
+
+    @staticmethod
+    def parse(encoded: str) -> Tuple[str, int, bytes, bytes]:
+        """
+        Split a stored hash into its parameters.
+
+        Returns:
+            (algorithm, cost, salt, derived key)
+        """
+        _, algorithm, cost, salt, digest = encoded.split('$')
+        return algorithm, int(cost), _b64decode(salt), _b64decode(digest)
+
+    @classmethod
+    def check(cls, encoded: str) -> None:
+        """
+        Check that a hash made elsewhere can be stored and verified.
+
+        Costs outside COST_RANGE either fail at verification (scrypt's
+        memory limit rejects small N) or tie up a worker for each login,
+        and salts or digests outside their size ranges are rejected too.
+
+        Raises:
+            ValueError: If the hash is malformed or a parameter is out of range
+        """
+        algorithm, cost, salt, digest = cls.parse(encoded)
+        if algorithm not in cls.COST_RANGE:
+            raise ValueError(f"unsupported algorithm: {algorithm}")
+        low, high = cls.COST_RANGE[algorithm]
+        if not low <= cost <= high:
+            raise ValueError(f"{algorithm} cost {cost} is outside [{low}, {high}]")
+        low, high = cls.SALT_SIZE_RANGE
+        if not low <= len(salt) <= high:
+            raise ValueError(f"salt of {len(salt)} bytes is outside [{low}, {high}]")
+        low, high = cls.DIGEST_SIZE_RANGE
+        if not low <= len(digest) <= high:
+            raise ValueError(f"digest of {len(digest)} bytes is outside [{low}, {high}]")
+
+    def hash(self, password: str) -> str:
+        """
+        Hash a password with a fresh salt under the current policy.
+
+        Returns:
+            Encoded hash string
+        """
+        salt = secrets.token_bytes(self.salt_size)
+        digest = self.derive(password, salt, self.algorithm, self.cost, self.dklen)
+        return f"${self.algorithm}${self.cost}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        """
+        Check a password against a stored hash in constant time.
+
+        The parameters recorded in the hash are used, not the current policy.
+
+        Returns:
+            True if the password matches, False otherwise
+        """
+        algorithm, cost, salt, expected = self.parse(encoded)
+        return hmac.compare_digest(
+            self.derive(password, salt, algorithm, cost, len(expected)), expected)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """Check whether a stored hash is weaker than the current policy."""
+        algorithm, cost, _, digest = self.parse(encoded)
+        return (algorithm != self.algorithm or cost < self.cost
+                or len(digest) < self.dklen)
+
+
+def _b64encode(data: bytes) -> str:
+    """Encode bytes as unpadded base64."""
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(text: str) -> bytes:
+    """Decode unpadded base64."""
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class KDFPool:
+    """
+    Bounded worker pool for password key derivation.
+
+    hashlib's scrypt and PBKDF2 release the GIL, so threads run derivations
+    in parallel. At most `max_workers + max_queue` jobs may be running or
+    waiting; further submissions raise AuthenticatorBusy instead of piling
+    up, so a login flood cannot queue unbounded CPU work.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: int = 64):
+        """
+        Initialize the pool.
+
+        Args:
+            max_workers: Worker threads (defaults to the CPU count)
+            max_queue: Jobs allowed to wait for a free worker
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='kdf')
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs currently running or queued."""
+        return self._pending
+
+    def submit(self, func: Callable, *args) -> Future:
+        """
+        Schedule a derivation job.
+
+        Raises:
+            AuthenticatorBusy: If the queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            raise AuthenticatorBusy("password hashing queue is full")
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future: Future) -> None:
+        """Free the queue slot of a finished job."""
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def run(self, func: Callable, *args) -> Any:
+        """Run a derivation job on the pool and wait for its result."""
+        return self.submit(func, *args).result()
+
+    def shutdown(self) -> None:
+        """Stop the worker threads."""
+        self._executor.shutdown(wait=True)
+
+
+class LockoutTracker:
+    """
+    Counts failures per key in time buckets and applies exponential backoff.
+
+    Failures land in fixed-width time buckets, and buckets older than
+    `window` are dropped whole, so state expires without per-key timers.
+    Each bucket holds at most `max_keys` keys and evicts the least recently
+    failed one when full, which bounds memory when attackers spray random
+    usernames. A key with `threshold` or more failures inside the window is
+    locked for base_delay * 2 ** (failures - threshold) seconds after its
+    latest failure, capped at max_delay.
+    """
+
+    def __init__(self, threshold: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 900.0, window: float = 900.0,
+                 bucket_seconds: float = 60.0, max_keys: int = 100_000,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize the tracker.
+
+        Args:
+            threshold: Failures within the window before backoff starts
+            base_delay: Lock duration in seconds at the threshold
+            max_delay: Upper bound on the lock duration in seconds
+            window: Seconds a failure keeps counting
+            bucket_seconds: Width of one time bucket
+            max_keys: Keys tracked per bucket
+            clock: Time source returning seconds
+        """
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.max_keys = max_keys
+        self.clock = clock
+        # (bucket index, {key: [failures, last failure time]}) oldest first
+        self._buckets: Deque[Tuple[int, 'OrderedDict[str, List[float]]']] = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of (bucket, key) entries currently held."""
+        with self._lock:
+            return sum(len(counts) for _, counts in self._buckets)
+
+    def _expire(self, now: float) -> None:
+        """Drop buckets that ended before the window started."""
+        cutoff = now - self.window
+        buckets = self._buckets
+        while buckets and (buckets[0][0] + 1) * self.bucket_seconds <= cutoff:
+            buckets.popleft()
+
+    def record_failure(self, key: str) -> None:
+        """Count a failure for a key at the current time."""
+        now = self.clock()
+        index = int(now // self.bucket_seconds)
+        with self._lock:
+            self._expire(now)
+            if not self._buckets or self._buckets[-1][0] != index:
+                self._buckets.append((index, OrderedDict()))
+            counts = self._buckets[-1][1]
+            entry = counts.pop(key, None)
+            if entry is None:
+                entry = [0, now]
+                if len(counts) >= self.max_keys:
+                    counts.popitem(last=False)
+            entry[0] += 1
+            entry[1] = now
+            counts[key] = entry
+
+    def locked_until(self, key: str) -> float:
+        """
+        Get the time a key's lock ends.
+
+        Returns:
+            Unlock time in clock seconds, or 0.0 if the key is not locked
+        """
+        now = self.clock()
+        failures, last = 0, 0.0
+        with self._lock:
+            self._expire(now)
+            for _, counts in self._buckets:
+                entry = counts.get(key)
+                if entry is not None:
+                    failures += entry[0]
+                    last = entry[1]
+        if failures < self.threshold:
+            return 0.0
+        delay = min(self.max_delay, self.base_delay * 2 ** min(failures - self.threshold, 64))
+        return last + delay if last + delay > now else 0.0
+
+    def is_locked(self, key: str) -> bool:
+        """Check whether a key is currently locked."""
+        return self.locked_until(key) > 0.0
+
+    def reset(self, key: str) -> None:
+        """Forget all failures for a key."""
+        with self._lock:
+            for _, counts in self._buckets:
+                counts.pop(key, None)
+
+
+class HyperLogLog:
+    """
+    Cardinality estimator in 2 ** precision one-byte registers.
+
+    The harmonic sum and the count of empty registers are maintained as
+    registers change, so count() is O(1) and can run on every update.
+    Standard error is about 1.04 / sqrt(2 ** precision).
+    """
+
+    def __init__(self, precision: int = 10):
+        """
+        Initialize an empty estimator.
+
+        Args:
+            precision: log2 of the register count (4-16)
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        size = 1 << precision
+        self.registers = bytearray(size)
+        self._inverse_sum = float(size)
+        self._zeros = size
+        self._alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+
+    def add(self, item: str) -> bool:
+        """
+        Add an item.
+
+        Returns:
+            True if a register changed (the estimate may have grown)
+        """
+        x = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        old = self.registers[index]
+        if rank <= old:
+            return False
+        self.registers[index] = rank
+        self._inverse_sum += 2.0 ** -rank - 2.0 ** -old
+        if old == 0:
+            self._zeros -= 1
+        return True
+
+    def copy(self) -> 'HyperLogLog':
+        """Return an independent estimator with the same registers."""
+        clone = HyperLogLog.__new__(HyperLogLog)
+        clone.precision = self.precision
+        clone.registers = bytearray(self.registers)
+        clone._inverse_sum = self._inverse_sum
+        clone._zeros = self._zeros
+        clone._alpha = self._alpha
+        return clone
+
+    def count(self) -> int:
+        """Estimate the number of distinct items added."""
+        size = len(self.registers)
+        estimate = self._alpha * size * size / self._inverse_sum
+        if estimate <= 2.5 * size and self._zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = size * math.log(size / self._zeros)
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """
+    Approximate per-key counters in fixed memory.
+
+    Estimates never undercount; with width w they overcount by at most
+    e/w of the total with probability 1 - e ** -depth.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        """
+        Initialize an empty sketch.
+
+        Args:
+            width: Counters per row
+            depth: Number of rows (independent hashes)
+        """
+        self.width = width
+        self.depth = depth
+        self.rows = [array('I', bytes(4 * width)) for _ in range(depth)]
+
+    def _indexes(self, item: str) -> List[int]:
+        """Column of an item in each row."""
+        digest = hashlib.blake2b(item.encode(), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[i:i + 4], 'little') % self.width
+                for i in range(0, 4 * self.depth, 4)]
+
+    def add(self, item: str, count: int = 1) -> int:
+        """
+        Increment an item's counter.
+
+        Returns:
+            The item's new estimated count
+        """
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(item)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, item: str) -> int:
+        """Estimate an item's count."""
+        return min(row[index] for row, index in zip(self.rows, self._indexes(item)))
+
+    def clear(self) -> None:
+        """Reset every counter to zero."""
+        for row in self.rows:
+            row[:] = array('I', bytes(4 * self.width))
+
+
+class CredentialStuffingDetector:
+    """
+    Spots distributed credential stuffing from login outcomes.
+
+    It tracks, in fixed memory:
+      - distinct usernames failing from each source, in a HyperLogLog per
+        source (least recently seen sources are evicted past max_sources)
+      - attempts and failures per source, in Count-Min Sketches
+      - the overall failure ratio
+
+    Statistics are kept for the current window and the previous one and
+    judged together, so they always span at least one full window: a
+    source cannot stay under a threshold by splitting its attempts across
+    a window boundary. Each source keeps a second HyperLogLog that starts
+    as a copy of its previous window's, so counts stay O(1).
+
+    A source that fails on `distinct_threshold` usernames, or whose failure
+    ratio reaches `failure_ratio` after `min_attempts` attempts, is put in
+    step-up mode for `step_up_duration` seconds; an overall failure ratio
+    above `global_failure_ratio` puts every source in step-up mode. Each
+    observation costs a constant number of hash and counter updates.
+    """
+
+    def __init__(self, distinct_threshold: int = 50, failure_ratio: float = 0.9,
+                 global_failure_ratio: float = 0.5, min_attempts: int = 100,
+                 window: float = 300.0, step_up_duration: Optional[float] = None,
+                 max_sources: int = 10_000, precision: int = 8,
+                 sketch_width: int = 2048, sketch_depth: int = 4,
+                 on_alarm: Optional[Callable[[str, Optional[str]], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize the detector.
+
+        Args:
+            distinct_threshold: Distinct failing usernames per source that alarm
+            failure_ratio: Per-source failure ratio that alarms
+            global_failure_ratio: Overall failure ratio that alarms
+            min_attempts: Attempts needed before a ratio is trusted
+            window: Seconds per statistics generation; two are kept
+            step_up_duration: Seconds an alarm stays active (defaults to window)
+            max_sources: Sources with a distinct-username estimator
+            precision: HyperLogLog precision for each source
+            sketch_width: Count-Min Sketch width
+            sketch_depth: Count-Min Sketch depth
+            on_alarm: Called with (reason, source) when an alarm is raised;
+                      source is None for the global alarm
+            clock: Time source returning seconds
+        """
+        self.distinct_threshold = distinct_threshold
+        self.failure_ratio = failure_ratio
+        self.global_failure_ratio = global_failure_ratio
+        self.min_attempts = min_attempts
+        self.window = window
+        self.step_up_duration = step_up_duration if step_up_duration is not None else window
+        self.max_sources = max_sources
+        self.precision = precision
+        self.on_alarm = on_alarm
+        self.clock = clock
+        # Per-window sketches and totals: index 0 is the current window
+        self._attempts = [CountMinSketch(sketch_width, sketch_depth) for _ in range(2)]
+        self._failures = [CountMinSketch(sketch_width, sketch_depth) for _ in range(2)]
+        self._totals = [[0, 0], [0, 0]]
+        # source -> [window number, usernames in that window, in it and the one before]
+        self._usernames: 'OrderedDict[str, List[Any]]' = OrderedDict()
+        self._flagged: 'OrderedDict[str, float]' = OrderedDict()
+        self._global_until = 0.0
+        self._window_number = 0
+        self._window_start = clock()
+        self._lock = threading.Lock()
+
+    def observe(self, username: str, source: Optional[str], success: bool) -> None:
+        """
+        Record the outcome of one login attempt.
+
+        Args:
+            username: Normalized username attempted
+            source: Client address, or None if unknown
+            success: Whether the credentials were correct
+        """
+        alarms = []
+        now = self.clock()
+        with self._lock:
+            if now - self._window_start >= self.window:
+                self._advance(now)
+            totals = self._totals[0]
+            totals[0] += 1
+            if not success:
+                totals[1] += 1
+            if source is not None:
+                reason = self._observe_source(username, source, success)
+                if reason is not None and self._flagged.get(source, 0.0) <= now:
+                    self._flagged[source] = now + self.step_up_duration
+                    self._flagged.move_to_end(source)
+                    if len(self._flagged) > self.max_sources:
+                        self._flagged.popitem(last=False)
+                    alarms.append((reason, source))
+            attempts = totals[0] + self._totals[1][0]
+            failures = totals[1] + self._totals[1][1]
+            if (attempts >= self.min_attempts and self._global_until <= now
+                    and failures >= self.global_failure_ratio * attempts):
+                self._global_until = now + self.step_up_duration
+                alarms.append(('global failure ratio', None))
+        if self.on_alarm is not None:
+            for reason, source in alarms:
+                self.on_alarm(reason, source)
+
+    def _observe_source(self, username: str, source: str, success: bool) -> Optional[str]:
+        """Update per-source statistics; return an alarm reason, if any."""
+        attempts = self._attempts[0].add(source) + self._attempts[1].estimate(source)
+        if success:
+            return None
+        failures = self._failures[0].add(source) + self._failures[1].estimate(source)
+        entry = self._usernames.get(source)
+        if entry is None or entry[0] < self._window_number - 1:
+            entry = self._usernames[source] = [self._window_number, HyperLogLog(self.precision),
+                                               HyperLogLog(self.precision)]
+            if len(self._usernames) > self.max_sources:
+                self._usernames.popitem(last=False)
+        else:
+            if entry[0] < self._window_number:
+                # Last seen in the previous window: it becomes the overlap's base
+                entry[:] = [self._window_number, HyperLogLog(self.precision), entry[1].copy()]
+            self._usernames.move_to_end(source)
+        entry[1].add(username)
+        if entry[2].add(username) and entry[2].count() >= self.distinct_threshold:
+            return 'distinct usernames'
+        if attempts >= self.min_attempts and failures >= self.failure_ratio * attempts:
+            return 'failure ratio'
+        return None
+
+    def _advance(self, now: float) -> None:
+        """Start a new window, keeping the one that ended; active alarms keep running."""
+        windows = int((now - self._window_start) // self.window)
+        for _ in range(min(windows, 2)):
+            self._attempts.reverse()
+            self._failures.reverse()
+            self._totals.reverse()
+            self._attempts[0].clear()
+            self._failures[0].clear()
+            self._totals[0] = [0, 0]
+        self._window_number += windows
+        self._window_start += windows * self.window
+
+    def requires_step_up(self, source: Optional[str] = None) -> bool:
+        """Check whether logins (from a source) should face extra verification."""
+        now = self.clock()
+        if self._global_until > now:
+            return True
+        return source is not None and self._flagged.get(source, 0.0) > now
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of the current and previous windows."""
+        now = self.clock()
+        with self._lock:
+            return {
+                'attempts': self._totals[0][0] + self._totals[1][0],
+                'failures': self._totals[0][1] + self._totals[1][1],
+                'tracked_sources': len(self._usernames),
+                'flagged_sources': sum(1 for until in self._flagged.values() if until > now),
+                'global_step_up': self._global_until > now,
+            }
+
+
+class TokenRevocationList:
+    """
+    Set of revoked session token IDs, bucketed by token expiry.
+
+    A revoked token only needs remembering until it would have expired
+    anyway, so IDs are filed under their expiry bucket and whole buckets are
+    dropped once they end. Memory is proportional to tokens revoked within
+    one token lifetime. Membership checks touch a single bucket.
+    """
+
+    def __init__(self, bucket_seconds: float = 60.0, clock: Callable[[], float] = time.time):
+        """
+        Initialize the revocation list.
+
+        Args:
+            bucket_seconds: Width of one expiry bucket
+            clock: Time source returning seconds
+        """
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        self._buckets: Dict[int, set] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of revoked IDs currently held."""
+        with self._lock:
+            return sum(len(ids) for ids in self._buckets.values())
+
+    def add(self, token_id: bytes, expires: float) -> None:
+        """Revoke a token ID until its expiry time."""
+        index = int(expires // self.bucket_seconds)
+        with self._lock:
+            self._purge()
+            self._buckets.setdefault(index, set()).add(token_id)
+
+    def contains(self, token_id: bytes, expires: float) -> bool:
+        """Check whether a token ID with the given expiry was revoked."""
+        ids = self._buckets.get(int(expires // self.bucket_seconds))
+        return ids is not None and token_id in ids
+
+    def _purge(self) -> None:
+        """Drop buckets whose tokens have all expired."""
+        current = int(self.clock() // self.bucket_seconds)
+        for index in [index for index in self._buckets if index < current]:
+            del self._buckets[index]
+
+
+class SessionTokens:
+    """
+    Issues and validates stateless, signed session tokens.
+
+    A token is ``<username>.<issued>.<expires>.<mac>``: timestamps in hex
+    seconds and a keyed BLAKE2b MAC over the rest, base64url-encoded.
+    Validation recomputes the MAC and checks expiry without touching the
+    user store. Tokens stop validating when the secret changes, so pass a
+    fixed secret to share tokens between processes or across restarts.
+    """
+
+    def __init__(self, secret: Optional[bytes] = None, ttl: float = 3600.0,
+                 revocations: Optional[TokenRevocationList] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize the token issuer.
+
+        Args:
+            secret: MAC key (random per instance if omitted)
+            ttl: Default token lifetime in seconds
+            revocations: Revocation list (tokens cannot be revoked if omitted)
+            clock: Time source returning seconds
+        """
+        self.secret = secret if secret is not None else secrets.token_bytes(32)
+        self.ttl = ttl
+        self.revocations = revocations
+        self.clock = clock
+
+    def _mac(self, payload: str) -> bytes:
+        """Compute the MAC of a token payload."""
+        return hashlib.blake2b(payload.encode(), key=self.secret, digest_size=16).digest()
+
+    def issue(self, username: str, ttl: Optional[float] = None) -> str:
+        """
+        Create a token for a user.
+
+        Args:
+            username: Normalized username the token identifies
+            ttl: Lifetime in seconds (defaults to the instance ttl)
+
+        Returns:
+            Signed token string
+        """
+        issued = int(self.clock())
+        expires = issued + int(ttl if ttl is not None else self.ttl)
+        payload = f"{username}.{issued:x}.{expires:x}"
+        return f"{payload}.{base64.urlsafe_b64encode(self._mac(payload)).decode().rstrip('=')}"
+
+    def _decode(self, token: str) -> Optional[Tuple[str, int, bytes]]:
+        """Check a token's signature; return (username, expiry, mac) or None."""
+        try:
+            payload, mac = token.rsplit('.', 1)
+            username, _, expires = payload.rsplit('.', 2)
+            expected = base64.urlsafe_b64decode(mac + '=' * (-len(mac) % 4))
+            expires_at = int(expires, 16)
+        except ValueError:
+            return None
+        if not hmac.compare_digest(self._mac(payload), expected):
+            return None
+        return username, expires_at, expected
+
+    def validate(self, token: str) -> Optional[str]:
+        """
+        Check a token.
+
+        Returns:
+            The token's username if it is authentic, unexpired and not
+            revoked, None otherwise
+        """
+        decoded = self._decode(token)
+        if decoded is None:
+            return None
+        username, expires, mac = decoded
+        if expires <= self.clock():
+            return None
+        if self.revocations is not None and self.revocations.contains(mac, expires):
+            return None
+        return username
+
+    def revoke(self, token: str) -> bool:
+        """
+        Revoke a valid token before it expires.
+
+        Returns:
+            True if revoked, False if the token was already invalid or no
+            revocation list is configured
+        """
+        if self.revocations is None or self.validate(token) is None:
+            return False
+        _, expires, mac = self._decode(token)
+        self.revocations.add(mac, expires)
+        return True
+
+
+class LatencyHistogram:
+    """
+    Log-scaled latency histogram over nanosecond samples.
+
+    Each power of two is split into four buckets, so quantiles are accurate
+    to within 25% at any scale using a few dozen counters.
+    """
+
+    SUB_BUCKETS = 4
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def _index(self, value: int) -> int:
+        """Bucket index of a sample."""
+        exponent = value.bit_length()
+        if exponent <= 2:
+            return value
+        return exponent * self.SUB_BUCKETS + ((value >> (exponent - 3)) & 3)
+
+    def _upper_bound(self, index: int) -> int:
+        """Largest value that falls into a bucket."""
+        if index < 3 * self.SUB_BUCKETS:
+            return index
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        return ((4 + sub + 1) << (exponent - 3)) - 1
+
+    def record(self, value: int) -> None:
+        """Add a sample in nanoseconds."""
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum_ns += value
+        if value > self.max_ns:
+            self.max_ns = value
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        """Add another histogram's samples to this one."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_ns += other.sum_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def quantile(self, q: float) -> int:
+        """Approximate the q-quantile (0 <= q <= 1) in nanoseconds."""
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(q * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean and tail quantiles in microseconds."""
+        return {
+            'count': self.total,
+            'mean_us': self.sum_ns / self.total / 1000 if self.total else 0.0,
+            'p50_us': self.quantile(0.5) / 1000,
+            'p99_us': self.quantile(0.99) / 1000,
+            'p999_us': self.quantile(0.999) / 1000,
+            'max_us': self.max_ns / 1000,
+        }
+
+
+class PhaseTimer:
+    """Times consecutive phases of one operation for LoginMetrics."""
+
+    __slots__ = ('metrics', 'operation', 'start', 'last')
+
+    def __init__(self, metrics: 'LoginMetrics', operation: str):
+        self.metrics = metrics
+        self.operation = operation
+        self.start = self.last = time.perf_counter_ns()
+
+    def mark(self, phase: str) -> None:
+        """Close the current phase under the given name."""
+        now = time.perf_counter_ns()
+        self.metrics.record(self.operation, phase, now - self.last)
+        self.last = now
+
+    def finish(self, outcome: str) -> None:
+        """Record the whole operation's latency and count its outcome."""
+        self.metrics.record(self.operation, 'total', time.perf_counter_ns() - self.start)
+        self.metrics.count(self.operation, outcome)
+
+
+class _NullTimer:
+    """Stand-in timer used when metrics are disabled."""
+
+    __slots__ = ()
+
+    def mark(self, phase: str) -> None:
+        pass
+
+    def finish(self, outcome: str) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class LoginMetrics:
+    """
+    Per-phase latency histograms and outcome counters for LoginAuthenticator.
+
+    Login phases are 'normalize', 'lookup' (including lockout checks),
+    'verify' and 'update'; registration phases are 'validate', 'hash' and
+    'update'. Every operation also records a 'total' phase.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def timer(self, operation: str) -> PhaseTimer:
+        """Start timing an operation."""
+        return PhaseTimer(self, operation)
+
+    def record(self, operation: str, phase: str, nanoseconds: int) -> None:
+        """Add a phase latency sample."""
+        key = (operation, phase)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.record(nanoseconds)
+
+    def count(self, operation: str, outcome: str) -> None:
+        """Increment an outcome counter."""
+        key = (operation, outcome)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Export the current metrics.
+
+        Returns:
+            Dictionary with 'counters' ({'operation.outcome': count}) and
+            'phases' ({'operation.phase': histogram summary})
+        """
+        with self._lock:
+            return {
+                'counters': {f"{op}.{outcome}": value
+                             for (op, outcome), value in sorted(self._counters.items())},
+                'phases': {f"{op}.{phase}": histogram.summary()
+                           for (op, phase), histogram in sorted(self._histograms.items())},
+            }
+
+    def reset(self) -> None:
+        """Discard all samples and counts."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+class UserStore(MutableMapping):
+    """
+    Base class for pluggable LoginAuthenticator storage.
+
+    A store maps normalized usernames to records of the form
+    {'password_hash': str, 'failed_attempts': int}. The authenticator never
+    writes through a record it has read; it calls add, record_failure,
+    reset_failures and replace_hash, which persistent stores implement as
+    single atomic statements. The defaults here are read-modify-write over
+    the mapping methods.
+    """
+
+    def add(self, username: str, record: Mapping[str, Any]) -> bool:
+        """
+        Insert a user unless the username is taken.
+
+        Returns:
+            True if inserted, False if the user already exists
+        """
+        if username in self:
+            return False
+        self[username] = record
+        return True
+
+    def record_failure(self, username: str) -> None:
+        """Increment a user's failed-attempt counter."""
+        record = dict(self[username])
+        record['failed_attempts'] += 1
+        self[username] = record
+
+    def reset_failures(self, username: str) -> None:
+        """Set a user's failed-attempt counter to zero."""
+        record = self[username]
+        if record['failed_attempts']:
+            self[username] = {**record, 'failed_attempts': 0}
+
+    def replace_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        """
+        Swap a user's password hash if it still equals old_hash.
+
+        Returns:
+            True if the hash was replaced, False otherwise
+        """
+        record = self.get(username)
+        if record is None or record['password_hash'] != old_hash:
+            return False
+        self[username] = {**record, 'password_hash': new_hash}
+        return True
+
+
+class MemoryUserStore(UserStore):
+    """In-process user store; records are plain dicts updated in place."""
+
+    def __init__(self):
+        self._users: Dict[str, Dict[str, Any]] = {}
+
+    def __contains__(self, username: object) -> bool:
+        return username in self._users
+
+    def __getitem__(self, username: str) -> Dict[str, Any]:
+        return self._users[username]
+
+    def get(self, username: str, default: Any = None) -> Any:
+        return self._users.get(username, default)
+
+    def __setitem__(self, username: str, record: Mapping[str, Any]) -> None:
+        self._users[username] = dict(record)
+
+    def __delitem__(self, username: str) -> None:
+        del self._users[username]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add(self, username: str, record: Mapping[str, Any]) -> bool:
+        record = dict(record)
+        return self._users.setdefault(username, record) is record
+
+    def record_failure(self, username: str) -> None:
+        self._users[username]['failed_attempts'] += 1
+
+    def reset_failures(self, username: str) -> None:
+        self._users[username]['failed_attempts'] = 0
+
+    def replace_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        record = self._users.get(username)
+        if record is None or record['password_hash'] != old_hash:
+            return False
+        record['password_hash'] = new_hash
+        return True
+
+
+class SQLiteUserStore(UserStore):
+    """
+    Persistent user store backed by SQLite.
+
+    The database runs in WAL mode so readers in other threads and processes
+    do not block on writers. Each thread gets its own connection, opened on
+    first use; statements are fixed strings, so sqlite3's statement cache
+    reuses them as prepared statements. Usernames are unique through an
+    index on lower(username), and counter updates are single UPDATE
+    statements, so concurrent failures are never lost.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS users ("
+        " username TEXT NOT NULL,"
+        " password_hash TEXT NOT NULL,"
+        " failed_attempts INTEGER NOT NULL DEFAULT 0)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (lower(username))",
+    )
+    SELECT = "SELECT password_hash, failed_attempts FROM users WHERE lower(username) = lower(?)"
+    EXISTS = "SELECT 1 FROM users WHERE lower(username) = lower(?)"
+    INSERT = ("INSERT INTO users (username, password_hash, failed_attempts) VALUES (?, ?, ?) "
+              "ON CONFLICT (lower(username)) DO NOTHING")
+    UPSERT = ("INSERT INTO users (username, password_hash, failed_attempts) VALUES (?, ?, ?) "
+              "ON CONFLICT (lower(username)) DO UPDATE SET "
+              "password_hash = excluded.password_hash, failed_attempts = excluded.failed_attempts")
+    DELETE = "DELETE FROM users WHERE lower(username) = lower(?)"
+    INCREMENT = "UPDATE users SET failed_attempts = failed_attempts + 1 WHERE lower(username) = lower(?)"
+    RESET = "UPDATE users SET failed_attempts = 0 WHERE lower(username) = lower(?) AND failed_attempts != 0"
+    SWAP = "UPDATE users SET password_hash = ? WHERE lower(username) = lower(?) AND password_hash = ?"
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        """
+        Open or create the database.
+
+        Args:
+            path: Database file path
+            timeout: Seconds to wait for a competing writer's lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit: every statement is its own atomic transaction
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        """Close every connection opened by this store."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def __contains__(self, username: object) -> bool:
+        return self._conn().execute(self.EXISTS, (username,)).fetchone() is not None
+
+    def __getitem__(self, username: str) -> Dict[str, Any]:
+        row = self._conn().execute(self.SELECT, (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+        return {'password_hash': row[0], 'failed_attempts': row[1]}
+
+    def __setitem__(self, username: str, record: Mapping[str, Any]) -> None:
+        self._conn().execute(self.UPSERT, (username, record['password_hash'],
+                                           record['failed_attempts']))
+
+    def __delitem__(self, username: str) -> None:
+        if self._conn().execute(self.DELETE, (username,)).rowcount == 0:
+            raise KeyError(username)
+
+    def __iter__(self) -> Iterator[str]:
+        return (row[0] for row in self._conn().execute("SELECT username FROM users").fetchall())
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def add(self, username: str, record: Mapping[str, Any]) -> bool:
+        cursor = self._conn().execute(self.INSERT, (username, record['password_hash'],
+                                                    record['failed_attempts']))
+        return cursor.rowcount == 1
+
+    def record_failure(self, username: str) -> None:
+        self._conn().execute(self.INCREMENT, (username,))
+
+    def reset_failures(self, username: str) -> None:
+        self._conn().execute(self.RESET, (username,))
+
+    def replace_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        return self._conn().execute(self.SWAP, (new_hash, username, old_hash)).rowcount == 1
+
+
+class UsernameNormalizer:
+    """
+    Maps usernames to case-insensitive keys with NFKC and casefold.
+
+    Compatibility forms and case variants of a name ('ＡＬＩＣＥ', 'Alice')
+    share one key, which str.lower() does not guarantee. ASCII input takes
+    a fast path (NFKC leaves it unchanged and casefold equals lower); other
+    names are memoized in a bounded LRU cache, so hot usernames are
+    normalized once and a flood of random names cannot grow it.
+
+    Stores written before keys were normalized hold non-ASCII users under
+    str.lower(); see NormalizedIndex for how they are found and re-keyed.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        """
+        Initialize the normalizer.
+
+        Args:
+            max_entries: Non-ASCII usernames kept in the memo cache
+        """
+        self.max_entries = max_entries
+        self._memo = functools.lru_cache(maxsize=max_entries)(self._compute)
+
+    @staticmethod
+    def _compute(username: str) -> str:
+        """Normalize without caching."""
+        return unicodedata.normalize('NFKC', username).casefold()
+
+    def __call__(self, username: str) -> str:
+        """Return the key for a username."""
+        if username.isascii():
+            return username.lower()
+        return self._memo(username)
+
+    def cache_info(self) -> Dict[str, int]:
+        """Memo cache hits, misses and size."""
+        info = self._memo.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+
+
+class NormalizedIndex(MutableMapping):
+    """
+    Mapping whose keys are usernames compared after normalization.
+
+    Entries live in a backing mapping under their normalized key, so each
+    is stored once whatever form it is looked up by; LoginAuthenticator
+    reads its UserStore through one. Iteration yields normalized keys.
+
+    Backing mappings written before keys were normalized hold some
+    non-ASCII entries under str.lower(). Lookups by the original spelling
+    still reach them without writing anything; rekey and migrate move them.
+    """
+
+    def __init__(self, normalizer: Optional[UsernameNormalizer] = None,
+                 entries: Optional[MutableMapping] = None):
+        """
+        Initialize the index.
+
+        Args:
+            normalizer: Key normalizer (a new UsernameNormalizer if omitted)
+            entries: Backing mapping (a new dict if omitted); a UserStore
+                     is written with its atomic add
+        """
+        self.normalize = normalizer if normalizer is not None else UsernameNormalizer()
+        self.entries: MutableMapping = entries if entries is not None else {}
+
+    def find(self, username: str, key: Optional[str] = None) -> Tuple[Optional[str], Any]:
+        """
+        Look up an entry without modifying the backing mapping.
+
+        Args:
+            username: Username in any form
+            key: Its normalized key, if already computed
+
+        Returns:
+            (key the entry is stored under, value), or (None, None) if absent
+        """
+        if key is None:
+            key = self.normalize(username)
+        value = self.entries.get(key)
+        if value is not None:
+            return key, value
+        legacy = username.lower()
+        if legacy != key and self.normalize(legacy) == key:
+            value = self.entries.get(legacy)
+            if value is not None:
+                return legacy, value
+        return None, None
+
+    def rekey(self, stored: str) -> bool:
+        """
+        Move an entry from a legacy key to its normalized key.
+
+        Returns:
+            True if moved, False if nothing is stored under `stored` or
+            another entry already holds the normalized key
+        """
+        key = self.normalize(stored)
+        value = self.entries.get(stored)
+        if key == stored or value is None or not self._insert(key, value):
+            return False
+        try:
+            del self.entries[stored]
+        except KeyError:
+            pass  # Moved by a concurrent caller
+        return True
+
+    def migrate(self) -> Dict[str, int]:
+        """
+        Re-key every entry stored under a legacy key.
+
+        Until this runs, a legacy entry is only found by its original
+        spelling, so 'STRASSE1' misses a stored 'straße1'. An entry whose
+        normalized key is already taken is left in place.
+
+        Returns:
+            Dictionary with 'migrated' and 'conflicts' counts
+        """
+        migrated = conflicts = 0
+        for stored in list(self.entries):
+            if self.normalize(stored) == stored:
+                continue
+            if self.rekey(stored):
+                migrated += 1
+            elif stored in self.entries:
+                conflicts += 1
+        return {'migrated': migrated, 'conflicts': conflicts}
+
+    def _insert(self, key: str, value: Any) -> bool:
+        """Store a value unless the key is taken."""
+        if isinstance(self.entries, UserStore):
+            return self.entries.add(key, value)
+        if key in self.entries:
+            return False
+        self.entries[key] = value
+        return True
+
+    def __contains__(self, username: object) -> bool:
+        return isinstance(username, str) and self.find(username)[0] is not None
+
+    def __getitem__(self, username: str) -> Any:
+        stored, value = self.find(username)
+        if stored is None:
+            raise KeyError(username)
+        return value
+
+    def __setitem__(self, username: str, value: Any) -> None:
+        stored = self.find(username)[0]
+        self.entries[stored if stored is not None else self.normalize(username)] = value
+
+    def __delitem__(self, username: str) -> None:
+        stored = self.find(username)[0]
+        if stored is None:
+            raise KeyError(username)
+        del self.entries[stored]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
 
 
 class LoginAuthenticator:
     """Simple login authentication system."""
 
-    def __init__(self):
-        """Initialize the authenticator."""
-        self.users: Dict[str, Dict[str, any]] = {}
+    def __init__(self, hasher: Optional[PasswordHasher] = None,
+                 pool: Optional[KDFPool] = None,
+                 lockout: Optional[LockoutTracker] = None,
+                 ip_lockout: Optional[LockoutTracker] = None,
+                 constant_time: bool = True,
+                 store: Optional[UserStore] = None,
+                 sessions: Optional[SessionTokens] = None,
+                 detector: Optional[CredentialStuffingDetector] = None,
+                 metrics: Optional[LoginMetrics] = None,
+                 normalizer: Optional[UsernameNormalizer] = None):
+        """
+        Initialize the authenticator.
+
+        Args:
+            hasher: Password hasher (scrypt with default cost if omitted)
+            pool: Worker pool for key derivation (a new KDFPool if omitted)
+            lockout: Per-username backoff tracker (no lockout if omitted)
+            ip_lockout: Per-source-IP backoff tracker (no IP lockout if omitted)
+            constant_time: Verify unknown usernames against a dummy hash so
+                           they cost as much as a wrong password
+            store: User storage (a new MemoryUserStore if omitted)
+            sessions: Session token issuer (revocable, random secret if omitted)
+            detector: Credential-stuffing detector fed by every login (optional)
+            metrics: Phase timing and outcome metrics (not collected if omitted)
+            normalizer: Username key normalizer (NFKC + casefold if omitted)
+        """
+        self.users: UserStore = store if store is not None else MemoryUserStore()
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+        self.pool = pool if pool is not None else KDFPool()
+        self.lockout = lockout
+        self.ip_lockout = ip_lockout
+        self.constant_time = constant_time
+        self.sessions = sessions if sessions is not None else SessionTokens(
+            revocations=TokenRevocationList())
+        self.detector = detector
+        self.metrics = metrics
+        self.normalize = normalizer if normalizer is not None else UsernameNormalizer()
+        # Username lookups go through the index; writes use its keys
+        self.index = NormalizedIndex(self.normalize, self.users)
+        # Derived on first use, by a pool worker, so construction stays cheap
+        self._dummy_hash: Optional[str] = None
 
     def validate_username(self, username: str) -> bool:
         """
@@ -45,56 +1358,395 @@ class LoginAuthenticator:
 
         Returns:
             True if registered successfully, False otherwise
+
+        Raises:
+            AuthenticatorBusy: If the hashing queue is full
         """
+        return self._run_flow(self._register_flow(username, password))
+
+    def _register_flow(self, username: str, password: str) -> Generator[_KDFStep, Any, bool]:
+        """Registration steps; yields the password derivation for the caller to run."""
+        timer = self._timer('register')
+        username_lower = self._check_registration(username, password)
+        timer.mark('validate')
+        if username_lower is None:
+            timer.finish('rejected')
+            return False
+
+        password_hash = yield self.hasher.hash, (password,)
+        timer.mark('hash')
+        stored = self._store_user(username_lower, password_hash)
+        timer.mark('update')
+        timer.finish('success' if stored else 'duplicate')
+        return stored
+
+    def _run_flow(self, flow: Generator[_KDFStep, Any, bool]) -> bool:
+        """Drive a login or registration flow, waiting on the pool for each derivation."""
+        try:
+            func, args = next(flow)
+            while True:
+                func, args = flow.send(self.pool.run(func, *args))
+        except StopIteration as done:
+            return done.value
+
+    def _timer(self, operation: str) -> Any:
+        """Start a phase timer, or a no-op one when metrics are off."""
+        return self.metrics.timer(operation) if self.metrics is not None else _NULL_TIMER
+
+    def import_users(self, rows: Iterable[Mapping[str, str]], chunk_size: int = 1000,
+                     checkpoint_path: Optional[str] = None,
+                     executor: Optional[Executor] = None,
+                     workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Bulk-import users from a stream of rows.
+
+        Each row has a 'username' and either a plaintext 'password' or an
+        encoded 'password_hash', which is stored as is (outdated parameters
+        are upgraded on the user's next login) if PasswordHasher.check
+        accepts it. Rows are validated a chunk at a time and plaintext
+        passwords in a chunk are hashed in parallel.
+
+        With checkpoint_path, the number of rows fully processed is saved
+        after every chunk and a later call skips that many rows, so an
+        interrupted import can be rerun with the same input. Rows of the
+        interrupted chunk that were already stored are then reported as
+        duplicates.
+
+        Args:
+            rows: Iterable of row mappings
+            chunk_size: Rows validated and hashed together
+            checkpoint_path: File recording progress (optional)
+            executor: Executor for hashing (a ProcessPoolExecutor if omitted)
+            workers: Worker count for the default executor
+
+        Returns:
+            Dictionary with 'imported', 'processed' (rows consumed in total,
+            including skipped ones), 'resumed_from' (rows skipped) and
+            'rejected' (list of (row index, reason))
+        """
+        start = _read_checkpoint(checkpoint_path) if checkpoint_path else 0
+        remaining = itertools.islice(iter(rows), start, None)
+        report: Dict[str, Any] = {'imported': 0, 'processed': start,
+                                  'resumed_from': start, 'rejected': []}
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(workers)
+        try:
+            while True:
+                chunk = list(itertools.islice(remaining, chunk_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk, report['processed'], executor, report)
+                report['processed'] += len(chunk)
+                if checkpoint_path:
+                    _write_checkpoint(checkpoint_path, report['processed'])
+        finally:
+            if own_executor:
+                executor.shutdown()
+        return report
+
+    def _import_chunk(self, chunk: List[Mapping[str, str]], position: int,
+                      executor: Executor, report: Dict[str, Any]) -> None:
+        """Validate, hash and store one chunk of import rows."""
+        rejected = report['rejected']
+        seen: Set[str] = set()
+        accepted: List[Tuple[int, str, Optional[str]]] = []
+        plaintext: List[str] = []
+        for index, row in enumerate(chunk, position):
+            reason = self._import_rejection(row, seen)
+            if reason is not None:
+                rejected.append((index, reason))
+                continue
+            username_lower = self.normalize(row['username'])
+            seen.add(username_lower)
+            password_hash = row.get('password_hash')
+            accepted.append((index, username_lower, password_hash))
+            if password_hash is None:
+                plaintext.append(row['password'])
+
+        # Batch process-pool tasks so pickling overhead stays small per password
+        hashes = iter(executor.map(self.hasher.hash, plaintext,
+                                   chunksize=max(1, len(plaintext) // 32)))
+        for index, username_lower, password_hash in accepted:
+            if password_hash is None:
+                password_hash = next(hashes)
+            if self._store_user(username_lower, password_hash):
+                report['imported'] += 1
+            else:
+                rejected.append((index, 'duplicate'))
+
+    def _import_rejection(self, row: Mapping[str, str], seen: Set[str]) -> Optional[str]:
+        """Return why an import row is rejected, or None if it is acceptable."""
+        username = row.get('username') or ''
+        if not self.validate_username(username):
+            return 'invalid username'
+        password_hash = row.get('password_hash')
+        if password_hash is not None:
+            try:
+                PasswordHasher.check(password_hash)
+            except (ValueError, TypeError, AttributeError):
+                return 'invalid hash'
+        elif not self.validate_password(row.get('password') or ''):
+            return 'invalid password'
+        username_lower = self.normalize(username)
+        if username_lower in seen or self.index.find(username, username_lower)[0] is not None:
+            return 'duplicate'
+        return None
+
+    def _check_registration(self, username: str, password: str) -> Optional[str]:
+        """Validate a registration; return the storage key, or None if rejected."""
         # Validate inputs
         if not self.validate_username(username):
-            return False
+            return None
 
         if not self.validate_password(password):
-            return False
+            return None
 
         # Check if user already exists
-        username_lower = username.lower()
-        if username_lower in self.users:
-            return False
+        username_lower = self.normalize(username)
+        if self.index.find(username, username_lower)[0] is not None:
+            return None
+
+        return username_lower
 
-        # Register user
-        self.users[username_lower] = {
-            'password': password,
+    def _store_user(self, username_lower: str, password_hash: str) -> bool:
+        """Insert a hashed user unless another registration won the race."""
+        user = {
+            'password_hash': password_hash,
             'failed_attempts': 0
         }
+        return self.users.add(username_lower, user)
 
-        return True
-
-    def login(self, username: str, password: str) -> bool:
+    def login(self, username: str, password: str, source_ip: Optional[str] = None,
+              step_up_verified: bool = False) -> bool:
         """
         Authenticate a login attempt.
 
+        Locked usernames and source IPs are rejected before any password
+        verification is done. So are logins the detector wants extra
+        verification for (see requires_step_up), unless the caller has
+        already run its own challenge, such as a CAPTCHA or one-time code,
+        and passes step_up_verified.
+
         Args:
             username: Username to authenticate
             password: Password to verify
+            source_ip: Client address for per-IP lockout (optional)
+            step_up_verified: The client passed the caller's step-up challenge
 
         Returns:
             True if credentials are correct, False otherwise
+
+        Raises:
+            AuthenticatorBusy: If the hashing queue is full
         """
-        username_lower = username.lower()
+        return self._run_flow(self._login_flow(username, password, source_ip, step_up_verified))
 
-        # Check if user exists
-        if username_lower not in self.users:
+    def _login_flow(self, username: str, password: str, source_ip: Optional[str],
+                    step_up_verified: bool = False) -> Generator[_KDFStep, Any, bool]:
+        """Login steps; yields the password verification for the caller to run."""
+        timer = self._timer('login')
+        username_lower = self.normalize(username)
+        timer.mark('normalize')
+        if self._locked_out(username_lower, source_ip):
+            timer.mark('lookup')
+            timer.finish('locked')
             return False
+        if not step_up_verified and self.requires_step_up(source_ip):
+            timer.mark('lookup')
+            timer.finish('step_up')
+            return False
+
+        stored, user = self.index.find(username, username_lower)
+        if stored is not None and stored != username_lower:
+            # A login writes to the record, so move a legacy user first
+            self.index.rekey(stored)
+            user = self.users.get(username_lower)
+        timer.mark('lookup')
 
-        user = self.users[username_lower]
+        # Check if user exists, spending the same verification work either way
+        if user is None:
+            if self.constant_time:
+                yield self._verify_dummy, (password,)
+            timer.mark('verify')
+            self._record_failure(username_lower, source_ip)
+            timer.mark('update')
+            timer.finish('unknown')
+            return False
+
+        # Check password on the worker pool
+        matched = yield self.hasher.verify, (password, user['password_hash'])
+        timer.mark('verify')
+        result = self._record_attempt(username_lower, user, matched, password, source_ip)
+        timer.mark('update')
+        timer.finish('success' if result else 'failure')
+        return result
+
+    def login_session(self, username: str, password: str, source_ip: Optional[str] = None,
+                      step_up_verified: bool = False) -> Optional[str]:
+        """
+        Authenticate a login attempt and issue a session token.
+
+        Args:
+            username: Username to authenticate
+            password: Password to verify
+            source_ip: Client address for per-IP lockout (optional)
+            step_up_verified: The client passed the caller's step-up challenge
+
+        Returns:
+            Session token if credentials are correct, None otherwise
+        """
+        if not self.login(username, password, source_ip, step_up_verified):
+            return None
+        return self.sessions.issue(self.normalize(username))
+
+    def validate_session(self, token: str) -> Optional[str]:
+        """
+        Validate a session token without a user lookup.
+
+        Returns:
+            Username the token was issued to, or None if invalid
+        """
+        return self.sessions.validate(token)
+
+    def revoke_session(self, token: str) -> bool:
+        """
+        Revoke a session token.
+
+        Returns:
+            True if revoked, False otherwise
+        """
+        return self.sessions.revoke(token)
+
+    def _get_dummy_hash(self) -> str:
+        """Return a hash of a random password under the current policy."""
+        dummy = self._dummy_hash
+        if dummy is None or self.hasher.needs_rehash(dummy):
+            dummy = self._dummy_hash = self.hasher.hash(secrets.token_urlsafe(16))
+        return dummy
+
+    def _verify_dummy(self, password: str) -> bool:
+        """Verify against the dummy hash; runs on the pool, as it may derive one."""
+        return self.hasher.verify(password, self._get_dummy_hash())
+
+    def is_locked_out(self, username: str, source_ip: Optional[str] = None) -> bool:
+        """
+        Check whether logins for a username or from a source IP are locked.
+
+        Args:
+            username: Username to check
+            source_ip: Client address to check (optional)
 
-        # Check password
-        if user['password'] == password:
+        Returns:
+            True if either is currently locked, False otherwise
+        """
+        return self._locked_out(self.normalize(username), source_ip)
+
+    def _locked_out(self, username_lower: str, source_ip: Optional[str]) -> bool:
+        """Check lockout state for an already normalized username."""
+        if self.lockout is not None and self.lockout.is_locked(username_lower):
+            return True
+        return (source_ip is not None and self.ip_lockout is not None
+                and self.ip_lockout.is_locked(source_ip))
+
+    def requires_step_up(self, source_ip: Optional[str] = None) -> bool:
+        """
+        Check whether the detector wants extra verification for a source.
+
+        login refuses such attempts unless step_up_verified is passed, so
+        callers check this first and challenge the client when it is True.
+
+        Args:
+            source_ip: Client address (optional)
+
+        Returns:
+            True if credential stuffing is suspected, False otherwise
+        """
+        return self.detector is not None and self.detector.requires_step_up(source_ip)
+
+    def _record_failure(self, username_lower: str, source_ip: Optional[str]) -> None:
+        """Count a failed attempt against the username and source IP."""
+        if self.detector is not None:
+            self.detector.observe(username_lower, source_ip, False)
+        if self.lockout is not None:
+            self.lockout.record_failure(username_lower)
+        if source_ip is not None and self.ip_lockout is not None:
+            self.ip_lockout.record_failure(source_ip)
+
+    def _record_attempt(self, username_lower: str, user: Dict[str, Any], matched: bool,
+                        password: str, source_ip: Optional[str] = None) -> bool:
+        """Update failed-attempt tracking after a password check."""
+        if matched:
             # Successful login - reset failed attempts
-            user['failed_attempts'] = 0
+            if user['failed_attempts']:
+                self.users.reset_failures(username_lower)
+            if self.lockout is not None:
+                self.lockout.reset(username_lower)
+            if self.detector is not None:
+                self.detector.observe(username_lower, source_ip, True)
+            self._schedule_rehash(username_lower, user, password)
             return True
         else:
             # Failed login - increment counter
-            user['failed_attempts'] += 1
+            self.users.record_failure(username_lower)
+            self._record_failure(username_lower, source_ip)
             return False
 
+    def _schedule_rehash(self, username_lower: str, user: Dict[str, Any], password: str) -> None:
+        """
+        Upgrade an outdated hash in the background after a successful login.
+
+        The login returns without waiting for the new derivation. The upgrade
+        is skipped when the hashing queue is full (it is retried on the next
+        login) and dropped if the hash changed while it was computed.
+        """
+        old_hash = user['password_hash']
+        if not self.hasher.needs_rehash(old_hash):
+            return
+        try:
+            self.pool.submit(self._rehash, username_lower, old_hash, password)
+        except AuthenticatorBusy:
+            pass
+
+    def _rehash(self, username_lower: str, old_hash: str, password: str) -> None:
+        """Derive a hash under the current policy and swap it in if unchanged."""
+        self.users.replace_hash(username_lower, old_hash, self.hasher.hash(password))
+
+    def hash_parameter_report(self, batch_size: int = 10_000) -> Dict[str, Any]:
+        """
+        Count users by stored hash parameters.
+
+        Users are scanned in batches, yielding the GIL between batches, so
+        the report can run in a background thread alongside logins.
+
+        Args:
+            batch_size: Users inspected per batch
+
+        Returns:
+            Dictionary with 'total', 'outdated' (hashes weaker than the
+            current policy) and 'by_parameters' ({'algorithm$cost': count})
+        """
+        usernames = list(self.users)
+        by_parameters: Dict[str, int] = {}
+        outdated = 0
+        for start in range(0, len(usernames), batch_size):
+            for username in usernames[start:start + batch_size]:
+                user = self.users.get(username)
+                if user is None:
+                    continue
+                encoded = user['password_hash']
+                algorithm, cost = encoded.split('$', 3)[1:3]
+                label = f"{algorithm}${cost}"
+                by_parameters[label] = by_parameters.get(label, 0) + 1
+                if self.hasher.needs_rehash(encoded):
+                    outdated += 1
+            time.sleep(0)
+        return {
+            'total': sum(by_parameters.values()),
+            'outdated': outdated,
+            'by_parameters': by_parameters,
+        }
+
     def get_failed_attempts(self, username: str) -> int:
         """
         Get number of failed login attempts for a user.
@@ -105,12 +1757,11 @@ class LoginAuthenticator:
         Returns:
             Number of failed attempts, or 0 if user doesn't exist
         """
-        username_lower = username.lower()
-
-        if username_lower not in self.users:
+        user = self.index.find(username)[1]
+        if user is None:
             return 0
 
-        return self.users[username_lower]['failed_attempts']
+        return user['failed_attempts']
 
     def user_exists(self, username: str) -> bool:
         """
@@ -122,4 +1773,94 @@ class LoginAuthenticator:
         Returns:
             True if user exists, False otherwise
         """
-        return username.lower() in self.users
+        return self.index.find(username)[0] is not None
+
+    def migrate_keys(self) -> Dict[str, int]:
+        """
+        Re-key users stored under legacy lower() keys.
+
+        Run once after upgrading a store written before usernames were
+        normalized. Until then, lookups reach a legacy user only by its
+        original spelling, and a login by that spelling re-keys it. A legacy
+        user whose normalized key is already taken is left in place and
+        counted as a conflict.
+
+        Returns:
+            Dictionary with 'migrated' and 'conflicts' counts
+        """
+        return self.index.migrate()
+
+
+def _read_checkpoint(path: str) -> int:
+    """Return the row position saved in an import checkpoint, or 0."""
+    try:
+        with open(path) as f:
+            return json.load(f)['position']
+    except FileNotFoundError:
+        return 0
+
+
+def _write_checkpoint(path: str, position: int) -> None:
+    """Atomically save an import position."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'position': position}, f)
+    os.replace(tmp_path, path)
+
+
+class AsyncLoginAuthenticator:
+    """
+    asyncio facade over LoginAuthenticator.
+
+    Validation and lookups run inline; key derivation is awaited on the
+    authenticator's KDFPool, so the event loop never blocks on hashing.
+    Calls raise AuthenticatorBusy when the hashing queue is full.
+    """
+
+    def __init__(self, authenticator: Optional[LoginAuthenticator] = None):
+        """
+        Initialize the async facade.
+
+        Args:
+            authenticator: Authenticator to wrap (a new one if omitted)
+        """
+        self.authenticator = authenticator if authenticator is not None else LoginAuthenticator()
+
+    async def register_user(self, username: str, password: str) -> bool:
+        """Register a new user without blocking the event loop."""
+        return await self._run_flow(self.authenticator._register_flow(username, password))
+
+    async def login(self, username: str, password: str, source_ip: Optional[str] = None,
+                    step_up_verified: bool = False) -> bool:
+        """Authenticate a login attempt without blocking the event loop."""
+        return await self._run_flow(self.authenticator._login_flow(
+            username, password, source_ip, step_up_verified))
+
+    async def _run_flow(self, flow: Generator[_KDFStep, Any, bool]) -> bool:
+        """Drive a login or registration flow, awaiting each derivation on the pool."""
+        pool = self.authenticator.pool
+        try:
+            func, args = next(flow)
+            while True:
+                result = await asyncio.wrap_future(pool.submit(func, *args))
+                func, args = flow.send(result)
+        except StopIteration as done:
+            return done.value
+
+    async def login_session(self, username: str, password: str,
+                            source_ip: Optional[str] = None,
+                            step_up_verified: bool = False) -> Optional[str]:
+        """Authenticate and issue a session token without blocking the event loop."""
+        if not await self.login(username, password, source_ip, step_up_verified):
+            return None
+        auth = self.authenticator
+        return auth.sessions.issue(auth.normalize(username))
+
+    async def validate_session(self, token: str) -> Optional[str]:
+        return self.authenticator.validate_session(token)
+
+    async def get_failed_attempts(self, username: str) -> int:
+        return self.authenticator.get_failed_attempts(username)
+
+    async def user_exists(self, username: str) -> bool:
+        return self.authenticator.user_exists(username)
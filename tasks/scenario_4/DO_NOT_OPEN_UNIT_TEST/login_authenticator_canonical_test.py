@@ -0,0 +1,851 @@
+import asyncio
+import base64
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+# Load the reference implementation under a unique name so it does not clash
+# with the canonical solutions of other scenarios in the same test session.
+_spec = importlib.util.spec_from_file_location(
+    "login_authenticator_canonical",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "canonical_solution.py"))
+canonical = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = canonical
+_spec.loader.exec_module(canonical)
+
+# Cheap work factor so the suite stays fast
+FAST_COST = 10
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class CountingHasher(canonical.PasswordHasher):
+    """Hasher that counts verifications."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.verifications = 0
+
+    def verify(self, password, encoded):
+        self.verifications += 1
+        return super().verify(password, encoded)
+
+
+def make_authenticator(**kwargs):
+    """Build an authenticator with a fast hasher."""
+    kwargs.setdefault('hasher', canonical.PasswordHasher(cost=FAST_COST))
+    return canonical.LoginAuthenticator(**kwargs)
+
+
+class TestPasswordHashing(unittest.TestCase):
+    """Test suite for hashed password storage and the KDF pool."""
+
+    def test_password_not_stored(self):
+        """Test that only a salted hash is stored."""
+        auth = make_authenticator()
+        auth.register_user("alice", "secret123")
+
+        user = auth.users["alice"]
+        self.assertNotIn('password', user)
+        self.assertNotIn("secret123", user['password_hash'])
+        self.assertTrue(user['password_hash'].startswith(f"$scrypt${FAST_COST}$"))
+        self.assertTrue(auth.login("Alice", "secret123"))
+        self.assertFalse(auth.login("alice", "secret124"))
+
+    def test_salts_differ(self):
+        """Test that equal passwords produce different hashes."""
+        auth = make_authenticator()
+        auth.register_user("alice", "secret123")
+        auth.register_user("bobby", "secret123")
+
+        self.assertNotEqual(auth.users["alice"]['password_hash'],
+                            auth.users["bobby"]['password_hash'])
+
+    def test_pbkdf2(self):
+        """Test the PBKDF2 algorithm with configurable iterations."""
+        hasher = canonical.PasswordHasher('pbkdf2_sha256', cost=1000)
+        encoded = hasher.hash("secret123")
+
+        self.assertTrue(encoded.startswith("$pbkdf2_sha256$1000$"))
+        self.assertTrue(hasher.verify("secret123", encoded))
+        self.assertFalse(hasher.verify("secret12", encoded))
+        with self.assertRaises(ValueError):
+            canonical.PasswordHasher('md5')
+
+    def test_queue_limit(self):
+        """Test that a full hashing queue rejects work instead of queueing it."""
+        pool = canonical.KDFPool(max_workers=1, max_queue=1)
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(release.wait)
+        auth = make_authenticator(pool=pool)
+
+        self.assertEqual(pool.depth, 2)
+        with self.assertRaises(canonical.AuthenticatorBusy):
+            auth.register_user("alice", "secret123")
+        release.set()
+        running.result()
+        queued.result()
+        self.assertTrue(auth.register_user("alice", "secret123"))
+        self.assertEqual(pool.depth, 0)
+
+    def test_sync_calls_raise_when_busy(self):
+        """Test that sync register and login surface a full queue as AuthenticatorBusy."""
+        pool = canonical.KDFPool(max_workers=1, max_queue=0)
+        self.addCleanup(pool.shutdown)
+        auth = make_authenticator(pool=pool)
+        self.assertTrue(auth.register_user("alice", "secret123"))
+        release = threading.Event()
+        running = pool.submit(release.wait)
+
+        with self.assertRaises(canonical.AuthenticatorBusy):
+            auth.register_user("bobby", "secret123")
+        with self.assertRaises(canonical.AuthenticatorBusy):
+            auth.login("alice", "secret123")
+        with self.assertRaises(canonical.AuthenticatorBusy):
+            auth.login("ghost", "secret123")
+        release.set()
+        running.result()
+        self.assertFalse(auth.user_exists("bobby"))
+        self.assertEqual(auth.get_failed_attempts("alice"), 0)
+        self.assertTrue(auth.login("alice", "secret123"))
+
+
+class TestHashMigration(unittest.TestCase):
+    """Test suite for stored hash parameters and rehash-on-login."""
+
+    def wait_for_upgrade(self, auth):
+        """Wait until background rehash jobs have finished."""
+        for _ in range(500):
+            if auth.pool.depth == 0:
+                return
+            threading.Event().wait(0.01)
+        self.fail("rehash did not finish")
+
+    def test_old_hashes_verify_under_new_policy(self):
+        """Test that verification uses the parameters stored with the hash."""
+        old = canonical.PasswordHasher(cost=FAST_COST)
+        new = canonical.PasswordHasher('pbkdf2_sha256', cost=2000)
+        encoded = old.hash("secret123")
+
+        self.assertTrue(new.verify("secret123", encoded))
+        self.assertTrue(new.needs_rehash(encoded))
+        self.assertFalse(old.needs_rehash(encoded))
+        self.assertFalse(canonical.PasswordHasher(cost=FAST_COST - 1).needs_rehash(encoded))
+
+    def test_upgrade_on_login(self):
+        """Test that a successful login upgrades an outdated hash."""
+        auth = make_authenticator()
+        auth.register_user("alice", "secret123")
+        auth.register_user("bobby", "secret123")
+        auth.hasher = canonical.PasswordHasher(cost=FAST_COST + 1)
+
+        self.assertFalse(auth.login("alice", "wrong-password"))
+        self.wait_for_upgrade(auth)
+        self.assertTrue(auth.users["alice"]['password_hash'].startswith(f"$scrypt${FAST_COST}$"))
+
+        self.assertTrue(auth.login("alice", "secret123"))
+        self.wait_for_upgrade(auth)
+        self.assertTrue(auth.users["alice"]['password_hash'].startswith(f"$scrypt${FAST_COST + 1}$"))
+        self.assertTrue(auth.login("alice", "secret123"))
+
+        report = auth.hash_parameter_report(batch_size=1)
+        self.assertEqual(report, {
+            'total': 2,
+            'outdated': 1,
+            'by_parameters': {f"scrypt${FAST_COST}": 1, f"scrypt${FAST_COST + 1}": 1},
+        })
+
+    def test_upgrade_skipped_when_busy(self):
+        """Test that a full hashing queue defers the upgrade without failing login."""
+        pool = canonical.KDFPool(max_workers=1, max_queue=0)
+        self.addCleanup(pool.shutdown)
+        auth = make_authenticator(pool=pool)
+        auth.register_user("alice", "secret123")
+        user = auth.users["alice"]
+        old_hash = user['password_hash']
+        auth.hasher = canonical.PasswordHasher(cost=FAST_COST + 1)
+
+        release = threading.Event()
+        blocker = pool.submit(release.wait)
+        # Record a verified login while the only worker is busy
+        self.assertTrue(auth._record_attempt("alice", user, True, "secret123"))
+        release.set()
+        blocker.result()
+        self.wait_for_upgrade(auth)
+        self.assertEqual(auth.users["alice"]['password_hash'], old_hash)
+
+
+class TestLockout(unittest.TestCase):
+    """Test suite for progressive lockout."""
+
+    def test_exponential_backoff(self):
+        """Test that lock durations double past the threshold and then expire."""
+        clock = FakeClock()
+        tracker = canonical.LockoutTracker(threshold=3, base_delay=10, max_delay=60,
+                                           window=300, clock=clock)
+        for _ in range(2):
+            tracker.record_failure("alice")
+        self.assertFalse(tracker.is_locked("alice"))
+
+        tracker.record_failure("alice")
+        self.assertEqual(tracker.locked_until("alice"), clock.now + 10)
+        tracker.record_failure("alice")
+        self.assertEqual(tracker.locked_until("alice"), clock.now + 20)
+        for _ in range(5):
+            tracker.record_failure("alice")
+        self.assertEqual(tracker.locked_until("alice"), clock.now + 60)
+
+        clock.advance(61)
+        self.assertFalse(tracker.is_locked("alice"))
+        # Failures still count inside the window, so the next one relocks
+        tracker.record_failure("alice")
+        self.assertTrue(tracker.is_locked("alice"))
+
+        clock.advance(400)
+        self.assertFalse(tracker.is_locked("alice"))
+        self.assertEqual(len(tracker), 0)
+
+    def test_memory_bounded(self):
+        """Test that spraying random usernames cannot grow state without bound."""
+        clock = FakeClock()
+        tracker = canonical.LockoutTracker(window=120, bucket_seconds=60, max_keys=100,
+                                           clock=clock)
+        for i in range(5000):
+            tracker.record_failure(f"user{i}")
+            if i % 1000 == 999:
+                clock.advance(30)
+
+        self.assertLessEqual(len(tracker), 300)
+
+    def test_locked_user_skips_verification(self):
+        """Test that locked users are rejected without hashing."""
+        clock = FakeClock()
+        hasher = CountingHasher(cost=FAST_COST)
+        auth = make_authenticator(hasher=hasher, lockout=canonical.LockoutTracker(
+            threshold=2, base_delay=30, clock=clock))
+        auth.register_user("alice", "secret123")
+
+        self.assertFalse(auth.login("alice", "wrong-password"))
+        self.assertFalse(auth.login("alice", "wrong-password"))
+        self.assertTrue(auth.is_locked_out("ALICE"))
+        self.assertFalse(auth.login("alice", "secret123"))
+        self.assertEqual(hasher.verifications, 2)
+        self.assertEqual(auth.get_failed_attempts("alice"), 2)
+
+        clock.advance(31)
+        self.assertTrue(auth.login("alice", "secret123"))
+        self.assertFalse(auth.is_locked_out("alice"))
+        self.assertEqual(auth.get_failed_attempts("alice"), 0)
+
+    def test_ip_lockout(self):
+        """Test that one source failing across many usernames is locked out."""
+        clock = FakeClock()
+        auth = make_authenticator(ip_lockout=canonical.LockoutTracker(
+            threshold=5, base_delay=60, clock=clock))
+        auth.register_user("alice", "secret123")
+        for i in range(5):
+            self.assertFalse(auth.login(f"victim{i}", "secret123", source_ip="203.0.113.9"))
+
+        self.assertFalse(auth.login("alice", "secret123", source_ip="203.0.113.9"))
+        self.assertTrue(auth.login("alice", "secret123", source_ip="198.51.100.7"))
+        self.assertTrue(auth.login("alice", "secret123"))
+
+
+def ks_statistic(a, b):
+    """Two-sample Kolmogorov-Smirnov statistic: max distance between CDFs."""
+    a, b = sorted(a), sorted(b)
+    i = j = 0
+    distance = 0.0
+    while i < len(a) and j < len(b):
+        if a[i] <= b[j]:
+            i += 1
+        else:
+            j += 1
+        distance = max(distance, abs(i / len(a) - j / len(b)))
+    return distance
+
+
+class TestConstantTimeLogin(unittest.TestCase):
+    """Test suite for enumeration-resistant login timing."""
+
+    SAMPLES = 30
+
+    def login_timings(self, auth):
+        """Time interleaved wrong-password and unknown-user logins."""
+        existing, missing = [], []
+        for i in range(self.SAMPLES):
+            for username, samples in (("alice", existing), (f"ghost{i}", missing)):
+                start = time.perf_counter()
+                self.assertFalse(auth.login(username, "wrong-password"))
+                samples.append(time.perf_counter() - start)
+        return existing, missing
+
+    def test_unknown_user_indistinguishable(self):
+        """Test that latency distributions match for existing and missing users."""
+        auth = make_authenticator(hasher=canonical.PasswordHasher(cost=FAST_COST + 2))
+        auth.register_user("alice", "secret123")
+
+        existing, missing = self.login_timings(auth)
+        # Critical value for n = m = 30 at alpha = 0.001 is about 0.5
+        self.assertLess(ks_statistic(existing, missing), 0.5)
+
+    def test_timing_oracle_without_constant_time(self):
+        """Test that the statistic detects the gap when the mode is off."""
+        auth = make_authenticator(hasher=canonical.PasswordHasher(cost=FAST_COST + 2),
+                                  constant_time=False)
+        auth.register_user("alice", "secret123")
+
+        existing, missing = self.login_timings(auth)
+        self.assertGreater(ks_statistic(existing, missing), 0.9)
+
+    def test_dummy_hash_follows_policy(self):
+        """Test that the dummy hash is regenerated when the policy changes."""
+        auth = make_authenticator()
+        auth.hasher = canonical.PasswordHasher(cost=FAST_COST + 1)
+
+        self.assertFalse(auth.login("ghost", "secret123"))
+        self.assertFalse(auth.hasher.needs_rehash(auth._dummy_hash))
+
+    def test_dummy_hash_is_lazy(self):
+        """Test that the dummy hash is derived on first use, on the pool."""
+        threads = []
+
+        class RecordingHasher(canonical.PasswordHasher):
+            def hash(self, password):
+                threads.append(threading.current_thread().name)
+                return super().hash(password)
+
+        auth = make_authenticator(hasher=RecordingHasher(cost=FAST_COST))
+        self.assertEqual(threads, [])
+
+        async def scenario():
+            return await canonical.AsyncLoginAuthenticator(auth).login("ghost", "secret123")
+
+        self.assertFalse(asyncio.run(scenario()))
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('kdf'))
+
+
+class TestSQLiteUserStore(unittest.TestCase):
+    """Test suite for the SQLite user store."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.path = os.path.join(self.tmpdir, "users.db")
+
+    def open_store(self):
+        store = canonical.SQLiteUserStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def test_persists_across_reopen(self):
+        """Test that users and counters survive a restart."""
+        store = self.open_store()
+        auth = make_authenticator(store=store)
+        self.assertTrue(auth.register_user("Alice", "secret123"))
+        self.assertFalse(auth.register_user("ALICE", "secret123"))
+        self.assertFalse(auth.login("alice", "wrong-password"))
+        store.close()
+
+        auth = make_authenticator(store=self.open_store())
+        self.assertTrue(auth.user_exists("alice"))
+        self.assertEqual(auth.get_failed_attempts("alice"), 1)
+        self.assertTrue(auth.login("alice", "secret123"))
+        self.assertEqual(auth.get_failed_attempts("alice"), 0)
+        self.assertEqual(list(auth.users), ["alice"])
+        self.assertEqual(len(auth.users), 1)
+
+    def test_unique_lowercase_index(self):
+        """Test that usernames differing only in case collide."""
+        store = self.open_store()
+        record = {'password_hash': "$scrypt$10$AA$AA", 'failed_attempts': 0}
+
+        self.assertTrue(store.add("bobby", record))
+        self.assertFalse(store.add("BOBBY", record))
+        self.assertIn("Bobby", store)
+        store["BoBbY"] = {**record, 'failed_attempts': 3}
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store["bobby"]['failed_attempts'], 3)
+        del store["bobby"]
+        self.assertNotIn("bobby", store)
+        with self.assertRaises(KeyError):
+            del store["bobby"]
+
+    def test_concurrent_failures_not_lost(self):
+        """Test that failed-attempt increments from many threads all land."""
+        store = self.open_store()
+        store.add("carol", {'password_hash': "$scrypt$10$AA$AA", 'failed_attempts': 0})
+
+        def fail_many():
+            for _ in range(50):
+                store.record_failure("carol")
+
+        threads = [threading.Thread(target=fail_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store["carol"]['failed_attempts'], 200)
+
+    def test_rehash_persists(self):
+        """Test that an upgraded hash is written back to the database."""
+        auth = make_authenticator(store=self.open_store())
+        auth.register_user("alice", "secret123")
+        old_hash = auth.users["alice"]['password_hash']
+        auth.hasher = canonical.PasswordHasher(cost=FAST_COST + 1)
+
+        self.assertTrue(auth.login("alice", "secret123"))
+        TestHashMigration.wait_for_upgrade(self, auth)
+        self.assertFalse(auth.users.replace_hash("alice", old_hash, "$scrypt$1$AA$AA"))
+        self.assertFalse(auth.hasher.needs_rehash(auth.users["alice"]['password_hash']))
+
+
+class TestSessionTokens(unittest.TestCase):
+    """Test suite for signed session tokens."""
+
+    def test_issue_and_validate(self):
+        """Test that a successful login yields a token naming the user."""
+        auth = make_authenticator()
+        auth.register_user("Alice", "secret123")
+
+        token = auth.login_session("ALICE", "secret123")
+        self.assertEqual(auth.validate_session(token), "alice")
+        self.assertIsNone(auth.login_session("alice", "wrong-password"))
+        self.assertIsNone(auth.login_session("nobody", "secret123"))
+
+    def test_tampered_tokens_rejected(self):
+        """Test that altered or foreign tokens do not validate."""
+        tokens = canonical.SessionTokens()
+        token = tokens.issue("alice")
+        payload, mac = token.rsplit('.', 1)
+        username, issued, expires = payload.split('.')
+
+        self.assertIsNone(tokens.validate(f"bobby.{issued}.{expires}.{mac}"))
+        self.assertIsNone(tokens.validate(f"{username}.{issued}.{int(expires, 16) + 1:x}.{mac}"))
+        self.assertIsNone(tokens.validate(f"{payload}.{mac[:-2]}"))
+        self.assertIsNone(tokens.validate("garbage"))
+        self.assertIsNone(canonical.SessionTokens().validate(token))
+
+    def test_expiry_and_revocation(self):
+        """Test expiry and that revoked IDs are dropped once they expire."""
+        clock = FakeClock()
+        revocations = canonical.TokenRevocationList(bucket_seconds=10, clock=clock)
+        tokens = canonical.SessionTokens(ttl=60, revocations=revocations, clock=clock)
+        kept = tokens.issue("alice")
+        revoked = tokens.issue("alice", ttl=30)
+
+        self.assertTrue(tokens.revoke(revoked))
+        self.assertFalse(tokens.revoke(revoked))
+        self.assertIsNone(tokens.validate(revoked))
+        self.assertEqual(tokens.validate(kept), "alice")
+
+        clock.advance(61)
+        self.assertIsNone(tokens.validate(kept))
+        tokens.revoke(tokens.issue("bobby"))
+        self.assertEqual(len(revocations), 1)
+
+    def test_validation_cheaper_than_login(self):
+        """Test that token validation is far cheaper than a hashed login."""
+        auth = make_authenticator(hasher=canonical.PasswordHasher(cost=FAST_COST + 2))
+        auth.register_user("alice", "secret123")
+
+        start = time.perf_counter()
+        token = auth.login_session("alice", "secret123")
+        login_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(1000):
+            auth.validate_session(token)
+        validate_time = (time.perf_counter() - start) / 1000
+        self.assertLess(validate_time * 100, login_time)
+
+
+class TestImportUsers(unittest.TestCase):
+    """Test suite for bulk user import."""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_import_and_report_rejections(self):
+        """Test that valid rows are imported and bad rows reported by index."""
+        auth = make_authenticator()
+        auth.register_user("taken", "secret123")
+        legacy_hash = canonical.PasswordHasher('pbkdf2_sha256', cost=1000).hash("legacy123")
+        rows = [
+            {'username': "alice", 'password': "secret123"},
+            {'username': "ab", 'password': "secret123"},
+            {'username': "bobby", 'password': "short"},
+            {'username': "ALICE", 'password': "secret123"},
+            {'username': "Taken", 'password': "secret123"},
+            {'username': "carol", 'password_hash': legacy_hash},
+            {'username': "dave1", 'password_hash': "not-a-hash"},
+        ]
+
+        report = auth.import_users(rows, chunk_size=3, executor=self.executor)
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(report['processed'], 7)
+        self.assertEqual(report['rejected'], [
+            (1, 'invalid username'), (2, 'invalid password'), (3, 'duplicate'),
+            (4, 'duplicate'), (6, 'invalid hash'),
+        ])
+        self.assertTrue(auth.login("alice", "secret123"))
+        self.assertEqual(auth.users["carol"]['password_hash'], legacy_hash)
+        self.assertTrue(auth.login("carol", "legacy123"))
+
+    def test_import_rejects_unusable_hash_parameters(self):
+        """Test that hashes which could not be verified at login are rejected."""
+        auth = make_authenticator()
+        salt = base64.b64encode(b"s" * 16).decode()
+        digest = base64.b64encode(b"d" * 32).decode()
+        rows = [
+            {'username': "scrypt1", 'password_hash': f"$scrypt$1${salt}${digest}"},
+            {'username': "pbkdf0", 'password_hash': f"$pbkdf2_sha256$0${salt}${digest}"},
+            {'username': "pbkdfbig", 'password_hash': f"$pbkdf2_sha256$999999999${salt}${digest}"},
+            {'username': "nosalt", 'password_hash': f"$scrypt$14$${digest}"},
+            {'username': "short", 'password_hash': f"$scrypt$14${salt}$AAAA"},
+            {'username': "nothash", 'password_hash': 42},
+            {'username': "valid", 'password_hash': f"$scrypt$14${salt}${digest}"},
+        ]
+
+        report = auth.import_users(rows, executor=self.executor)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['rejected'], [(index, 'invalid hash') for index in range(6)])
+        self.assertTrue(auth.user_exists("valid"))
+
+    def test_resume_from_checkpoint(self):
+        """Test that an interrupted import resumes after the last full chunk."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        checkpoint = os.path.join(tmpdir, "import.json")
+        rows = [{'username': f"user{i}", 'password': "secret123"} for i in range(10)]
+
+        def interrupted():
+            yield from rows[:7]
+            raise KeyboardInterrupt
+
+        auth = make_authenticator()
+        with self.assertRaises(KeyboardInterrupt):
+            auth.import_users(interrupted(), chunk_size=3, checkpoint_path=checkpoint,
+                              executor=self.executor)
+        self.assertEqual(len(auth.users), 6)
+
+        report = auth.import_users(rows, chunk_size=3, checkpoint_path=checkpoint,
+                                   executor=self.executor)
+        self.assertEqual(report['resumed_from'], 6)
+        self.assertEqual(report['imported'], 4)
+        self.assertEqual(report['processed'], 10)
+        self.assertEqual(len(auth.users), 10)
+
+    def test_process_pool(self):
+        """Test hashing on the default process pool."""
+        auth = make_authenticator()
+        rows = [{'username': f"user{i}", 'password': "secret123"} for i in range(4)]
+
+        report = auth.import_users(rows, workers=2)
+        self.assertEqual(report['imported'], 4)
+        self.assertTrue(auth.login("user3", "secret123"))
+
+
+class TestCredentialStuffingDetection(unittest.TestCase):
+    """Test suite for the sketches and the stuffing detector."""
+
+    def test_hyperloglog_accuracy(self):
+        """Test that the estimate is within a few standard errors."""
+        hll = canonical.HyperLogLog(precision=10)
+        for i in range(20_000):
+            hll.add(f"user{i}")
+            hll.add(f"user{i // 2}")
+
+        self.assertAlmostEqual(hll.count(), 20_000, delta=20_000 * 0.1)
+        small = canonical.HyperLogLog(precision=10)
+        for i in range(50):
+            small.add(f"user{i}")
+        self.assertAlmostEqual(small.count(), 50, delta=3)
+
+    def test_count_min_never_undercounts(self):
+        """Test that estimates are upper bounds of the true counts."""
+        sketch = canonical.CountMinSketch(width=64, depth=3)
+        for i in range(1000):
+            sketch.add(f"ip{i % 200}", count=i % 7 + 1)
+        for i in range(200):
+            true_count = sum(j % 7 + 1 for j in range(i, 1000, 200))
+            self.assertGreaterEqual(sketch.estimate(f"ip{i}"), true_count)
+        sketch.clear()
+        self.assertEqual(sketch.estimate("ip0"), 0)
+
+    def test_spraying_source_flagged(self):
+        """Test that one source failing across many usernames raises an alarm."""
+        clock = FakeClock()
+        alarms = []
+        detector = canonical.CredentialStuffingDetector(
+            distinct_threshold=50, global_failure_ratio=1.1, window=60,
+            on_alarm=lambda reason, source: alarms.append((reason, source)), clock=clock)
+        for i in range(100):
+            detector.observe(f"victim{i}", "203.0.113.9", False)
+            detector.observe("alice", "198.51.100.7", i % 10 != 0)
+
+        self.assertEqual(alarms, [('distinct usernames', "203.0.113.9")])
+        self.assertTrue(detector.requires_step_up("203.0.113.9"))
+        self.assertFalse(detector.requires_step_up("198.51.100.7"))
+        clock.advance(61)
+        self.assertFalse(detector.requires_step_up("203.0.113.9"))
+
+    def test_low_and_slow_global_alarm(self):
+        """Test that failures spread thinly over many sources trip the global alarm."""
+        detector = canonical.CredentialStuffingDetector(min_attempts=200, max_sources=50,
+                                                        clock=FakeClock())
+        for i in range(400):
+            detector.observe(f"victim{i}", f"10.0.{i // 256}.{i % 256}", i % 5 == 0)
+
+        self.assertTrue(detector.requires_step_up())
+        self.assertTrue(detector.requires_step_up("192.0.2.1"))
+        stats = detector.stats()
+        self.assertEqual(stats['flagged_sources'], 0)
+        self.assertEqual(stats['tracked_sources'], 50)
+
+    def test_authenticator_feeds_detector(self):
+        """Test that logins report outcomes and expose step-up mode."""
+        detector = canonical.CredentialStuffingDetector(distinct_threshold=5,
+                                                        global_failure_ratio=1.1)
+        auth = make_authenticator(detector=detector)
+        auth.register_user("alice", "secret123")
+        for i in range(5):
+            auth.login(f"victim{i}", "secret123", source_ip="203.0.113.9")
+
+        self.assertTrue(auth.requires_step_up("203.0.113.9"))
+        self.assertFalse(auth.requires_step_up("198.51.100.7"))
+        self.assertTrue(auth.login("alice", "secret123", source_ip="198.51.100.7"))
+        self.assertEqual(detector.stats()['attempts'], 6)
+
+    def test_attempts_split_across_windows_are_caught(self):
+        """Test that staying under the threshold in each fixed window still alarms."""
+        clock = FakeClock()
+        detector = canonical.CredentialStuffingDetector(
+            distinct_threshold=50, global_failure_ratio=1.1, window=60, clock=clock)
+        for i in range(40):
+            detector.observe(f"victim{i}", "203.0.113.9", False)
+        clock.advance(60)
+        self.assertFalse(detector.requires_step_up("203.0.113.9"))
+        for i in range(40, 80):
+            detector.observe(f"victim{i}", "203.0.113.9", False)
+        self.assertTrue(detector.requires_step_up("203.0.113.9"))
+
+        # Statistics older than two windows are forgotten
+        clock.advance(180)
+        for i in range(40):
+            detector.observe(f"victim{i}", "198.51.100.7", False)
+        clock.advance(120)
+        for i in range(40, 80):
+            detector.observe(f"victim{i}", "198.51.100.7", False)
+        self.assertFalse(detector.requires_step_up("198.51.100.7"))
+
+    def test_login_enforces_step_up(self):
+        """Test that flagged sources must pass the caller's step-up challenge."""
+        detector = canonical.CredentialStuffingDetector(distinct_threshold=5,
+                                                        global_failure_ratio=1.1)
+        metrics = canonical.LoginMetrics()
+        auth = make_authenticator(detector=detector, metrics=metrics)
+        auth.register_user("alice", "secret123")
+        for i in range(5):
+            auth.login(f"victim{i}", "secret123", source_ip="203.0.113.9")
+
+        self.assertFalse(auth.login("alice", "secret123", source_ip="203.0.113.9"))
+        self.assertIsNone(auth.login_session("alice", "secret123", source_ip="203.0.113.9"))
+        self.assertEqual(metrics.snapshot()['counters']['login.step_up'], 2)
+        self.assertTrue(auth.login("alice", "secret123", source_ip="203.0.113.9",
+                                   step_up_verified=True))
+        async_auth = canonical.AsyncLoginAuthenticator(auth)
+        self.assertFalse(asyncio.run(async_auth.login("alice", "secret123", "203.0.113.9")))
+        self.assertTrue(asyncio.run(async_auth.login("alice", "secret123", "203.0.113.9",
+                                                     step_up_verified=True)))
+
+
+class TestLoginMetrics(unittest.TestCase):
+    """Test suite for phase timing and outcome counters."""
+
+    def test_histogram_quantiles(self):
+        """Test that quantiles land within one bucket of the true value."""
+        histogram = canonical.LatencyHistogram()
+        for value in range(1, 10_001):
+            histogram.record(value * 1000)
+
+        for q in (0.5, 0.99, 0.999):
+            true_value = q * 10_000 * 1000
+            self.assertGreaterEqual(histogram.quantile(q), true_value)
+            self.assertLessEqual(histogram.quantile(q), true_value * 1.25)
+        self.assertEqual(histogram.quantile(1.0), 10_000_000)
+        self.assertEqual(canonical.LatencyHistogram().quantile(0.5), 0)
+
+    def test_login_phases_and_counters(self):
+        """Test that every login outcome and phase is recorded."""
+        metrics = canonical.LoginMetrics()
+        auth = make_authenticator(metrics=metrics)
+        auth.register_user("alice", "secret123")
+        auth.register_user("alice", "secret123")
+        auth.register_user("ab", "secret123")
+        auth.login("alice", "secret123")
+        auth.login("alice", "wrong-password")
+        auth.login("ghost", "secret123")
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {
+            'login.failure': 1, 'login.success': 1, 'login.unknown': 1,
+            'register.rejected': 2, 'register.success': 1,
+        })
+        for phase in ('normalize', 'lookup', 'verify', 'update', 'total'):
+            self.assertEqual(snapshot['phases'][f"login.{phase}"]['count'], 3)
+        self.assertEqual(snapshot['phases']['register.hash']['count'], 1)
+        phases = snapshot['phases']
+        self.assertGreater(phases['login.verify']['mean_us'], phases['login.lookup']['mean_us'])
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {'counters': {}, 'phases': {}})
+
+
+class TestUsernameNormalization(unittest.TestCase):
+    """Test suite for NFKC + casefold username keys."""
+
+    def test_equivalent_forms_share_a_key(self):
+        """Test that width, case and compatibility variants collide."""
+        normalize = canonical.UsernameNormalizer()
+
+        self.assertEqual(normalize("ＡＬＩＣＥ"), "alice")
+        self.assertEqual(normalize("Straße"), normalize("STRASSE"))
+        self.assertEqual(normalize("ǅemal"), normalize("DŽEMAL"))
+        self.assertEqual(normalize("Bob"), "bob")
+
+    def test_memo_is_bounded(self):
+        """Test that repeated names hit the memo and the memo stays bounded."""
+        normalize = canonical.UsernameNormalizer(max_entries=8)
+        for _ in range(3):
+            normalize("Ｃａｒｏｌ")
+        normalize("alice")
+        for i in range(100):
+            normalize(f"ü{i}")
+
+        info = normalize.cache_info()
+        self.assertEqual(info['hits'], 2)
+        self.assertEqual(info['misses'], 101)
+        self.assertEqual(info['size'], 8)
+
+    def test_authenticator_rejects_lookalike_registration(self):
+        """Test that a fullwidth variant cannot register beside the original."""
+        auth = make_authenticator()
+        self.assertTrue(auth.register_user("alice1", "secret123"))
+
+        self.assertFalse(auth.register_user("ａｌｉｃｅ１", "secret123"))
+        self.assertTrue(auth.user_exists("ＡＬＩＣＥ１"))
+        self.assertTrue(auth.login("ａｌｉｃｅ１", "secret123"))
+        token = auth.login_session("ALICE1", "secret123")
+        self.assertEqual(auth.validate_session(token), "alice1")
+
+    def test_normalized_index(self):
+        """Test the reusable index keeps one entry per normalized name."""
+        index = canonical.NormalizedIndex()
+        index["Ａlice"] = 1
+        index["ALICE"] = 2
+
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index["alice"], 2)
+        self.assertEqual(list(index), ["alice"])
+        self.assertNotIn(42, index)
+        del index["ＡＬＩＣＥ"]
+        self.assertNotIn("alice", index)
+
+    def test_normalized_index_legacy_reads_do_not_write(self):
+        """Test that legacy lower() keys are found read-only and moved by migrate."""
+        entries = {"ｂｏｂ": 1, "straße": 2, "strasse": 3}
+        index = canonical.NormalizedIndex(entries=entries)
+
+        self.assertEqual(index.find("ＢＯＢ"), ("ｂｏｂ", 1))
+        self.assertEqual(index["ＢＯＢ"], 1)
+        self.assertNotIn("BOB", index)
+        self.assertEqual(entries, {"ｂｏｂ": 1, "straße": 2, "strasse": 3})
+
+        self.assertEqual(index.migrate(), {'migrated': 1, 'conflicts': 1})
+        self.assertEqual(entries, {"bob": 1, "straße": 2, "strasse": 3})
+
+    def test_legacy_keys_are_migrated(self):
+        """Test that users stored under lower() keys are found and re-keyed."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, "users.db")
+        store = canonical.SQLiteUserStore(path)
+        self.addCleanup(store.close)
+        auth = make_authenticator(store=store)
+        password_hash = auth.hasher.hash("secret123")
+        for name, failures in (("Straße1", 0), ("ＢＯＢ１２", 2), ("ＤＡＮ１２３", 0)):
+            store.add(name.lower(), {'password_hash': password_hash, 'failed_attempts': failures})
+        store.add("dan123", {'password_hash': password_hash, 'failed_attempts': 0})
+
+        # Lookups by the original spelling find their user without moving it
+        self.assertFalse(auth.register_user("Straße1", "secret456"))
+        self.assertTrue(auth.user_exists("Straße1"))
+        self.assertEqual(auth.get_failed_attempts("ＢＯＢ１２"), 2)
+        self.assertFalse(auth.user_exists("STRASSE1"))
+        self.assertEqual(sorted(store), ["dan123", "straße1", "ｂｏｂ１２", "ｄａｎ１２３"])
+
+        # A login by the original spelling re-keys its user
+        self.assertTrue(auth.login("ＢＯＢ１２", "secret123"))
+        self.assertEqual(auth.get_failed_attempts("bob12"), 0)
+        self.assertNotIn("ｂｏｂ１２", store)
+
+        store.add("Ｅｖｅ１２".lower(), {'password_hash': password_hash, 'failed_attempts': 0})
+        self.assertEqual(auth.migrate_keys(), {'migrated': 2, 'conflicts': 1})
+        self.assertFalse(auth.register_user("EVE12", "secret456"))
+        self.assertEqual(sorted(store), ["bob12", "dan123", "eve12", "strasse1", "ｄａｎ１２３"])
+
+        reopened = canonical.SQLiteUserStore(path)
+        self.addCleanup(reopened.close)
+        auth = make_authenticator(store=reopened)
+        self.assertTrue(auth.login("Strasse1", "secret123"))
+        self.assertTrue(auth.login("eve12", "secret123"))
+
+
+class TestAsyncLoginAuthenticator(unittest.TestCase):
+    """Test suite for the async facade."""
+
+    def test_async_register_and_login(self):
+        """Test concurrent async registrations and logins."""
+        async def scenario():
+            auth = canonical.AsyncLoginAuthenticator(make_authenticator())
+            names = [f"user{i}" for i in range(8)]
+            registered = await asyncio.gather(
+                *(auth.register_user(name, "secret123") for name in names))
+            self.assertTrue(all(registered))
+            self.assertFalse(await auth.register_user("USER0", "secret123"))
+            self.assertFalse(await auth.register_user("ab", "secret123"))
+
+            results = await asyncio.gather(
+                *(auth.login(name, "secret123") for name in names),
+                auth.login("user0", "wrong-password"),
+                auth.login("nobody", "secret123"))
+            self.assertEqual(results, [True] * 8 + [False, False])
+            self.assertEqual(await auth.get_failed_attempts("user0"), 1)
+            self.assertTrue(await auth.user_exists("User1"))
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+Benchmark suite for the user profile manager reference implementation.
+
+Usage:
+    python bench_user_profile_manager.py [--sizes 10000,100000] [--queries N]
+                                         [--backends dict,columnar,sqlite] [--memory]
+                                         [--json PATH]
+
+For every store size and backend it measures:
+  - create_profile throughput (index maintenance included)
+  - get_profile latency for a small set of hot usernames
+  - rebuild_indexes time from an existing `profiles` dict (dict backend)
+  - search_by_age latency (mean, p50, p99) at several selectivities,
+    against the original scan-and-sort implementation as a baseline
+  - search_by_location latency for selective and broad substrings,
+    against the original lowercase-and-scan implementation
+
+The dict backend keeps per-user dicts plus secondary indexes; the columnar
+backend (ColumnarProfiles) answers searches with column scans, vectorised
+when NumPy is installed; the sqlite backend (SQLiteProfileStore, in a
+temporary directory) loads profiles in one batch and pushes searches down
+to SQL. With --memory a separate build runs under
+tracemalloc to report bytes per profile; this is slow, so try
+--sizes 1000000 --queries 5 before attempting 10M users.
+
+Results are printed as a table and, with --json, written as flat records
+({size, benchmark, ...metrics}).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List
+
+import canonical_solution
+from canonical_solution import ColumnarProfiles, SQLiteProfileStore, UserProfileManager
+
+LOCATIONS = ("New York", "San Francisco", "Paris", "New Jersey", "Berlin", "Tokyo",
+             "Newcastle", "York", "Sao Paulo", "Lagos")
+AGE_THRESHOLDS = (13, 60, 110)
+LOCATION_QUERIES = ("lagos", "new", "o", "zurich")
+
+BACKENDS: Dict[str, Callable[[], UserProfileManager]] = {
+    'dict': UserProfileManager,
+    'columnar': lambda: UserProfileManager(store=ColumnarProfiles()),
+    'sqlite': lambda: UserProfileManager(store=SQLiteProfileStore(
+        os.path.join(tempfile.mkdtemp(prefix='bench-profiles-'), 'profiles.db'))),
+}
+
+
+def percentiles(samples: List[int]) -> Dict[str, float]:
+    """Summarize nanosecond samples as microsecond mean/p50/p99."""
+    samples = sorted(samples)
+    return {
+        'mean_us': sum(samples) / len(samples) / 1000,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000,
+    }
+
+
+def time_calls(func: Callable[[Any], Any], args: List[Any]) -> Dict[str, float]:
+    """Time one call per argument and summarize the latencies."""
+    clock = time.perf_counter_ns
+    samples = []
+    for arg in args:
+        start = clock()
+        func(arg)
+        samples.append(clock() - start)
+    return percentiles(samples)
+
+
+def scan_by_age(manager: UserProfileManager, min_age: int) -> List[str]:
+    """The original search_by_age: scan every profile, then sort."""
+    return sorted(profile['username'] for profile in manager.profiles.values()
+                  if profile['age'] >= min_age)
+
+
+def scan_by_location(manager: UserProfileManager, location: str) -> List[str]:
+    """The original search_by_location: lowercase and test every profile."""
+    location = location.lower()
+    return sorted(profile['username'] for profile in manager.profiles.values()
+                  if location in profile['location'].lower())
+
+
+def build(size: int, backend: str = 'dict', seed: int = 42) -> UserProfileManager:
+    """Create a manager holding `size` random profiles."""
+    rng = random.Random(seed)
+    manager = BACKENDS[backend]()
+    batch = getattr(manager.store, 'batch', None)
+    with batch() if batch is not None else nullcontext():
+        for i in range(size):
+            manager.create_profile(f"u{rng.getrandbits(48):x}{i}", f"user{i}@example.com",
+                                   rng.randint(13, 120), bio="", location=rng.choice(LOCATIONS))
+    return manager
+
+
+def dispose(manager: UserProfileManager) -> None:
+    """Close a SQLite-backed manager and remove its database."""
+    if isinstance(manager.store, SQLiteProfileStore):
+        manager.store.close()
+        shutil.rmtree(os.path.dirname(manager.store.path), ignore_errors=True)
+
+
+def measure_memory(size: int, backend: str) -> Dict[str, Any]:
+    """Bytes allocated by a freshly built manager, via tracemalloc."""
+    tracemalloc.start()
+    manager = build(size, backend)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    dispose(manager)
+    return {'mbytes': allocated / 2 ** 20, 'bytes_per_profile': allocated / size}
+
+
+def bench_size(size: int, queries: int, backend: str, memory: bool) -> List[Dict[str, Any]]:
+    """Run every benchmark for one store size and backend."""
+    results = []
+    base = {'size': size, 'backend': backend}
+
+    if memory:
+        results.append({**base, 'benchmark': 'memory', **measure_memory(size, backend)})
+
+    start = time.perf_counter()
+    manager = build(size, backend)
+    elapsed = time.perf_counter() - start
+    results.append({**base, 'benchmark': 'create_profile', 'ops_per_sec': size / elapsed})
+    try:
+        results.extend(bench_searches(manager, base, queries))
+    finally:
+        dispose(manager)
+    return results
+
+
+def bench_searches(manager: UserProfileManager, base: Dict[str, Any],
+                   queries: int) -> List[Dict[str, Any]]:
+    """Time lookups and searches on a loaded manager."""
+    results = []
+    hot = sorted(manager.profiles)[:100]
+    results.append({**base, 'benchmark': 'get_profile hot',
+                    **time_calls(manager.get_profile, hot * max(1, queries // 2))})
+
+    # The scan baselines walk per-user dicts, so they only apply to that backend.
+    baselines = manager.store is None
+    if baselines:
+        start = time.perf_counter()
+        manager.rebuild_indexes()
+        results.append({**base, 'benchmark': 'rebuild_indexes',
+                        'seconds': time.perf_counter() - start})
+
+    for min_age in AGE_THRESHOLDS:
+        args = [min_age] * queries
+        results.append({**base, 'benchmark': f'age>={min_age}',
+                        'matches': len(manager.search_by_age(min_age)),
+                        **time_calls(manager.search_by_age, args)})
+        if baselines:
+            results.append({**base, 'benchmark': f'age>={min_age} scan',
+                            **time_calls(lambda age: scan_by_age(manager, age), args)})
+
+    for query in LOCATION_QUERIES:
+        args = [query] * queries
+        results.append({**base, 'benchmark': f'location~{query!r}',
+                        'matches': len(manager.search_by_location(query)),
+                        **time_calls(manager.search_by_location, args)})
+        if baselines:
+            results.append({**base, 'benchmark': f'location~{query!r} scan',
+                            **time_calls(lambda loc: scan_by_location(manager, loc), args)})
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    """Print results one line per record."""
+    for row in results:
+        label = f"{row['size']:>9} {row['backend']:<8} {row['benchmark']:<24}"
+        metrics = ", ".join(f"{key}={value:,}" if isinstance(value, int) else f"{key}={value:,.2f}"
+                            for key, value in row.items()
+                            if key not in ('size', 'backend', 'benchmark'))
+        print(f"{label} {metrics}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10000,100000', help='comma-separated store sizes')
+    parser.add_argument('--queries', type=int, default=20, help='calls per latency measurement')
+    parser.add_argument('--backends', default='dict,columnar,sqlite',
+                        help=f"comma-separated subset of {','.join(BACKENDS)}")
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure bytes per profile with tracemalloc')
+    parser.add_argument('--json', help='write results to this file as JSON')
+    args = parser.parse_args()
+
+    backends = args.backends.split(',')
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        for backend in backends:
+            results.extend(bench_size(size, args.queries, backend, args.memory))
+    print_table(results)
+
+    if args.json:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'numpy': canonical_solution.np is not None,
+                'timestamp': time.time(),
+                'args': vars(args),
+            },
+            'results': results,
+        }
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
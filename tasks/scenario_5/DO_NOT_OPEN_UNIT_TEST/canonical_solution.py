@@ -1,12 +1,1112 @@
-from typing import Dict, List, Optional, Any
+import functools
+import heapq
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # columnar scans fall back to plain loops
+    np = None
+
+PROFILE_FIELDS = ('username', 'email', 'age', 'bio', 'location')
+
+
+@functools.lru_cache(maxsize=10_000)
+def _fold_unicode(text: str) -> str:
+    """NFKC-normalize and casefold, memoized."""
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def _fold(text: str) -> str:
+    """
+    Case-insensitive form of a username or search text.
+
+    NFKC plus casefold, so compatibility forms and case variants ('ＡＬＩＣＥ',
+    'Straße' and 'STRASSE') compare equal, which str.lower() does not
+    guarantee. ASCII text takes a lower() fast path; other strings are
+    memoized in a bounded cache, so hot usernames are normalized once.
+    """
+    if text.isascii():
+        return text.lower()
+    return _fold_unicode(text)
+
+
+class SortedKeyList:
+    """
+    Sorted list of strings split into bounded chunks.
+
+    Chunks hold at most 2 * LOAD items and are located by bisecting each
+    chunk's last item, so inserts and removals shift one small chunk rather
+    than the whole list; iteration walks the chunks in order.
+    """
+
+    LOAD = 512
+
+    def __init__(self, items: Iterable[str] = ()):
+        """
+        Initialize the list.
+
+        Args:
+            items: Initial items, in any order
+        """
+        ordered = sorted(items)
+        self._chunks: List[List[str]] = [ordered[i:i + self.LOAD]
+                                         for i in range(0, len(ordered), self.LOAD)]
+        self._maxes: List[str] = [chunk[-1] for chunk in self._chunks]
+        self._len = len(ordered)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        return chain.from_iterable(self._chunks)
+
+    def __contains__(self, value: object) -> bool:
+        if not self._maxes:
+            return False
+        index = bisect_left(self._maxes, value)
+        if index == len(self._maxes):
+            return False
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, value)
+        return position < len(chunk) and chunk[position] == value
+
+    def iter_from(self, after: Optional[str] = None) -> Iterator[str]:
+        """Iterate in order over the values greater than `after` (all if None)."""
+        if after is None:
+            return iter(self)
+        index = bisect_right(self._maxes, after)
+        if index == len(self._maxes):
+            return iter(())
+        chunk = self._chunks[index]
+        return chain(chunk[bisect_right(chunk, after):],
+                     chain.from_iterable(self._chunks[index + 1:]))
+
+    def add(self, value: str) -> None:
+        """Insert a value in order."""
+        if not self._maxes:
+            self._chunks.append([value])
+            self._maxes.append(value)
+        else:
+            index = min(bisect_left(self._maxes, value), len(self._maxes) - 1)
+            chunk = self._chunks[index]
+            insort(chunk, value)
+            self._maxes[index] = chunk[-1]
+            if len(chunk) > 2 * self.LOAD:
+                self._chunks.insert(index + 1, chunk[self.LOAD:])
+                del chunk[self.LOAD:]
+                self._maxes.insert(index, chunk[-1])
+        self._len += 1
+
+    def remove(self, value: str) -> bool:
+        """
+        Remove one occurrence of a value.
+
+        Returns:
+            True if removed, False if the value was not present
+        """
+        index = bisect_left(self._maxes, value)
+        if index == len(self._maxes):
+            return False
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, value)
+        if position == len(chunk) or chunk[position] != value:
+            return False
+        del chunk[position]
+        if chunk:
+            self._maxes[index] = chunk[-1]
+        else:
+            del self._chunks[index]
+            del self._maxes[index]
+        self._len -= 1
+        return True
+
+
+class AgeIndex:
+    """
+    Secondary index from age to usernames, kept in username order.
+
+    Each distinct age owns a SortedKeyList of usernames and the distinct
+    ages are kept sorted, so a range query bisects to the matching ages and
+    merges their already-ordered runs. The work is proportional to the
+    result size rather than to the number of profiles, and it never
+    re-sorts unordered data.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[int, str]] = ()):
+        """
+        Initialize the index.
+
+        Args:
+            entries: Initial (age, username) pairs, sorted in bulk
+        """
+        grouped: Dict[int, List[str]] = {}
+        for age, username in entries:
+            grouped.setdefault(age, []).append(username)
+        self._buckets: Dict[int, SortedKeyList] = {
+            age: SortedKeyList(usernames) for age, usernames in grouped.items()}
+        self._ages: List[int] = sorted(self._buckets)
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def add(self, age: int, username: str) -> None:
+        """Index a username under an age."""
+        bucket = self._buckets.get(age)
+        if bucket is None:
+            bucket = self._buckets[age] = SortedKeyList()
+            insort(self._ages, age)
+        bucket.add(username)
+
+    def remove(self, age: int, username: str) -> None:
+        """Drop a username from an age."""
+        bucket = self._buckets.get(age)
+        if bucket is not None and bucket.remove(username) and not bucket:
+            del self._buckets[age]
+            del self._ages[bisect_left(self._ages, age)]
+
+    def _runs(self, min_age: Optional[int], max_age: Optional[int]) -> List[SortedKeyList]:
+        """Buckets for the ages in [min_age, max_age]."""
+        start = 0 if min_age is None else bisect_left(self._ages, min_age)
+        stop = len(self._ages) if max_age is None else bisect_right(self._ages, max_age)
+        return [self._buckets[age] for age in self._ages[start:stop]]
+
+    def count(self, min_age: Optional[int] = None, max_age: Optional[int] = None) -> int:
+        """Number of usernames with an age in [min_age, max_age]."""
+        return sum(len(run) for run in self._runs(min_age, max_age))
+
+    def range(self, min_age: Optional[int] = None, max_age: Optional[int] = None) -> List[str]:
+        """
+        List usernames with an age in [min_age, max_age], in username order.
+
+        Timsort detects the presorted per-age runs and only merges them.
+        """
+        runs = self._runs(min_age, max_age)
+        if len(runs) == 1:
+            return list(runs[0])
+        return sorted(chain.from_iterable(runs))
+
+    def iter_range(self, min_age: Optional[int] = None, max_age: Optional[int] = None,
+                   after: Optional[str] = None) -> Iterator[str]:
+        """
+        Lazily yield usernames with an age in [min_age, max_age], in order.
+
+        Args:
+            min_age: Minimum age, inclusive (optional)
+            max_age: Maximum age, inclusive (optional)
+            after: Only yield usernames greater than this one (optional)
+        """
+        return heapq.merge(*(run.iter_from(after) for run in self._runs(min_age, max_age)))
+
+
+class ValueIndex:
+    """Secondary index from a case-insensitive value (see _fold) to usernames in order."""
+
+    def __init__(self):
+        self._buckets: Dict[str, SortedKeyList] = {}
+
+    def add(self, value: str, username: str) -> None:
+        """Index a username under a value."""
+        key = _fold(value)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = SortedKeyList()
+        bucket.add(username)
+
+    def remove(self, value: str, username: str) -> None:
+        """Drop a username from a value."""
+        key = _fold(value)
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.remove(username) and not bucket:
+            del self._buckets[key]
+
+    def count(self, value: str) -> int:
+        """Number of usernames under a value."""
+        bucket = self._buckets.get(_fold(value))
+        return len(bucket) if bucket is not None else 0
+
+    def iter_value(self, value: str, after: Optional[str] = None) -> Iterator[str]:
+        """Yield the usernames under a value in order, starting after `after`."""
+        bucket = self._buckets.get(_fold(value))
+        return bucket.iter_from(after) if bucket is not None else iter(())
+
+
+class TrigramIndex:
+    """
+    Case-insensitive substring index over a text field.
+
+    Usernames are grouped by their folded value (see _fold), and an inverted index
+    maps every trigram to the distinct values containing it. Many profiles
+    share a value (a city, say), so postings stay small. A query of three or
+    more characters intersects the postings of its trigrams, smallest
+    first, then verifies the surviving values with a substring test.
+    Shorter queries scan the distinct values instead of the profiles.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, SortedKeyList] = {}
+        self._postings: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        """All three-character substrings of text."""
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, value: str, username: str) -> None:
+        """Index a username under a field value."""
+        key = _fold(value)
+        users = self._users.get(key)
+        if users is None:
+            users = self._users[key] = SortedKeyList()
+            for trigram in self._trigrams(key):
+                self._postings.setdefault(trigram, set()).add(key)
+        users.add(username)
+
+    def remove(self, value: str, username: str) -> None:
+        """Drop a username from a field value."""
+        key = _fold(value)
+        users = self._users.get(key)
+        if users is None or not users.remove(username) or users:
+            return
+        del self._users[key]
+        for trigram in self._trigrams(key):
+            posting = self._postings[trigram]
+            posting.discard(key)
+            if not posting:
+                del self._postings[trigram]
+
+    def matching_values(self, query: str) -> List[str]:
+        """Distinct folded values containing query (case-insensitive)."""
+        query = _fold(query)
+        if len(query) < 3:
+            return [key for key in self._users if query in key]
+        postings = []
+        for trigram in self._trigrams(query):
+            posting = self._postings.get(trigram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return [key for key in candidates if query in key]
+
+    def count(self, query: str) -> int:
+        """Number of usernames whose value contains query."""
+        return sum(len(self._users[key]) for key in self.matching_values(query))
+
+    def search(self, query: str) -> List[str]:
+        """Sorted usernames whose value contains query."""
+        runs = [self._users[key] for key in self.matching_values(query)]
+        if len(runs) == 1:
+            return list(runs[0])
+        return sorted(chain.from_iterable(runs))
+
+    def iter_match(self, query: str, after: Optional[str] = None) -> Iterator[str]:
+        """Lazily yield usernames whose value contains query, in order."""
+        return heapq.merge(*(self._users[key].iter_from(after)
+                             for key in self.matching_values(query)))
+
+
+class ProfileStore(MutableMapping):
+    """
+    Alternative backing storage for UserProfileManager.
+
+    Keys are folded usernames (see _fold) and values are profile mappings with the
+    fields in PROFILE_FIELDS. A manager given a store keeps no secondary
+    indexes of its own and delegates searches to the store; the defaults
+    here scan every profile.
+    """
+
+    def add(self, key: str, profile: Mapping) -> bool:
+        """Insert a profile unless the key is taken; return whether it was added."""
+        if key in self:
+            return False
+        self[key] = profile
+        return True
+
+    def set_field(self, key: str, field: str, value: Any) -> None:
+        """Change one field of an existing profile."""
+        self[key][field] = value
+
+    def usernames(self) -> List[str]:
+        """Display usernames of every profile, in no particular order."""
+        return [profile['username'] for profile in self.values()]
+
+    def search_by_age(self, min_age: Optional[int] = None,
+                      max_age: Optional[int] = None) -> List[str]:
+        """Sorted usernames with an age in [min_age, max_age]."""
+        return sorted(profile['username'] for profile in self.values()
+                      if (min_age is None or profile['age'] >= min_age)
+                      and (max_age is None or profile['age'] <= max_age))
+
+    def search_by_location(self, location: str) -> List[str]:
+        """Sorted usernames whose location contains `location`, ignoring case."""
+        location = _fold(location)
+        return sorted(profile['username'] for profile in self.values()
+                      if location in _fold(profile['location']))
+
+    def search_by_bio(self, text: str) -> List[str]:
+        """Sorted usernames whose bio contains `text`, ignoring case."""
+        text = _fold(text)
+        return sorted(profile['username'] for profile in self.values()
+                      if text in _fold(profile['bio']))
+
+
+class StringArena:
+    """
+    One string per row, packed as UTF-8 into a single buffer.
+
+    Overwritten strings are appended and their old bytes left behind; the
+    buffer is compacted once more than half of it is garbage.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._garbage = 0
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, row: int) -> str:
+        offset = self._offsets[row]
+        return self._data[offset:offset + self._lengths[row]].decode('utf-8')
+
+    def __setitem__(self, row: int, text: str) -> None:
+        self._garbage += self._lengths[row]
+        self._offsets[row], self._lengths[row] = self._store(text)
+        if self._garbage > 4096 and self._garbage * 2 > len(self._data):
+            self.compact()
+
+    def append(self, text: str) -> None:
+        """Add a row at the end."""
+        offset, length = self._store(text)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+
+    def move_last(self, row: int) -> None:
+        """Drop `row`, moving the last row into its place."""
+        self._garbage += self._lengths[row]
+        self._offsets[row] = self._offsets[-1]
+        self._lengths[row] = self._lengths[-1]
+        self._offsets.pop()
+        self._lengths.pop()
+
+    def compact(self) -> None:
+        """Rewrite the buffer without garbage."""
+        data = bytearray()
+        for row, (offset, length) in enumerate(zip(self._offsets, self._lengths)):
+            self._offsets[row] = len(data)
+            data += self._data[offset:offset + length]
+        self._data = data
+        self._garbage = 0
+
+    def nbytes(self) -> int:
+        """Bytes held by the buffer and the row tables."""
+        return (len(self._data) + self._offsets.itemsize * len(self._offsets)
+                + self._lengths.itemsize * len(self._lengths))
+
+    def _store(self, text: str) -> Tuple[int, int]:
+        encoded = text.encode('utf-8')
+        offset = len(self._data)
+        self._data += encoded
+        return offset, len(encoded)
+
+
+class ProfileView(MutableMapping):
+    """Live dict-like view of one profile in ColumnarProfiles."""
+
+    __slots__ = ('_columns', '_key')
+
+    def __init__(self, columns: 'ColumnarProfiles', key: str):
+        self._columns = columns
+        self._key = key
+
+    def __getitem__(self, field: str) -> Any:
+        return self._columns._get(self._key, field)
+
+    def __setitem__(self, field: str, value: Any) -> None:
+        self._columns.set_field(self._key, field, value)
+
+    def __delitem__(self, field: str) -> None:
+        raise TypeError("profile fields cannot be removed")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(PROFILE_FIELDS)
+
+    def __len__(self) -> int:
+        return len(PROFILE_FIELDS)
+
+    def __repr__(self) -> str:
+        return f"ProfileView({dict(self)!r})"
+
+
+class ColumnarProfiles(ProfileStore):
+    """
+    Profiles stored column by column instead of one dict per user.
+
+    Ages are one byte per row, locations are codes into a table of
+    interned strings, and emails and bios live in StringArenas. Rows are
+    dense: deleting one moves the last row into the hole. Age and location
+    searches are mask operations over the columns, vectorised with NumPy
+    when it is installed.
+    """
+
+    def __init__(self, profiles: Iterable[Dict[str, Any]] = ()):
+        self._rows: Dict[str, int] = {}
+        self._usernames: List[str] = []
+        self._ages = array('B')
+        self._locations = array('I')
+        self._location_codes: Dict[str, int] = {}
+        self._location_names: List[str] = []
+        self._emails = StringArena()
+        self._bios = StringArena()
+        for profile in profiles:
+            self[_fold(profile['username'])] = profile
+
+    def __len__(self) -> int:
+        return len(self._usernames)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._rows
+
+    def __getitem__(self, key: str) -> ProfileView:
+        if key not in self._rows:
+            raise KeyError(key)
+        return ProfileView(self, key)
+
+    def __setitem__(self, key: str, profile: Mapping) -> None:
+        if key in self._rows:
+            for field in PROFILE_FIELDS:
+                self.set_field(key, field, profile[field])
+            return
+        self._rows[key] = len(self._usernames)
+        self._usernames.append(profile['username'])
+        self._ages.append(profile['age'])
+        self._locations.append(self._intern(profile['location']))
+        self._emails.append(profile['email'])
+        self._bios.append(profile['bio'])
+
+    def __delitem__(self, key: str) -> None:
+        row = self._rows.pop(key)
+        last = self._usernames.pop()
+        if row < len(self._usernames):
+            self._usernames[row] = last
+            self._rows[_fold(last)] = row
+            self._ages[row] = self._ages[-1]
+            self._locations[row] = self._locations[-1]
+        self._ages.pop()
+        self._locations.pop()
+        self._emails.move_last(row)
+        self._bios.move_last(row)
+
+    def set_field(self, key: str, field: str, value: Any) -> None:
+        row = self._rows[key]
+        if field == 'age':
+            self._ages[row] = value
+        elif field == 'location':
+            self._locations[row] = self._intern(value)
+        elif field == 'email':
+            self._emails[row] = value
+        elif field == 'bio':
+            self._bios[row] = value
+        elif field == 'username':
+            self._usernames[row] = value
+        else:
+            raise KeyError(field)
+
+    def _get(self, key: str, field: str) -> Any:
+        row = self._rows[key]
+        if field == 'age':
+            return self._ages[row]
+        if field == 'location':
+            return self._location_names[self._locations[row]]
+        if field == 'email':
+            return self._emails[row]
+        if field == 'bio':
+            return self._bios[row]
+        if field == 'username':
+            return self._usernames[row]
+        raise KeyError(field)
+
+    def _intern(self, location: str) -> int:
+        """Code for a location, allocating one the first time it is seen."""
+        code = self._location_codes.get(location)
+        if code is None:
+            code = self._location_codes[location] = len(self._location_names)
+            self._location_names.append(location)
+        return code
+
+    def usernames(self) -> List[str]:
+        return list(self._usernames)
+
+    def search_by_age(self, min_age: Optional[int] = None,
+                      max_age: Optional[int] = None) -> List[str]:
+        low = 0 if min_age is None else max(min_age, 0)
+        high = 255 if max_age is None else min(max_age, 255)
+        if low > high:
+            return []
+        if np is not None:
+            ages = np.frombuffer(self._ages, dtype=np.uint8)
+            rows = np.flatnonzero((ages >= low) & (ages <= high)).tolist()
+        else:
+            rows = [row for row, age in enumerate(self._ages) if low <= age <= high]
+        return self._sorted_usernames(rows)
+
+    def search_by_location(self, location: str) -> List[str]:
+        location = _fold(location)
+        wanted = [code for code, name in enumerate(self._location_names)
+                  if location in _fold(name)]
+        if not wanted:
+            return []
+        if np is not None:
+            table = np.zeros(len(self._location_names), dtype=bool)
+            table[wanted] = True
+            rows = np.flatnonzero(table[np.frombuffer(self._locations, dtype=np.uintc)]).tolist()
+        else:
+            wanted = set(wanted)
+            rows = [row for row, code in enumerate(self._locations) if code in wanted]
+        return self._sorted_usernames(rows)
+
+    def _sorted_usernames(self, rows: List[int]) -> List[str]:
+        usernames = self._usernames
+        return sorted([usernames[row] for row in rows])
+
+    def nbytes(self) -> int:
+        """Approximate bytes held by the columns (excluding usernames and the row map)."""
+        return (self._ages.itemsize * len(self._ages)
+                + self._locations.itemsize * len(self._locations)
+                + self._emails.nbytes() + self._bios.nbytes())
+
+
+class SQLiteProfileStore(ProfileStore):
+    """
+    Persistent profile store backed by SQLite.
+
+    The database runs in WAL mode and each thread opens its own connection,
+    so worker processes can share one file. Profiles are found through a
+    unique `key` column holding the manager's folded username, age
+    searches use an index on `age`, and location and bio substring searches
+    use an FTS5 trigram table kept in sync by triggers (SQLite 3.34+). FTS5
+    ignores case with its own Unicode case folding, which does not apply
+    NFKC, so those searches do not match compatibility forms.
+
+    Each thread keeps an LRU cache of the profiles it has read. SQLite's
+    data_version pragma changes whenever another connection commits, and a
+    thread drops its cache when it sees the pragma change. The pragma is
+    read at most once per `max_staleness` seconds, so a cached profile may
+    miss another thread's or process's write for up to that long; this
+    connection's own writes are always visible. Writes run in autocommit
+    mode unless grouped with batch(), which checks the pragma once when it
+    starts and holds the write lock, so no other commit can land inside it.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS profiles ("
+        " id INTEGER PRIMARY KEY,"
+        " key TEXT NOT NULL UNIQUE,"
+        " username TEXT NOT NULL,"
+        " email TEXT NOT NULL,"
+        " age INTEGER NOT NULL,"
+        " bio TEXT NOT NULL DEFAULT '',"
+        " location TEXT NOT NULL DEFAULT '')",
+        "CREATE INDEX IF NOT EXISTS profiles_age ON profiles (age)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS profiles_fts USING fts5("
+        " location, bio, content='profiles', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS profiles_fts_insert AFTER INSERT ON profiles BEGIN"
+        " INSERT INTO profiles_fts (rowid, location, bio) VALUES (new.id, new.location, new.bio);"
+        " END",
+        "CREATE TRIGGER IF NOT EXISTS profiles_fts_delete AFTER DELETE ON profiles BEGIN"
+        " INSERT INTO profiles_fts (profiles_fts, rowid, location, bio)"
+        " VALUES ('delete', old.id, old.location, old.bio);"
+        " END",
+        "CREATE TRIGGER IF NOT EXISTS profiles_fts_update AFTER UPDATE OF location, bio ON profiles BEGIN"
+        " INSERT INTO profiles_fts (profiles_fts, rowid, location, bio)"
+        " VALUES ('delete', old.id, old.location, old.bio);"
+        " INSERT INTO profiles_fts (rowid, location, bio) VALUES (new.id, new.location, new.bio);"
+        " END",
+    )
+    SELECT = "SELECT username, email, age, bio, location FROM profiles WHERE key = ?"
+    EXISTS = "SELECT 1 FROM profiles WHERE key = ?"
+    INSERT = ("INSERT INTO profiles (key, username, email, age, bio, location) "
+              "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO NOTHING")
+    UPSERT = ("INSERT INTO profiles (key, username, email, age, bio, location) "
+              "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+              "username = excluded.username, email = excluded.email, age = excluded.age, "
+              "bio = excluded.bio, location = excluded.location")
+    DELETE = "DELETE FROM profiles WHERE key = ?"
+    UPDATES = {field: f"UPDATE profiles SET {field} = ? WHERE key = ?" for field in PROFILE_FIELDS}
+    BY_AGE = "SELECT username FROM profiles WHERE age BETWEEN ? AND ? ORDER BY username"
+    MATCH = ("SELECT p.username FROM profiles_fts JOIN profiles p ON p.id = profiles_fts.rowid "
+             "WHERE profiles_fts MATCH ? ORDER BY p.username")
+
+    def __init__(self, path: str, cache_size: int = 1024, timeout: float = 5.0,
+                 max_staleness: float = 1.0):
+        """
+        Open or create the database.
+
+        Args:
+            path: Database file path
+            cache_size: Profiles cached per thread (0 disables the cache)
+            timeout: Seconds to wait for a competing writer's lock
+            max_staleness: Seconds between checks for other connections'
+                           writes (0 checks on every cached read)
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.max_staleness = max_staleness
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit: every statement is its own transaction unless batched
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.cache = OrderedDict()
+            self._local.version = None
+            self._local.checked = float('-inf')
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        """Close every connection opened by this store."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Group this thread's writes into one transaction.
+
+        The batch commits when the block exits and rolls back if it raises;
+        a batch opened inside another one joins it.
+        """
+        conn = self._conn()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._sync(conn)
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self._local.cache.clear()
+            raise
+        conn.execute("COMMIT")
+
+    def _cache(self, conn: sqlite3.Connection) -> 'OrderedDict[str, Dict[str, Any]]':
+        """This thread's cache, emptied if another connection has committed."""
+        local = self._local
+        # Inside a batch the write lock keeps other commits out
+        if (not conn.in_transaction
+                and time.monotonic() - local.checked >= self.max_staleness):
+            self._sync(conn)
+        return local.cache
+
+    def _sync(self, conn: sqlite3.Connection) -> None:
+        """Read data_version and drop this thread's cache if it changed."""
+        local = self._local
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        local.checked = time.monotonic()
+        if version != local.version:
+            local.cache.clear()
+            local.version = version
+
+    def _remember(self, key: str, profile: Dict[str, Any]) -> None:
+        """Cache a profile, evicting the least recently used one if full."""
+        if self.cache_size <= 0:
+            return
+        cache = self._local.cache
+        cache[key] = profile
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        """Return a copy of a profile; change it through set_field."""
+        conn = self._conn()
+        cache = self._cache(conn)
+        profile = cache.get(key)
+        if profile is not None:
+            cache.move_to_end(key)
+        else:
+            row = conn.execute(self.SELECT, (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            profile = dict(zip(PROFILE_FIELDS, row))
+            self._remember(key, profile)
+        return dict(profile)
+
+    def __contains__(self, key: object) -> bool:
+        conn = self._conn()
+        if key in self._cache(conn):
+            return True
+        return conn.execute(self.EXISTS, (key,)).fetchone() is not None
+
+    def __setitem__(self, key: str, profile: Mapping) -> None:
+        self._conn().execute(self.UPSERT, (key, *(profile[field] for field in PROFILE_FIELDS)))
+        self._remember(key, {field: profile[field] for field in PROFILE_FIELDS})
+
+    def add(self, key: str, profile: Mapping) -> bool:
+        values = tuple(profile[field] for field in PROFILE_FIELDS)
+        if self._conn().execute(self.INSERT, (key, *values)).rowcount == 0:
+            return False
+        self._remember(key, dict(zip(PROFILE_FIELDS, values)))
+        return True
+
+    def __delitem__(self, key: str) -> None:
+        conn = self._conn()
+        self._local.cache.pop(key, None)
+        if conn.execute(self.DELETE, (key,)).rowcount == 0:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return (row[0] for row in self._conn().execute("SELECT key FROM profiles").fetchall())
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def set_field(self, key: str, field: str, value: Any) -> None:
+        if field not in self.UPDATES:
+            raise KeyError(field)
+        if self._conn().execute(self.UPDATES[field], (value, key)).rowcount == 0:
+            # Deleted by another connection; forget any cached copy
+            self._local.cache.pop(key, None)
+            raise KeyError(key)
+        profile = self._local.cache.get(key)
+        if profile is not None:
+            profile[field] = value
+
+    def usernames(self) -> List[str]:
+        return [row[0] for row in self._conn().execute("SELECT username FROM profiles")]
+
+    def search_by_age(self, min_age: Optional[int] = None,
+                      max_age: Optional[int] = None) -> List[str]:
+        low = -2 ** 63 if min_age is None else min_age
+        high = 2 ** 63 - 1 if max_age is None else max_age
+        return [row[0] for row in self._conn().execute(self.BY_AGE, (low, high))]
+
+    def search_by_location(self, location: str) -> List[str]:
+        return self._search('location', location)
+
+    def search_by_bio(self, text: str) -> List[str]:
+        return self._search('bio', text)
+
+    def _search(self, column: str, text: str) -> List[str]:
+        """Sorted usernames whose `column` contains text, ignoring case."""
+        conn = self._conn()
+        if len(text) >= 3:
+            phrase = '"' + text.replace('"', '""') + '"'
+            return [row[0] for row in conn.execute(self.MATCH, (f"{column} : {phrase}",))]
+        # The trigram index cannot answer shorter queries
+        text = _fold(text)
+        return sorted(username for username, value in
+                      conn.execute(f"SELECT username, {column} FROM profiles")
+                      if text in _fold(value))
+
+
+class Query:
+    """
+    Base class for composable profile queries.
+
+    Terms combine with & and |. A term backed by an index reports an
+    estimated match count and streams its matches from the index in
+    username order; other terms are applied as filters over a scan.
+    """
+
+    def __and__(self, other: 'Query') -> 'Query':
+        return And(self, other)
+
+    def __or__(self, other: 'Query') -> 'Query':
+        return Or(self, other)
+
+    def check(self, manager: 'UserProfileManager') -> None:
+        """Raise ValueError if the query is malformed."""
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        """Test a single profile."""
+        raise NotImplementedError
+
+    def estimate(self, manager: 'UserProfileManager') -> Optional[int]:
+        """Match count from an index, or None if the term needs a scan."""
+        return None
+
+    def stream(self, manager: 'UserProfileManager',
+               after: Optional[str] = None) -> Iterator[str]:
+        """Lazily yield matching usernames in order, starting after `after`."""
+        profiles = manager.profiles
+        return (username for username in manager._ordered_usernames(after)
+                if self.matches(profiles[_fold(username)]))
+
+    def explain(self, manager: 'UserProfileManager') -> str:
+        """Describe how the query will be executed."""
+        estimate = self.estimate(manager)
+        if estimate is None:
+            return f"scan {self!r}"
+        return f"index {self!r} ~{estimate}"
+
+
+class AgeRange(Query):
+    """Profiles with min_age <= age <= max_age (either bound optional)."""
+
+    def __init__(self, min_age: Optional[int] = None, max_age: Optional[int] = None):
+        self.min_age = min_age
+        self.max_age = max_age
+
+    def __repr__(self) -> str:
+        return f"AgeRange({self.min_age!r}, {self.max_age!r})"
+
+    def check(self, manager: 'UserProfileManager') -> None:
+        if (self.min_age is not None and self.max_age is not None
+                and self.min_age > self.max_age):
+            raise ValueError(f"empty age range: {self!r}")
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        age = profile['age']
+        return ((self.min_age is None or age >= self.min_age)
+                and (self.max_age is None or age <= self.max_age))
+
+    def estimate(self, manager: 'UserProfileManager') -> Optional[int]:
+        if manager.age_index is None:
+            return None
+        return manager.age_index.count(self.min_age, self.max_age)
+
+    def stream(self, manager: 'UserProfileManager',
+               after: Optional[str] = None) -> Iterator[str]:
+        if manager.age_index is None:
+            return super().stream(manager, after)
+        return manager.age_index.iter_range(self.min_age, self.max_age, after)
+
+
+class LocationContains(Query):
+    """Profiles whose location contains text (case-insensitive)."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"LocationContains({self.text!r})"
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        return _fold(self.text) in _fold(profile['location'])
+
+    def estimate(self, manager: 'UserProfileManager') -> Optional[int]:
+        if manager.location_index is None:
+            return None
+        return manager.location_index.count(self.text)
+
+    def stream(self, manager: 'UserProfileManager',
+               after: Optional[str] = None) -> Iterator[str]:
+        if manager.location_index is None:
+            return super().stream(manager, after)
+        return manager.location_index.iter_match(self.text, after)
+
+
+class EmailDomain(Query):
+    """Profiles whose email domain equals domain (case-insensitive)."""
+
+    def __init__(self, domain: str):
+        self.domain = domain
+
+    def __repr__(self) -> str:
+        return f"EmailDomain({self.domain!r})"
+
+    def check(self, manager: 'UserProfileManager') -> None:
+        if not manager.validate_email(f"user@{self.domain}"):
+            raise ValueError(f"invalid email domain: {self.domain!r}")
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        return _email_domain(profile['email']) == _fold(self.domain)
+
+    def estimate(self, manager: 'UserProfileManager') -> Optional[int]:
+        if manager.email_index is None:
+            return None
+        return manager.email_index.count(self.domain)
+
+    def stream(self, manager: 'UserProfileManager',
+               after: Optional[str] = None) -> Iterator[str]:
+        if manager.email_index is None:
+            return super().stream(manager, after)
+        return manager.email_index.iter_value(self.domain, after)
+
+
+class Where(Query):
+    """Profiles accepted by an arbitrary predicate (always a filter)."""
+
+    def __init__(self, predicate: Callable[[Dict[str, Any]], bool], name: str = 'where'):
+        self.predicate = predicate
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Where({self.name})"
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        return bool(self.predicate(profile))
+
+
+class And(Query):
+    """
+    Profiles matching every part.
+
+    The part with the smallest estimate drives the query; the others are
+    applied lazily to its stream, most selective first.
+    """
+
+    def __init__(self, *parts: Query):
+        self.parts = _query_parts('And', parts)
+
+    def __repr__(self) -> str:
+        return f"And{self.parts!r}"
+
+    def check(self, manager: 'UserProfileManager') -> None:
+        for part in self.parts:
+            part.check(manager)
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        return all(part.matches(profile) for part in self.parts)
+
+    def estimate(self, manager: 'UserProfileManager') -> Optional[int]:
+        estimates = [e for e in (part.estimate(manager) for part in self.parts) if e is not None]
+        return min(estimates) if estimates else None
+
+    def _ranked(self, manager: 'UserProfileManager') -> List[Query]:
+        """Parts ordered by estimated matches; scans count as every profile."""
+        def cost(part: Query) -> int:
+            estimate = part.estimate(manager)
+            return len(manager.profiles) + 1 if estimate is None else estimate
+        return sorted(self.parts, key=cost)
+
+    def stream(self, manager: 'UserProfileManager',
+               after: Optional[str] = None) -> Iterator[str]:
+        driver, *filters = self._ranked(manager)
+        profiles = manager.profiles
+        return (username for username in driver.stream(manager, after)
+                if all(part.matches(profiles[_fold(username)]) for part in filters))
+
+    def explain(self, manager: 'UserProfileManager') -> str:
+        driver, *filters = self._ranked(manager)
+        plan = driver.explain(manager)
+        if filters:
+            plan += f"; filter {', '.join(repr(part) for part in filters)}"
+        return f"({plan})"
+
+
+class Or(Query):
+    """
+    Profiles matching any part.
+
+    When every part is indexed their streams are merged in username order;
+    otherwise the whole disjunction is one scan.
+    """
+
+    def __init__(self, *parts: Query):
+        self.parts = _query_parts('Or', parts)
+
+    def __repr__(self) -> str:
+        return f"Or{self.parts!r}"
+
+    def check(self, manager: 'UserProfileManager') -> None:
+        for part in self.parts:
+            part.check(manager)
+
+    def matches(self, profile: Dict[str, Any]) -> bool:
+        return any(part.matches(profile) for part in self.parts)
+
+    def estimate(self, manager: 'UserProfileManager') -> Optional[int]:
+        estimates = [part.estimate(manager) for part in self.parts]
+        return None if None in estimates else sum(estimates)
+
+    def stream(self, manager: 'UserProfileManager',
+               after: Optional[str] = None) -> Iterator[str]:
+        if self.estimate(manager) is None:
+            return super().stream(manager, after)
+        return _unique(heapq.merge(*(part.stream(manager, after) for part in self.parts)))
+
+    def explain(self, manager: 'UserProfileManager') -> str:
+        if self.estimate(manager) is None:
+            return f"scan {self!r}"
+        return f"(merge {' | '.join(part.explain(manager) for part in self.parts)})"
+
+
+def _query_parts(kind: str, parts: Tuple[Query, ...]) -> Tuple[Query, ...]:
+    """Validate the parts of an And or Or query."""
+    if not parts:
+        raise ValueError(f"{kind}() needs at least one query")
+    for part in parts:
+        if not isinstance(part, Query):
+            raise TypeError(f"{kind}() parts must be queries, got {part!r}")
+    return parts
+
+
+def _unique(ordered: Iterator[str]) -> Iterator[str]:
+    """Drop consecutive duplicates from an ordered stream."""
+    previous = None
+    for item in ordered:
+        if item != previous:
+            yield item
+            previous = item
+
+
+def _email_domain(email: str) -> str:
+    """Folded domain part of a validated email address."""
+    return _fold(email.rsplit('@', 1)[-1])
 
 
 class UserProfileManager:
     """Manages user profiles with validation and search capabilities."""
 
-    def __init__(self):
-        """Initialize the user profile manager."""
-        self.profiles: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, store: Optional[ProfileStore] = None):
+        """
+        Initialize the user profile manager.
+
+        Profiles must be changed through create_profile and update_profile
+        so the search indexes stay in sync; call rebuild_indexes after
+        editing `profiles` directly.
+
+        Args:
+            store: Backing storage such as ColumnarProfiles or
+                   SQLiteProfileStore (optional). A store answers searches
+                   itself, so no secondary indexes are kept; by default
+                   profiles are dicts in memory.
+        """
+        self.store = store
+        if store is not None:
+            self.profiles = store
+            self.age_index = self.location_index = self.email_index = None
+        else:
+            self.profiles: Dict[str, Dict[str, Any]] = {}
+            self.age_index = AgeIndex()
+            self.location_index = TrigramIndex()
+            self.email_index = ValueIndex()
 
     def validate_username(self, username: str) -> bool:
         """
@@ -83,22 +1183,43 @@ class UserProfileManager:
         if not self.validate_age(age):
             return False
 
-        # Check if user already exists (case-insensitive)
-        username_lower = username.lower()
-        if username_lower in self.profiles:
-            return False
-
-        # Create profile
-        self.profiles[username_lower] = {
+        username_lower = _fold(username)
+        profile = {
             'username': username,
             'email': email,
             'age': age,
             'bio': bio,
             'location': location
         }
+        if self.store is not None:
+            # The store checks and inserts in one step, so processes sharing
+            # it cannot both create the same user
+            return self.store.add(username_lower, profile)
+
+        # Check if user already exists (case-insensitive)
+        if username_lower in self.profiles:
+            return False
+
+        # Create profile
+        self.profiles[username_lower] = profile
+        self.age_index.add(age, username)
+        self.location_index.add(location, username)
+        self.email_index.add(_email_domain(email), username)
 
         return True
 
+    def rebuild_indexes(self) -> None:
+        """Rebuild the search indexes from `profiles` (a no-op with a store)."""
+        if self.store is not None:
+            return
+        self.age_index = AgeIndex((profile['age'], profile['username'])
+                                  for profile in self.profiles.values())
+        self.location_index = TrigramIndex()
+        self.email_index = ValueIndex()
+        for profile in self.profiles.values():
+            self.location_index.add(profile['location'], profile['username'])
+            self.email_index.add(_email_domain(profile['email']), profile['username'])
+
     def get_profile(self, username: str) -> Optional[Dict[str, Any]]:
         """
         Retrieve a user profile.
@@ -109,7 +1230,7 @@ class UserProfileManager:
         Returns:
             Profile dictionary or None if not found
         """
-        return self.profiles.get(username.lower())
+        return self.profiles.get(_fold(username))
 
     def update_profile(self, username: str, email: Optional[str] = None,
                       age: Optional[int] = None, bio: Optional[str] = None,
@@ -127,30 +1248,65 @@ class UserProfileManager:
         Returns:
             True if updated successfully, False if user doesn't exist or validation fails
         """
-        username_lower = username.lower()
+        username_lower = _fold(username)
 
         if username_lower not in self.profiles:
             return False
 
-        # Validate new values if provided
-        if email is not None:
-            if not self.validate_email(email):
-                return False
-            self.profiles[username_lower]['email'] = email
+        try:
+            # Validate new values if provided
+            if email is not None:
+                if not self.validate_email(email):
+                    return False
+                self._set_field(username_lower, 'email', email)
 
-        if age is not None:
-            if not self.validate_age(age):
-                return False
-            self.profiles[username_lower]['age'] = age
+            if age is not None:
+                if not self.validate_age(age):
+                    return False
+                self._set_field(username_lower, 'age', age)
 
-        if bio is not None:
-            self.profiles[username_lower]['bio'] = bio
+            if bio is not None:
+                self._set_field(username_lower, 'bio', bio)
 
-        if location is not None:
-            self.profiles[username_lower]['location'] = location
+            if location is not None:
+                self._set_field(username_lower, 'location', location)
+        except KeyError:
+            # A shared store's profile was deleted after the check above
+            return False
 
         return True
 
+    def _set_field(self, username_lower: str, field: str, value: Any) -> None:
+        """Change one field of a profile, keeping the search indexes in sync."""
+        if self.store is not None:
+            self.store.set_field(username_lower, field, value)
+            return
+        profile = self.profiles[username_lower]
+        username = profile['username']
+        if field == 'age':
+            self.age_index.remove(profile['age'], username)
+            self.age_index.add(value, username)
+        elif field == 'location':
+            self.location_index.remove(profile['location'], username)
+            self.location_index.add(value, username)
+        elif field == 'email':
+            self.email_index.remove(_email_domain(profile['email']), username)
+            self.email_index.add(_email_domain(value), username)
+        profile[field] = value
+
+    def _ordered_usernames(self, after: Optional[str] = None) -> Iterator[str]:
+        """
+        Every username in order, starting after `after`.
+
+        A store has no ordered username index, so each call loads and sorts
+        every username in the store before yielding the first one.
+        """
+        if self.store is None:
+            return self.age_index.iter_range(after=after)
+        usernames = sorted(self.store.usernames())
+        start = 0 if after is None else bisect_right(usernames, after)
+        return iter(usernames[start:])
+
     def generate_summary(self, username: str) -> Optional[str]:
         """
         Generate a text summary of a user profile.
@@ -170,23 +1326,20 @@ class UserProfileManager:
 
         return f"{profile['username']} ({profile['age']}): {profile['email']} - {bio}"
 
-    def search_by_age(self, min_age: int) -> List[str]:
+    def search_by_age(self, min_age: int, max_age: Optional[int] = None) -> List[str]:
         """
         Find all users at or above a minimum age.
 
         Args:
             min_age: Minimum age threshold
+            max_age: Maximum age, inclusive (optional)
 
         Returns:
-            List of usernames matching criteria
+            Sorted list of usernames matching criteria
         """
-        results = []
-
-        for username, profile in self.profiles.items():
-            if profile['age'] >= min_age:
-                results.append(profile['username'])
-
-        return sorted(results)
+        if self.store is not None:
+            return self.store.search_by_age(min_age, max_age)
+        return self.age_index.range(min_age, max_age)
 
     def search_by_location(self, location: str) -> List[str]:
         """
@@ -196,13 +1349,54 @@ class UserProfileManager:
             location: Location string to search for
 
         Returns:
-            List of usernames matching criteria
+            Sorted list of usernames matching criteria
+        """
+        if self.store is not None:
+            return self.store.search_by_location(location)
+        return self.location_index.search(location)
+
+    def iter_query(self, query: Query, after: Optional[str] = None) -> Iterator[str]:
+        """
+        Lazily yield usernames matching a query, in username order.
+
+        Matches are produced on demand from the most selective index, so
+        only as many profiles are examined as the caller consumes. A
+        manager backed by a store keeps no indexes, so every query on it is
+        a scan that first loads and sorts all usernames in the store; its
+        cost grows with the store, not with the number of matches consumed.
+
+        Args:
+            query: Query built from AgeRange, LocationContains, EmailDomain,
+                   Where, And/& and Or/|
+            after: Only yield usernames greater than this one (optional)
+
+        Raises:
+            ValueError: If the query is malformed
+        """
+        query.check(self)
+        return query.stream(self, after)
+
+    def query(self, query: Query, cursor: Optional[str] = None,
+              limit: int = 100) -> Tuple[List[str], Optional[str]]:
         """
-        results = []
-        location_lower = location.lower()
+        Return one page of usernames matching a query.
 
-        for username, profile in self.profiles.items():
-            if location_lower in profile['location'].lower():
-                results.append(profile['username'])
+        Args:
+            query: Query to run
+            cursor: Cursor from the previous page, or None to start
+            limit: Maximum number of usernames on the page
+
+        Returns:
+            (page, next cursor); the cursor is None once the end is reached
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        matches = self.iter_query(query, cursor)
+        page = list(islice(matches, limit))
+        more = next(matches, None) is not None
+        return page, (page[-1] if more else None)
 
-        return sorted(results)
+    def explain(self, query: Query) -> str:
+        """Describe the plan iter_query would use for a query."""
+        query.check(self)
+        return query.explain(self)
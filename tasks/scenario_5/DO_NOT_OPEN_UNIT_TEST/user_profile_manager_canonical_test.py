@@ -0,0 +1,379 @@
+import importlib.util
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Load the reference implementation under a unique name so it does not clash
+# with the canonical solutions of other scenarios in the same test session.
+_spec = importlib.util.spec_from_file_location(
+    "user_profile_manager_canonical",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "canonical_solution.py"))
+canonical = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = canonical
+_spec.loader.exec_module(canonical)
+
+LOCATIONS = ["New York", "San Francisco", "Paris", "New Jersey", "Berlin", ""]
+DOMAINS = ["example.com", "corp.example", "mail.test"]
+
+
+def populate(manager, count, seed=7):
+    """Create `count` random profiles; return the brute-force reference data."""
+    rng = random.Random(seed)
+    for i in range(count):
+        manager.create_profile(f"user{rng.randrange(10 ** 6)}x{i}", f"u{i}@{rng.choice(DOMAINS)}",
+                               rng.randint(13, 120), location=rng.choice(LOCATIONS))
+    return rng
+
+
+class TestSortedKeyList(unittest.TestCase):
+    """Test suite for the chunked sorted list."""
+
+    def test_matches_sorted_list(self):
+        """Test inserts and removals against a plain sorted list."""
+        rng = random.Random(1)
+        keys = canonical.SortedKeyList()
+        reference = []
+        for i in range(5000):
+            value = f"k{rng.randrange(3000)}"
+            if rng.random() < 0.3 and reference:
+                victim = rng.choice(reference)
+                self.assertTrue(keys.remove(victim))
+                reference.remove(victim)
+            else:
+                keys.add(value)
+                reference.append(value)
+
+        reference.sort()
+        self.assertEqual(list(keys), reference)
+        self.assertEqual(len(keys), len(reference))
+        self.assertFalse(keys.remove("missing"))
+        self.assertIn(reference[0], keys)
+        self.assertNotIn("zzz", keys)
+
+
+class TestAgeIndex(unittest.TestCase):
+    """Test suite for indexed age search."""
+
+    def test_search_matches_scan(self):
+        """Test that indexed results equal a sorted full scan after updates."""
+        manager = canonical.UserProfileManager()
+        rng = populate(manager, 3000)
+        for username in rng.sample(sorted(manager.profiles), 500):
+            manager.update_profile(username, age=rng.randint(13, 120))
+
+        for min_age, max_age in ((13, None), (50, None), (119, None), (30, 40), (121, None)):
+            expected = sorted(p['username'] for p in manager.profiles.values()
+                              if p['age'] >= min_age and (max_age is None or p['age'] <= max_age))
+            self.assertEqual(manager.search_by_age(min_age, max_age), expected)
+            self.assertEqual(list(manager.age_index.iter_range(min_age, max_age)), expected)
+            self.assertEqual(manager.age_index.count(min_age, max_age), len(expected))
+
+    def test_failed_update_keeps_index(self):
+        """Test that an invalid age leaves the index unchanged."""
+        manager = canonical.UserProfileManager()
+        manager.create_profile("Alice", "alice@example.com", 30)
+
+        self.assertFalse(manager.update_profile("alice", age=200))
+        self.assertEqual(manager.search_by_age(30, 30), ["Alice"])
+        self.assertTrue(manager.update_profile("alice", age=31))
+        self.assertEqual(manager.search_by_age(30, 30), [])
+        self.assertEqual(manager.search_by_age(31), ["Alice"])
+
+    def test_rebuild(self):
+        """Test rebuilding after direct edits to `profiles`."""
+        manager = canonical.UserProfileManager()
+        populate(manager, 200)
+        expected = manager.search_by_age(40)
+        manager.age_index = canonical.AgeIndex()
+
+        manager.rebuild_indexes()
+        self.assertEqual(manager.search_by_age(40), expected)
+
+
+class TestLocationIndex(unittest.TestCase):
+    """Test suite for trigram location search."""
+
+    def test_search_matches_scan(self):
+        """Test indexed substring search against a full scan after updates."""
+        manager = canonical.UserProfileManager()
+        rng = populate(manager, 2000)
+        for username in rng.sample(sorted(manager.profiles), 300):
+            manager.update_profile(username, location=rng.choice(LOCATIONS + ["Newark"]))
+
+        for query in ("new", "NEW Y", "Francisco", "is", "e", "", "york", "nowhere", "ew J"):
+            expected = sorted(p['username'] for p in manager.profiles.values()
+                              if query.lower() in p['location'].lower())
+            self.assertEqual(manager.search_by_location(query), expected, query)
+
+    def test_emptied_values_are_dropped(self):
+        """Test that postings for values nobody has any more are removed."""
+        index = canonical.TrigramIndex()
+        index.add("Reykjavik", "alice")
+        index.add("Reykjavik", "bobby")
+        index.remove("reykjavik", "alice")
+        self.assertEqual(index.search("kjav"), ["bobby"])
+
+        index.remove("Reykjavik", "bobby")
+        index.remove("Nowhere", "carol")
+        self.assertEqual(index.search("kjav"), [])
+        self.assertEqual(index._postings, {})
+
+    def test_values_fold_beyond_lower(self):
+        """Test that indexes compare values after NFKC and casefold."""
+        locations = canonical.TrigramIndex()
+        locations.add("ＭÜNCHEN", "alice")
+        locations.add("Straße", "bobby")
+        self.assertEqual(locations.search("münchen"), ["alice"])
+        self.assertEqual(locations.search("STRASS"), ["bobby"])
+
+        domains = canonical.ValueIndex()
+        domains.add("ＥＸＡＭＰＬＥ.com", "alice")
+        self.assertEqual(list(domains.iter_value("example.COM")), ["alice"])
+        domains.remove("example.com", "alice")
+        self.assertEqual(domains.count("example.com"), 0)
+
+
+class TestQuery(unittest.TestCase):
+    """Test suite for composable queries."""
+
+    def setUp(self):
+        self.manager = canonical.UserProfileManager()
+        rng = populate(self.manager, 2000)
+        for username in rng.sample(sorted(self.manager.profiles), 200):
+            self.manager.update_profile(username, email=f"moved@{rng.choice(DOMAINS)}")
+
+    def expected(self, query):
+        return sorted(p['username'] for p in self.manager.profiles.values() if query.matches(p))
+
+    def test_matches_scan(self):
+        """Test conjunctions and disjunctions against a brute-force filter."""
+        Q = canonical
+        queries = [
+            Q.AgeRange(30, 40) & Q.LocationContains("new") & Q.EmailDomain("CORP.example"),
+            Q.AgeRange(100) | Q.LocationContains("paris"),
+            Q.EmailDomain("mail.test") & (Q.AgeRange(max_age=20) | Q.LocationContains("berlin")),
+            Q.LocationContains("york") & Q.Where(lambda p: p['age'] % 2 == 0, 'even age'),
+            Q.Where(lambda p: p['age'] == 50) | Q.EmailDomain("example.com"),
+            Q.Where(lambda p: p['location'] == ""),
+            Q.AgeRange(20, 30) & Q.LocationContains("nowhere"),
+        ]
+        for query in queries:
+            self.assertEqual(list(self.manager.iter_query(query)), self.expected(query), query)
+
+    def test_pagination(self):
+        """Test that paging with cursors returns every match exactly once."""
+        query = canonical.AgeRange(18, 60) & canonical.LocationContains("new")
+        pages, cursor = [], None
+        while True:
+            page, cursor = self.manager.query(query, cursor=cursor, limit=37)
+            self.assertLessEqual(len(page), 37)
+            pages.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(pages, self.expected(query))
+
+        with self.assertRaises(ValueError):
+            self.manager.query(query, limit=0)
+
+    def test_planner_drives_from_most_selective_index(self):
+        """Test that the smallest index estimate drives a conjunction."""
+        manager = canonical.UserProfileManager()
+        for i in range(50):
+            manager.create_profile(f"user{i}", f"user{i}@example.com", 30, location="Paris")
+        manager.create_profile("rare", "rare@rare.test", 30, location="Paris")
+
+        query = canonical.AgeRange(30) & canonical.LocationContains("par") & canonical.EmailDomain("rare.test")
+        self.assertTrue(manager.explain(query).startswith("(index EmailDomain('rare.test') ~1;"))
+        self.assertEqual(manager.query(query), (["rare"], None))
+
+    def test_invalid_query(self):
+        """Test that malformed terms are rejected before running."""
+        with self.assertRaises(ValueError):
+            self.manager.iter_query(canonical.AgeRange(40, 30))
+        with self.assertRaises(ValueError):
+            self.manager.query(canonical.EmailDomain("no-dot"))
+
+    def test_invalid_combinators(self):
+        """Test that And and Or reject empty and non-query parts up front."""
+        for combinator in (canonical.And, canonical.Or):
+            with self.assertRaises(ValueError):
+                combinator()
+            with self.assertRaises(TypeError):
+                combinator(canonical.AgeRange(30), "age > 30")
+        single = canonical.And(canonical.AgeRange(30, 40))
+        self.assertEqual(list(self.manager.iter_query(single)), self.expected(single))
+
+
+class StoreContract:
+    """Checks shared by every ProfileStore, run against the dict-backed manager."""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.reference = canonical.UserProfileManager()
+        self.manager = canonical.UserProfileManager(store=self.make_store())
+        for manager in (self.reference, self.manager):
+            rng = populate(manager, 1500)
+            for username in rng.sample(sorted(manager.profiles), 400):
+                manager.update_profile(username, email=f"new@{rng.choice(DOMAINS)}",
+                                       age=rng.randint(13, 120), bio="b" * rng.randrange(50),
+                                       location=rng.choice(LOCATIONS + ["Zürich"]))
+
+    def test_matches_dict_backed_manager(self):
+        """Test profiles, searches and queries against the default manager."""
+        for key in self.reference.profiles:
+            self.assertEqual(dict(self.manager.get_profile(key)), self.reference.get_profile(key))
+        self.assertIsNone(self.manager.get_profile("nobody"))
+
+        backends = [None, canonical.np] if canonical.np is not None else [None]
+        for backend in backends:
+            with mock.patch.object(canonical, 'np', backend):
+                for min_age, max_age in ((13, None), (60, 70), (0, 500), (121, None), (50, 40)):
+                    self.assertEqual(self.manager.search_by_age(min_age, max_age),
+                                     self.reference.search_by_age(min_age, max_age))
+                for location in ("new", "ZÜR", "", "nowhere"):
+                    self.assertEqual(self.manager.search_by_location(location),
+                                     self.reference.search_by_location(location))
+
+        query = canonical.AgeRange(20, 80) & canonical.EmailDomain("mail.test")
+        self.assertEqual(self.manager.query(query, limit=10), self.reference.query(query, limit=10))
+
+    def test_unicode_usernames_fold(self):
+        """Test that usernames match after NFKC and casefold, not just lower()."""
+        for manager in (self.reference, self.manager):
+            self.assertTrue(manager.create_profile("Straße", "s@example.com", 30))
+            self.assertFalse(manager.create_profile("STRASSE", "t@example.com", 31))
+            self.assertTrue(manager.update_profile("ｓｔｒａｓｓｅ", age=40))
+            self.assertEqual(manager.get_profile("strasse")['age'], 40)
+            self.assertEqual(manager.get_profile("STRASSE")['username'], "Straße")
+
+    def test_delete_keeps_other_profiles(self):
+        """Test that deleting profiles leaves the remaining ones intact."""
+        store = self.manager.profiles
+        expected = {key: dict(store[key]) for key in store}
+        for key in sorted(expected)[::3]:
+            del store[key]
+            del expected[key]
+        self.assertEqual({key: dict(store[key]) for key in store}, expected)
+        self.assertEqual(len(store), len(expected))
+        with self.assertRaises(KeyError):
+            del store["nobody"]
+
+
+class TestColumnarProfiles(StoreContract, unittest.TestCase):
+    """Test suite for the columnar profile store."""
+
+    def make_store(self):
+        return canonical.ColumnarProfiles()
+
+    def test_view_writes_through(self):
+        """Test that a profile view is live and writes back to the columns."""
+        self.manager.create_profile("Alice", "alice@example.com", 30, bio="hi", location="Oslo")
+        profile = self.manager.get_profile("alice")
+        self.manager.update_profile("alice", bio="updated")
+        self.assertEqual(profile['bio'], "updated")
+        profile['location'] = "Bergen"
+        self.assertIn("Alice", self.manager.search_by_location("berg"))
+        self.assertEqual(self.manager.generate_summary("ALICE"),
+                         "Alice (30): alice@example.com - updated")
+
+    def test_arena_compacts(self):
+        """Test that rewriting strings does not grow the arena without bound."""
+        arena = canonical.StringArena()
+        arena.append("")
+        for i in range(5000):
+            arena[0] = f"value {i}"
+        self.assertEqual(arena[0], "value 4999")
+        self.assertLess(arena.nbytes(), 10000)
+
+
+class TestSQLiteProfileStore(StoreContract, unittest.TestCase):
+    """Test suite for the SQLite profile store."""
+
+    def make_store(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "profiles.db")
+        self.stores = [canonical.SQLiteProfileStore(self.path)]
+        return self.stores[0]
+
+    def open_store(self, **kwargs):
+        store = canonical.SQLiteProfileStore(self.path, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_survives_reopen(self):
+        """Test that profiles persist and stay unique across managers."""
+        self.manager.create_profile("Alice", "alice@example.com", 30, bio="Rock climber",
+                                    location="Oslo")
+        reopened = canonical.UserProfileManager(store=self.open_store())
+
+        self.assertEqual(reopened.get_profile("ALICE"),
+                         {'username': "Alice", 'email': "alice@example.com", 'age': 30,
+                          'bio': "Rock climber", 'location': "Oslo"})
+        self.assertFalse(reopened.create_profile("alice", "other@example.com", 40))
+        self.assertEqual(reopened.store.search_by_bio("CLIMB"), ["Alice"])
+        self.assertEqual(reopened.search_by_location("sl"), ["Alice"])
+
+    def test_update_after_other_connection_deletes(self):
+        """Test that updating a profile deleted elsewhere returns False."""
+        self.manager.create_profile("Alice", "alice@example.com", 30)
+        self.assertEqual(self.manager.get_profile("alice")['age'], 30)
+        other = self.open_store()
+        del other["alice"]
+
+        self.assertFalse(self.manager.update_profile("Alice", age=31))
+        self.assertIsNone(self.manager.get_profile("alice"))
+        self.assertNotIn("alice", other)
+
+    def test_cache_sees_other_writers(self):
+        """Test that a cached profile is refreshed after another connection writes."""
+        self.manager.create_profile("Alice", "alice@example.com", 30)
+        other = canonical.UserProfileManager(store=self.open_store(max_staleness=0))
+        self.assertEqual(other.get_profile("alice")['age'], 30)
+
+        self.manager.update_profile("alice", age=31)
+        self.assertEqual(other.get_profile("alice")['age'], 31)
+
+    def test_cache_staleness_is_bounded_by_interval(self):
+        """Test that other writers are checked for once per interval and per batch."""
+        self.manager.create_profile("Alice", "alice@example.com", 30)
+        store = self.open_store(max_staleness=3600)
+        other = canonical.UserProfileManager(store=store)
+        self.assertEqual(other.get_profile("alice")['age'], 30)
+
+        self.manager.update_profile("alice", age=31)
+        self.assertEqual(other.get_profile("alice")['age'], 30)
+        with store.batch():
+            self.assertEqual(other.get_profile("alice")['age'], 31)
+        store.max_staleness = 0
+        self.manager.update_profile("alice", age=32)
+        self.assertEqual(other.get_profile("alice")['age'], 32)
+
+    def test_batch_rolls_back(self):
+        """Test that a failed batch leaves neither rows nor cached profiles."""
+        store = self.manager.store
+        with store.batch():
+            self.manager.create_profile("Alice", "alice@example.com", 30)
+        with self.assertRaises(RuntimeError):
+            with store.batch():
+                self.manager.create_profile("Bobby", "bobby@example.com", 40)
+                self.manager.update_profile("alice", age=99)
+                raise RuntimeError("abort")
+
+        self.assertIsNone(self.manager.get_profile("bobby"))
+        self.assertEqual(self.manager.get_profile("alice")['age'], 30)
+        self.assertNotIn("Alice", self.open_store().search_by_age(99))
+
+
+if __name__ == '__main__':
+    unittest.main()